@@ -0,0 +1,172 @@
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request ran out of time or was cancelled (e.g. its client went away)"""
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; retry_after is the suggested wait in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Deadline:
+    """Time budget of one request, and the cursors currently running on its behalf
+
+    cancel() (called by the watchdog when the budget runs out, or when the client
+    disconnects) stops every attached cursor with cursor.cancel(), which pyodbc
+    sends to SQL Server as an attention signal from any thread.
+    """
+
+    def __init__(self, seconds=None):
+        self.expires = time.monotonic() + seconds if seconds else None
+        self.cancelled = None  # reason, once cancelled
+        self._cursors = set()
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds left (None = no limit)"""
+        if self.expires is None:
+            return None
+        return self.expires - time.monotonic()
+
+    def check(self):
+        """Raise DeadlineExceeded if the request should stop"""
+        if self.cancelled is None:
+            remaining = self.remaining()
+            if remaining is None or remaining > 0:
+                return
+            self.cancel('deadline exceeded')
+        raise DeadlineExceeded(f"Request cancelled: {self.cancelled}")
+
+    def attach(self, cursor):
+        with self._lock:
+            if self.cancelled is None:
+                self._cursors.add(cursor)
+                return
+        cursor.cancel()
+
+    def detach(self, cursor):
+        with self._lock:
+            self._cursors.discard(cursor)
+
+    def cancel(self, reason):
+        with self._lock:
+            if self.cancelled is not None:
+                return
+            self.cancelled = reason
+            cursors = list(self._cursors)
+        for cursor in cursors:
+            try:
+                cursor.cancel()
+            except Exception as e:
+                print(f"Error cancelling query: {e}")
+
+
+current_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+class DeadlineWatchdog:
+    """Background thread that cancels requests whose deadline has passed"""
+
+    def __init__(self):
+        self._heap = []  # (expires, sequence, deadline)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._counters = {'watched': 0, 'expired': 0}
+
+    def watch(self, deadline):
+        if deadline.expires is None:
+            return
+        with self._condition:
+            heapq.heappush(self._heap, (deadline.expires, next(self._sequence), deadline))
+            self._counters['watched'] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='deadline-watchdog', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def finish(self, deadline):
+        """The request is done; stop watching it"""
+        deadline.expires = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                expires, _, deadline = self._heap[0]
+                delay = expires - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            if deadline.expires is not None and deadline.cancelled is None:
+                self._counters['expired'] += 1
+                deadline.cancel('deadline exceeded')
+
+    def stats(self):
+        with self._condition:
+            return {'watching': len(self._heap), **self._counters}
+
+
+class AdmissionController:
+    """Bound the number of expensive requests running at once, with a bounded wait queue
+
+    Up to max_concurrent requests run; up to max_queue more wait (at most
+    queue_timeout seconds) for one of them to finish. Anything beyond that is
+    refused with Overloaded, so a burst is shed before it reaches the database.
+    """
+
+    def __init__(self, max_concurrent=8, max_queue=32, queue_timeout=10, retry_after=5):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._running = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self._counters = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0}
+
+    def acquire(self, timeout=None):
+        """Wait for a slot (up to queue_timeout, or timeout if shorter); raises Overloaded"""
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        with self._condition:
+            if self._running >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    self._counters['rejected'] += 1
+                    raise Overloaded('Too many queries are running, retry shortly', self.retry_after)
+                self._waiting += 1
+                self._counters['queued'] += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self._running < self.max_concurrent, max(timeout, 0))
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    self._counters['timed_out'] += 1
+                    raise Overloaded('Timed out waiting for a query slot, retry shortly', self.retry_after)
+            self._running += 1
+            self._counters['admitted'] += 1
+
+    def release(self):
+        with self._condition:
+            self._running -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'running': self._running,
+                'waiting': self._waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                **self._counters
+            }
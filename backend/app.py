@@ -1,8 +1,54 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import pyodbc
 from dotenv import load_dotenv
 import os
+import json
+import hashlib
+import math
+import time
+from functools import partial
+
+try:
+    import orjson
+except ImportError:  # Optional: responses are serialized with the standard json module without it
+    orjson = None
+
+from db_pool import ConnectionPool, PoolTimeout
+import standin_db
+from schema_catalog import SchemaCatalog
+from result_cache import ResultCache, filter_cache_key
+from table_versions import TableVersionTracker
+from change_tracking import ChangeTracker
+from query_executor import QueryExecutor, QueryTimeout
+from timepoint_index import (
+    GENDER_F, GENDER_M, GENDER_NULL, GENDER_O, TimepointIndex, fetch_rows, gender_code, pid_array, pid_chunks
+)
+from columnar_engine import ColumnarEngine
+from baseline_counts import BaselineCounts
+from filter_spec import canonical_filter_spec, select_tables
+from query_compiler import (
+    compile_baseline_delta_query, compile_baseline_pid_query, compile_export_queries, compile_filter_query,
+    compile_pid_query, compile_sweep_query, compile_thresholds, compile_wave_query
+)
+from participants_dimension import ParticipantsDimension
+from data_export import EXPORT_FORMATS, stream_export
+from single_flight import SingleFlight
+from variable_stats import VariableStatistics
+from threshold_sweep import SWEEP_OPERATORS, sweep_qualifying
+from wave_breakdown import wave_qualifying
+from index_advisor import DIALECTS, FilterWorkload, profile_workload, recommend
+from admission_control import (
+    AdmissionController, Deadline, DeadlineExceeded, DeadlineWatchdog, Overloaded, current_deadline
+)
+from slow_query_log import SlowQueryLog
+from snapshot_store import SnapshotStore
+from study_years import parse_years, participants_table, study_mapping, union_participants
+import compression
+from metrics import MetricsRegistry, RequestTimer, TimedCursor, current_labels, current_timer, query_labels, span
+import numpy as np
+from cohort_algebra import COHORTS, evaluate, parse_combine, pid_set, referenced_filters
 
 # Load environment variables
 load_dotenv()
@@ -10,43 +56,139 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)  # This will enable CORS for all routes
 
+# Study years: each year's data is in its own tables, named with the year (participants_2025,
+# participants_2026, ...). Requests without a "years" selector use DEFAULT_STUDY_YEAR (the latest by default)
+STUDY_YEARS = sorted({int(year) for year in os.getenv('STUDY_YEARS', '2025').split(',') if year.strip()})
+DEFAULT_STUDY_YEAR = int(os.getenv('DEFAULT_STUDY_YEAR') or STUDY_YEARS[-1])
+PARTICIPANTS_TABLE_PATTERN = 'participants_{year}'
+PARTICIPANTS_TABLE = participants_table(PARTICIPANTS_TABLE_PATTERN, DEFAULT_STUDY_YEAR)
+
 # Database configuration
-PARTICIPANTS_TABLE = 'participants_2025'  # Define participants table name as a constant
 
 DB_CONFIG = {
     'SERVER': os.getenv('DB_SERVER'),
     'DATABASE': os.getenv('DB_DATABASE'),
     'USERNAME': os.getenv('DB_USERNAME'),
     'PASSWORD': os.getenv('DB_PASSWORD'),
-    'DRIVER': os.getenv('DB_DRIVER', 'ODBC Driver 17 for SQL Server')
+    'DRIVER': os.getenv('DB_DRIVER', 'ODBC Driver 17 for SQL Server'),
+    'STANDIN_PATH': os.getenv('DB_STANDIN_PATH')  # SQLite file used instead of SQL Server (benchmarks, local testing)
+}
+
+# Connection pool sizing (see /pool-stats to tune)
+POOL_CONFIG = {
+    'MIN_SIZE': int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+    'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+    'IDLE_TIMEOUT': float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),  # seconds before surplus idle connections close
+    'CHECKOUT_TIMEOUT': float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', 30)),  # seconds to wait for a free connection
+    'PING_INTERVAL': float(os.getenv('DB_POOL_PING_INTERVAL', 5))  # idle seconds before a checkout re-checks liveness
+}
+
+SCHEMA_CHECK_INTERVAL = float(os.getenv('SCHEMA_CHECK_INTERVAL', 300))  # seconds between schema version checks
+
+# /query-data result cache
+RESULT_CACHE_CONFIG = {
+    'MAX_ENTRIES': int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 1000)),
+    'MAX_BYTES': int(os.getenv('RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    'TTL': float(os.getenv('RESULT_CACHE_TTL', 600)),  # seconds
+    'VERSION_POLL_INTERVAL': float(os.getenv('DATA_VERSION_POLL_INTERVAL', 30))  # seconds between data change checks
+}
+
+# Column stamped on insert and update, used to narrow data changes down to the affected participants
+CHANGE_TRACKING_COLUMN = os.getenv('CHANGE_TRACKING_COLUMN', 'modified_at')
+
+# Concurrent query execution inside /query-data
+QUERY_CONCURRENCY = {
+    'MAX_WORKERS': int(os.getenv('QUERY_MAX_WORKERS', 8)),  # database queries in flight per process
+    'PER_REQUEST': int(os.getenv('QUERY_MAX_PARALLEL_PER_REQUEST', 4)),  # queries in flight per request
+    'TIMEOUT': int(os.getenv('QUERY_TIMEOUT', 60))  # seconds per query (0 = no limit)
+}
+
+# In-memory timepoint bitmap index for timepoint/cohort-only questions
+TIMEPOINT_INDEX_ENABLED = os.getenv('TIMEPOINT_INDEX_ENABLED', 'true').lower() == 'true'
+TIMEPOINT_INDEX_MAX_AGE = float(os.getenv('TIMEPOINT_INDEX_MAX_AGE', 3600))  # seconds before a scheduled rebuild
+
+# Execution engine for filtered counts: 'sql' or 'columnar' (in-process NumPy snapshots);
+# requests can override it with "engine" in the body
+QUERY_ENGINE = os.getenv('QUERY_ENGINE', 'sql').lower()
+COLUMNAR_SNAPSHOT_MAX_AGE = float(os.getenv('COLUMNAR_SNAPSHOT_MAX_AGE', 3600))  # seconds before a reload
+
+BASELINE_REFRESH_INTERVAL = float(os.getenv('BASELINE_REFRESH_INTERVAL', 900))  # seconds between recomputes
+
+VARIABLE_STATS_MAX_AGE = float(os.getenv('VARIABLE_STATS_MAX_AGE', 86400))  # seconds before histograms are rebuilt
+
+SWEEP_MAX_CELLS = int(os.getenv('SWEEP_MAX_CELLS', 2500))  # cutoffs (or grid cells) per /query-sweep request
+
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', 5000))  # rows per fetchmany batch in /export-data
+
+# In-memory pid -> gender lookup used for gender breakdowns instead of SQL CASE expressions
+PARTICIPANTS_DIMENSION_ENABLED = os.getenv('PARTICIPANTS_DIMENSION_ENABLED', 'true').lower() == 'true'
+PARTICIPANTS_DIMENSION_MAX_AGE = float(os.getenv('PARTICIPANTS_DIMENSION_MAX_AGE', 3600))  # seconds before a full reload
+
+# Slow-query log: per-fingerprint query stats, plus queries slower than the threshold (see /slow-queries)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 1000))
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', 200))  # slow executions kept
+SLOW_QUERY_CAPTURE_PLANS = os.getenv('SLOW_QUERY_CAPTURE_PLANS', 'false').lower() == 'true'  # estimated plans
+
+# Deadlines and admission control for the query routes: each request gets REQUEST_DEADLINE seconds (a
+# "timeout" in the body can lower it) after which its running statements are cancelled, and at most
+# ADMISSION_MAX_CONCURRENT run at once with ADMISSION_MAX_QUEUE more waiting; the rest get 503
+REQUEST_LIMITS = {
+    'DEADLINE': float(os.getenv('REQUEST_DEADLINE', 120)),  # seconds (0 = no deadline)
+    'MAX_CONCURRENT': int(os.getenv('ADMISSION_MAX_CONCURRENT', 8)),
+    'MAX_QUEUE': int(os.getenv('ADMISSION_MAX_QUEUE', 32)),
+    'QUEUE_TIMEOUT': float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10)),  # seconds a queued request waits for a slot
+    'RETRY_AFTER': int(os.getenv('ADMISSION_RETRY_AFTER', 5)),  # seconds, sent with 503 responses
+    # /export-data has its own, lower limit: each export holds a connection for as long as it streams
+    'EXPORT_MAX_CONCURRENT': int(os.getenv('EXPORT_MAX_CONCURRENT', 2)),
+    'EXPORT_MAX_QUEUE': int(os.getenv('EXPORT_MAX_QUEUE', 4))
 }
+LIMITED_ENDPOINTS = {'query_data', 'query_sweep', 'query_waves', 'export_data'}
 
-# Modality to table mapping 
-MODALITY_MAPPING = {
+# On-disk snapshots of the timepoint index, column snapshots and participant maps, memory-mapped by every
+# worker process (shared RAM, fast restarts); unset to keep private in-memory copies per process
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR') or None
+SNAPSHOT_KEEP_VERSIONS = int(os.getenv('SNAPSHOT_KEEP_VERSIONS', 2))  # published versions kept per snapshot
+
+# HTTP caching and compression: /get-modalities and /get-variables carry an ETag derived from the schema
+# version (If-None-Match gets 304) and may be reused by the browser for HTTP_CACHE_MAX_AGE seconds before
+# revalidating; JSON/text responses of at least COMPRESS_MIN_BYTES are sent with br or gzip when accepted
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 60))
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))  # 0 disables compression
+
+# Filter shapes that reached SQL, for /index-advisor; set a path to also append them to a file for the CLI
+FILTER_WORKLOAD_LOG = os.getenv('FILTER_WORKLOAD_LOG') or None
+
+# Modality to table mapping; {year} is replaced by the study year. Add 'years': [...] to a modality
+# that only exists in some of the STUDY_YEARS
+MODALITY_TABLES = {
     'Diet_Data_Totals': {
         'tables': [
-            {'name': 'asa24_children_totals_2025', 'type': 'children', "gender_column": ""},
-            {'name': 'asa24_parents_totals_2025', 'type': 'adults', "gender_column": ""}
+            {'name': 'asa24_children_totals_{year}', 'type': 'children', "gender_column": ""},
+            {'name': 'asa24_parents_totals_{year}', 'type': 'adults', "gender_column": ""}
         ]
     },
     'Qualtrics_Data': {
         'tables': [
-            {'name': 'qualtrics_children_data_2025', 'type': 'children', "gender_column": "gender"},
-            # {'name': 'qualtrics_children_data_2025_coded', 'type': 'child', "gender_column": "gender"},
-            {'name': 'qualtrics_parent_data_2025', 'type': 'adults', "gender_column": "gender_v2"}
-            # {'name': 'qualtrics_parent_data_2025_coded', 'type': 'parent', "gender_column": "gender_v2"}
+            {'name': 'qualtrics_children_data_{year}', 'type': 'children', "gender_column": "gender"},
+            # {'name': 'qualtrics_children_data_{year}_coded', 'type': 'child', "gender_column": "gender"},
+            {'name': 'qualtrics_parent_data_{year}', 'type': 'adults', "gender_column": "gender_v2"}
+            # {'name': 'qualtrics_parent_data_{year}_coded', 'type': 'parent', "gender_column": "gender_v2"}
         ]
     },
     'Demographic_Data': {
         'tables': [
-            {'name': 'child_demographics_2025', 'type': 'children', "gender_column": "gender"},
-            {'name': 'parent_demographics_2025', 'type': 'adults', "gender_column": "gender_v2"}
+            {'name': 'child_demographics_{year}', 'type': 'children', "gender_column": "gender"},
+            {'name': 'parent_demographics_{year}', 'type': 'adults', "gender_column": "gender_v2"}
         ]
     }
 }
+YEAR_MAPPINGS = {year: study_mapping(MODALITY_TABLES, year) for year in STUDY_YEARS}
+MODALITY_MAPPING = YEAR_MAPPINGS.get(DEFAULT_STUDY_YEAR) or study_mapping(MODALITY_TABLES, DEFAULT_STUDY_YEAR)
 
-def get_db_connection():
-    """Create and return a database connection"""
+def _connect():
+    """Open a new physical database connection"""
+    if DB_CONFIG['STANDIN_PATH']:
+        return standin_db.connect(DB_CONFIG['STANDIN_PATH'])
     conn_str = (
         f"DRIVER={{{DB_CONFIG['DRIVER']}}};"
         f"SERVER={DB_CONFIG['SERVER']};"
@@ -54,12 +196,205 @@ def get_db_connection():
         f"UID={DB_CONFIG['USERNAME']};"
         f"PWD={DB_CONFIG['PASSWORD']};"
     )
+    return pyodbc.connect(conn_str)
+
+# Instrumentation: per-request phase timings (Server-Timing header) and Prometheus metrics at /metrics
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'Request latency by route', ('route', 'method', 'status')
+)
+phase_seconds = metrics.histogram(
+    'http_request_phase_seconds', 'Time per request spent connecting, executing, fetching and serializing',
+    ('route', 'phase')
+)
+query_seconds = metrics.histogram(
+    'db_query_duration_seconds', 'Duration of each execute/fetch call', ('route', 'modality', 'table', 'phase')
+)
+connect_seconds = metrics.histogram('db_connect_duration_seconds', 'Time to check out a connection', ('route',))
+request_errors = metrics.counter('http_request_errors_total', 'Responses with a 5xx status', ('route', 'status'))
+query_errors = metrics.counter('db_query_errors_total', 'Failed execute/fetch calls', ('route', 'modality', 'table'))
+connect_errors = metrics.counter('db_connect_errors_total', 'Failed connection checkouts', ('route',))
+requests_in_flight = metrics.gauge('http_requests_in_flight', 'Requests being handled', ('route',))
+
+def _route_label():
+    timer = current_timer.get()
+    return timer.route if timer is not None else 'background'
+
+def _record_query_time(phase, seconds):
+    labels = current_labels.get()
+    query_seconds.observe(
+        seconds, route=_route_label(), modality=labels.get('modality', ''), table=labels.get('table', ''), phase=phase
+    )
+
+def _record_query_error(phase):
+    labels = current_labels.get()
+    query_errors.inc(route=_route_label(), modality=labels.get('modality', ''), table=labels.get('table', ''))
+
+def _record_statement(sql, params, seconds, rows, error):
+    slow_queries.record(sql, params, seconds, rows, {'route': _route_label(), **current_labels.get()}, error)
+
+db_pool = ConnectionPool(
+    _connect,
+    min_size=POOL_CONFIG['MIN_SIZE'],
+    max_size=POOL_CONFIG['MAX_SIZE'],
+    idle_timeout=POOL_CONFIG['IDLE_TIMEOUT'],
+    checkout_timeout=POOL_CONFIG['CHECKOUT_TIMEOUT'],
+    ping_interval=POOL_CONFIG['PING_INTERVAL'],
+    wrap_cursor=lambda cursor: TimedCursor(cursor, _record_query_time, _record_query_error, _record_statement)
+)
+db_pool.warm_in_background()
+
+def get_db_connection():
+    """Check out a pooled database connection (close() returns it to the pool)"""
+    started = time.perf_counter()
     try:
-        conn = pyodbc.connect(conn_str)
-        return conn
-    except pyodbc.Error as e:
+        with span('connect'):
+            return db_pool.acquire()
+    except (pyodbc.Error, PoolTimeout) as e:
         print(f"Error connecting to database: {e}")
+        connect_errors.inc(route=_route_label())
         return None
+    finally:
+        connect_seconds.observe(time.perf_counter() - started, route=_route_label())
+
+slow_queries = SlowQueryLog(
+    get_db_connection,
+    threshold_ms=SLOW_QUERY_THRESHOLD_MS,
+    max_entries=SLOW_QUERY_LOG_SIZE,
+    capture_plans=SLOW_QUERY_CAPTURE_PLANS
+)
+
+ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that counts serialization time as the request's 'serialize' phase
+
+    Serializes with orjson when it is installed (same sorted keys and default() for
+    types JSON does not know), falling back to the standard encoder for anything
+    orjson rejects, e.g. integers beyond 64 bits.
+    """
+
+    def dumps(self, obj, **kwargs):
+        with span('serialize'):
+            if orjson is not None:
+                option = ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if kwargs.get('indent') else 0)
+                try:
+                    return orjson.dumps(obj, default=self.default, option=option).decode()
+                except TypeError:
+                    pass
+            return super().dumps(obj, **kwargs)
+
+app.json = TimedJSONProvider(app)
+
+@app.before_request
+def start_request_timer():
+    timer = RequestTimer(request.url_rule.rule if request.url_rule else 'unmatched')
+    g.timer_token = current_timer.set(timer)
+    requests_in_flight.inc(route=timer.route)
+
+@app.before_request
+def admit_request():
+    """Give query requests a deadline and wait for an admission slot (503 when overloaded)"""
+    if request.endpoint not in LIMITED_ENDPOINTS:
+        return None
+    if request.endpoint == 'export_data':
+        # Exports outlive the request: no deadline, and export_data holds the slot until the stream closes
+        controller, timeout = export_admission, None
+    else:
+        seconds = REQUEST_LIMITS['DEADLINE'] or None
+        body = request.get_json(silent=True)
+        requested = body.get('timeout') if isinstance(body, dict) else None
+        if isinstance(requested, (int, float)) and not isinstance(requested, bool) and requested > 0:
+            seconds = min(seconds, requested) if seconds else requested
+        deadline = Deadline(seconds)
+        g.deadline_token = current_deadline.set(deadline)
+        request.environ['databaseapp.deadline'] = deadline  # The ASGI bridge cancels it when the client disconnects
+        deadline_watchdog.watch(deadline)
+        controller, timeout = admission, deadline.remaining()
+    try:
+        with span('queue'):
+            controller.acquire(timeout)
+    except Overloaded as e:
+        response = jsonify({'status': 'error', 'message': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    g.admitted = controller
+    return None
+
+def _deadline_response(e):
+    return jsonify({'status': 'error', 'message': str(e)}), 504
+
+def _genders_unavailable_response():
+    """503 while the participant gender maps could not be refreshed; the client retries once they are back"""
+    response = jsonify({'status': 'error', 'message': 'Participant genders are not available'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(REQUEST_LIMITS['RETRY_AFTER'])
+    return response
+
+@app.after_request
+def record_request_timing(response):
+    timer = current_timer.get()
+    if timer is None:
+        return response
+    response.headers['Server-Timing'] = timer.server_timing()
+    request_seconds.observe(
+        time.perf_counter() - timer.started, route=timer.route, method=request.method, status=response.status_code
+    )
+    for phase, (seconds, _) in list(timer.spans.items()):
+        phase_seconds.observe(seconds, route=timer.route, phase=phase)
+    if response.status_code >= 500:
+        request_errors.inc(route=timer.route, status=response.status_code)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compress JSON/text responses with the best encoding the client accepts (timed as 'compress')"""
+    if not COMPRESS_MIN_BYTES or not compression.compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = compression.negotiate(request.accept_encodings)
+    if encoding is None or response.calculate_content_length() < COMPRESS_MIN_BYTES:
+        return response
+    with span('compress'):
+        response.set_data(compression.compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def _etag(*parts):
+    """ETag for a response determined by parts (names and the schema/data versions it was built from)"""
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:20]
+
+def _cacheable(response, etag):
+    """Mark a response revalidatable by ETag; weak so it holds for every Content-Encoding"""
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.max_age = HTTP_CACHE_MAX_AGE
+    if not HTTP_CACHE_MAX_AGE:
+        response.cache_control.no_cache = True
+    return response
+
+def _not_modified(etag):
+    """304 response if the client's If-None-Match still matches etag, else None"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return _cacheable(app.response_class(status=304), etag)
+
+@app.teardown_request
+def finish_request_timer(exc):
+    admitted = g.pop('admitted', None)
+    if admitted is not None:
+        admitted.release()
+    deadline_token = g.pop('deadline_token', None)
+    if deadline_token is not None:
+        deadline_watchdog.finish(current_deadline.get())
+        current_deadline.reset(deadline_token)
+    timer = current_timer.get()
+    if timer is not None:
+        requests_in_flight.dec(route=timer.route)
+    token = g.pop('timer_token', None)
+    if token is not None:
+        current_timer.reset(token)
 
 @app.route('/')
 def home():
@@ -69,10 +404,12 @@ def home():
 def get_modalities():
     """Get all available modalities"""
     try:
-        return jsonify({
+        modalities = list(MODALITY_MAPPING.keys())
+        etag = _etag('modalities', modalities)
+        return _not_modified(etag) or _cacheable(jsonify({
             'status': 'success',
-            'modalities': list(MODALITY_MAPPING.keys())
-        })
+            'modalities': modalities
+        }), etag)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -119,6 +456,121 @@ def get_operators_for_type(data_type):
             {'value': 'IS NOT NULL', 'label': 'is not empty'}
         ]
 
+schema_catalog = SchemaCatalog(
+    get_db_connection,
+    MODALITY_MAPPING,
+    get_operators_for_type,
+    check_interval=SCHEMA_CHECK_INTERVAL
+)
+schema_catalog.warm()
+
+variable_statistics = VariableStatistics(
+    get_db_connection,
+    schema_catalog,
+    max_age=VARIABLE_STATS_MAX_AGE
+)
+
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_CONFIG['MAX_ENTRIES'],
+    max_bytes=RESULT_CACHE_CONFIG['MAX_BYTES'],
+    ttl=RESULT_CACHE_CONFIG['TTL']
+)
+# Tables of every study year (the default year's first), watched for data changes
+STUDY_TABLES = list(dict.fromkeys(
+    [t['name'] for m in MODALITY_MAPPING.values() for t in m['tables']] + [PARTICIPANTS_TABLE] + [
+        name
+        for year, mapping in YEAR_MAPPINGS.items()
+        for name in [t['name'] for m in mapping.values() for t in m['tables']] +
+        [participants_table(PARTICIPANTS_TABLE_PATTERN, year)]
+    ]
+))
+table_versions = TableVersionTracker(
+    get_db_connection,
+    STUDY_TABLES,
+    poll_interval=RESULT_CACHE_CONFIG['VERSION_POLL_INTERVAL']
+)
+# Catalog changes are narrowed down to the affected pids before the components below see them
+change_tracker = ChangeTracker(
+    get_db_connection,
+    STUDY_TABLES,
+    watermark_column=CHANGE_TRACKING_COLUMN,
+    poll_interval=RESULT_CACHE_CONFIG['VERSION_POLL_INTERVAL']
+)
+table_versions.add_listener(change_tracker.tables_changed)
+change_tracker.add_listener(result_cache.apply_changes)
+change_tracker.add_listener(variable_statistics.invalidate)
+
+snapshot_store = None
+if SNAPSHOT_DIR:
+    snapshot_store = SnapshotStore(SNAPSHOT_DIR, data_version=table_versions.token, keep=SNAPSHOT_KEEP_VERSIONS)
+
+timepoint_index = TimepointIndex(
+    get_db_connection,
+    MODALITY_MAPPING,
+    PARTICIPANTS_TABLE,
+    max_age=TIMEPOINT_INDEX_MAX_AGE,
+    store=snapshot_store
+)
+change_tracker.add_listener(timepoint_index.apply_changes)
+if TIMEPOINT_INDEX_ENABLED:
+    timepoint_index.check()
+
+columnar_engine = ColumnarEngine(
+    get_db_connection,
+    MODALITY_MAPPING,
+    PARTICIPANTS_TABLE,
+    max_age=COLUMNAR_SNAPSHOT_MAX_AGE,
+    store=snapshot_store
+)
+change_tracker.add_listener(columnar_engine.invalidate)
+if QUERY_ENGINE == 'columnar':
+    columnar_engine.check()
+
+participants_dimension = ParticipantsDimension(
+    get_db_connection,
+    MODALITY_MAPPING,
+    PARTICIPANTS_TABLE,
+    max_age=PARTICIPANTS_DIMENSION_MAX_AGE,
+    store=snapshot_store
+)
+change_tracker.add_listener(participants_dimension.invalidate)
+if PARTICIPANTS_DIMENSION_ENABLED:
+    participants_dimension.check()
+
+# Gender maps of the other study years, for queries with a "years" selector; loaded on first use and
+# kept in process (snapshots are only shared for the default year)
+year_dimensions = {DEFAULT_STUDY_YEAR: participants_dimension}
+for year in STUDY_YEARS:
+    if year != DEFAULT_STUDY_YEAR:
+        year_dimensions[year] = ParticipantsDimension(
+            get_db_connection,
+            YEAR_MAPPINGS[year],
+            participants_table(PARTICIPANTS_TABLE_PATTERN, year),
+            max_age=PARTICIPANTS_DIMENSION_MAX_AGE
+        )
+        change_tracker.add_listener(year_dimensions[year].invalidate)
+
+query_executor = QueryExecutor(
+    max_workers=QUERY_CONCURRENCY['MAX_WORKERS'],
+    per_request=QUERY_CONCURRENCY['PER_REQUEST'],
+    timeout=QUERY_CONCURRENCY['TIMEOUT']
+)
+query_flights = SingleFlight()  # identical queries in flight across requests run once
+filter_workload = FilterWorkload(FILTER_WORKLOAD_LOG)
+admission = AdmissionController(
+    max_concurrent=REQUEST_LIMITS['MAX_CONCURRENT'],
+    max_queue=REQUEST_LIMITS['MAX_QUEUE'],
+    queue_timeout=REQUEST_LIMITS['QUEUE_TIMEOUT'],
+    retry_after=REQUEST_LIMITS['RETRY_AFTER']
+)
+export_admission = AdmissionController(
+    max_concurrent=REQUEST_LIMITS['EXPORT_MAX_CONCURRENT'],
+    max_queue=REQUEST_LIMITS['EXPORT_MAX_QUEUE'],
+    queue_timeout=REQUEST_LIMITS['QUEUE_TIMEOUT'],
+    retry_after=REQUEST_LIMITS['RETRY_AFTER']
+)
+deadline_watchdog = DeadlineWatchdog()
+
 @app.route('/get-variables/<modality>/<cohort_type>')
 def get_variables(modality, cohort_type):
     """Get variables for a specific modality and cohort type"""
@@ -135,47 +587,86 @@ def get_variables(modality, cohort_type):
         if not tables:
             return jsonify({'status': 'error', 'message': f'No tables found for {cohort_type} cohort'}), 404
 
-        # Get database connection
-        conn = get_db_connection()
-        if not conn:
+        schema_version = schema_catalog.version()
+        etag = _etag('variables', modality, cohort_type, schema_version) if schema_version else None
+        if etag is not None:
+            not_modified = _not_modified(etag)
+            if not_modified is not None:
+                return not_modified
+
+        variables = schema_catalog.variables(modality, cohort_type)
+        if variables is None:
             return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
 
-        cursor = conn.cursor()
-        
-        # Get column names and types from all relevant tables
-        variables = {}
-        for table in tables:
-            try:
-                cursor.execute(f"SELECT TOP 0 * FROM {table}")
-                for column in cursor.description:
-                    col_name = column[0]
-                    # Map SQL Server types to our simplified types
-                    type_name = column[1].__name__.lower()
-                    if type_name in ['int', 'bigint', 'smallint', 'tinyint', 'decimal', 'numeric', 'float', 'real']:
-                        data_type = 'number'
-                    elif type_name in ['datetime', 'date', 'time', 'datetime2', 'datetimeoffset']:
-                        data_type = 'datetime'
-                    elif type_name in ['char', 'varchar', 'text', 'nchar', 'nvarchar', 'ntext']:
-                        data_type = 'string'
-                    else:
-                        data_type = 'other'
-                    
-                    # Only update if not exists or if current type is more specific
-                    if col_name not in variables or variables[col_name]['type'] == 'other':
-                        variables[col_name] = {
-                            'name': col_name,
-                            'type': data_type,
-                            'operators': get_operators_for_type(data_type)
-                        }
-            except pyodbc.Error as e:
-                print(f"Error getting columns from {table}: {e}")
-
-        cursor.close()
-        conn.close()
+        response = jsonify({
+            'status': 'success',
+            'variables': variables
+        })
+        return _cacheable(response, etag) if etag is not None else response
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+def _cohort_tables(modality, cohort_type):
+    return [table['name'] for table in MODALITY_MAPPING[modality]['tables'] if table['type'] == cohort_type]
+
+@app.route('/variable-stats/<modality>/<cohort_type>')
+def get_variable_stats(modality, cohort_type):
+    """Get value distributions (histogram, min/max, nulls, distinct count) of a cohort's numeric variables"""
+    try:
+        if modality not in MODALITY_MAPPING:
+            return jsonify({'status': 'error', 'message': 'Invalid modality'}), 400
+
+        tables = _cohort_tables(modality, cohort_type)
+        if not tables:
+            return jsonify({'status': 'error', 'message': f'No tables found for {cohort_type} cohort'}), 404
+
+        stats = {}
+        for table_name in tables:
+            stats[table_name] = variable_statistics.describe(table_name)
+            if stats[table_name] is None:
+                return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+
+        return jsonify({'status': 'success', 'tables': stats})
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/variable-stats/<modality>/<cohort_type>/estimate')
+def estimate_threshold(modality, cohort_type):
+    """Approximate how many rows a proposed threshold matches, from the precomputed histograms
+
+    estimated_rows counts table rows across every timepoint, not the participants at the
+    selected timepoints that /query-data counts, so it can be several times larger.
+    """
+    try:
+        if modality not in MODALITY_MAPPING:
+            return jsonify({'status': 'error', 'message': 'Invalid modality'}), 400
+
+        tables = _cohort_tables(modality, cohort_type)
+        if not tables:
+            return jsonify({'status': 'error', 'message': f'No tables found for {cohort_type} cohort'}), 404
+
+        variable = request.args.get('variable')
+        operator = request.args.get('operator')
+        if not variable or not operator:
+            return jsonify({'status': 'error', 'message': 'variable and operator are required'}), 400
+
+        estimates = {}
+        try:
+            for table_name in tables:
+                estimates[table_name] = variable_statistics.estimate(
+                    table_name, variable, operator, request.args.get('value'), request.args.get('value2')
+                )
+                if estimates[table_name] is None:
+                    return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
 
         return jsonify({
             'status': 'success',
-            'variables': sorted([v for v in variables.values()], key=lambda x: x['name'])
+            'estimated_rows': sum(e['estimated_rows'] for e in estimates.values()),
+            'tables': estimates
         })
 
     except Exception as e:
@@ -194,245 +685,88 @@ def test_connection():
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-def _build_not_null_conditions(variables):
-    """Build SQL conditions to check for NOT NULL values in selected variables"""
-    if not variables:
-        return "1=1"  # No variables selected, always true
-    conditions = [f"t.{var['name']} IS NOT NULL" for var in variables]  # Use table alias 't' for variables
-    return " AND ".join(conditions)
+@app.route('/pool-stats')
+def pool_stats():
+    """Report connection pool occupancy and checkout latency"""
+    return jsonify({'status': 'success', 'pool': db_pool.stats()})
 
-def build_filter_queries(modality, logic_parameters):
-    """Build SQL queries for a specific modality and its logic parameters"""
+@app.route('/schema-catalog', methods=['GET', 'POST'])
+def schema_catalog_status():
+    """Report which tables the schema catalog holds and when it was last checked (POST reloads it)"""
+    if request.method == 'POST':
+        schema_catalog.refresh(force=True)
+    return jsonify({'status': 'success', 'catalog': schema_catalog.stats()})
+
+def _selected_tables(modality, logic_parameters, mapping=None):
+    """Return the tables a filter reads (in the default study year, or in mapping) and its logic parameter"""
     # Get the actual table mappings for this modality
-    modality_config = MODALITY_MAPPING.get(modality)
+    modality_config = (mapping or MODALITY_MAPPING).get(modality)
     if not modality_config:
         raise ValueError(f"No table mapping found for modality: {modality}")
-    
-    queries = []
-    all_params = []
-    
-    # Filter tables based on selected cohorts
-    selected_tables = []
-    
-    # Get cohorts from the first logic parameter (if any)
-    selected_cohorts = []
-    if logic_parameters and len(logic_parameters) > 0:
-        selected_cohorts = logic_parameters[0].get('cohorts', [])
-    
-    # If no cohorts selected, empty cohorts list, or all cohorts selected, include all tables
-    has_children = 'children' in selected_cohorts
-    has_adults = 'adults' in selected_cohorts or 'adult' in selected_cohorts
-    
-    # If no cohorts or both cohorts selected, include all tables
-    if not selected_cohorts or (has_children and has_adults):
-        selected_tables = modality_config['tables'].copy()
-    else:
-        # Only include tables that match the selected cohorts
-        for table_config in modality_config['tables']:
-            table_type = table_config['type']
-            if (table_type == 'children' and has_children) or \
-               (table_type == 'adults' and has_adults):
-                selected_tables.append(table_config)
-
-    # Build a query for each selected table
-    for table_config in selected_tables:
-        table_name = table_config['name']
-        table_type = table_config['type']
-        gender_col = table_config['gender_column']
-        
-        # Process the first logic parameter (or use defaults if none provided)
-        logic_param = logic_parameters[0] if logic_parameters and len(logic_parameters) > 0 else {}
-        timepoints = logic_param.get('timepoints') if logic_param and logic_param.get('timepoints') else []
-        thresholds = logic_param.get('thresholds') if logic_param and logic_param.get('thresholds') else []
-        cohorts = logic_param.get('cohorts') if logic_param and logic_param.get('cohorts') else []
-        
-        # If no timepoints specified, empty list, or 'all' selected, use all timepoints
-        if not timepoints or timepoints == [] or 'all' in timepoints:
-            timepoints = [1, 2, 3, 4, 5, 6]  # All timepoints must be present
-        
-        # Make sure timepoints are integers
-        timepoint_params = [int(tp) for tp in timepoints]
-        
 
-        base_query = f"""
-        WITH ParticipantGenders AS (
-            SELECT 
-                v.pid,
-                COALESCE(p.gender, 'Unknown') as gender
-            FROM (
-                SELECT t.pid
-                FROM {table_name} t
-                WHERE t.time_point IN ({','.join(['?' for _ in timepoints])})
-                GROUP BY t.pid
-                HAVING COUNT(DISTINCT t.time_point) = {len(timepoints)}
-                AND COUNT(CASE WHEN {_build_not_null_conditions(logic_param.get('variables', []))} THEN 1 END) = {len(timepoints)}
-            ) v
-            LEFT JOIN {table_name} t ON v.pid = t.pid
-            LEFT JOIN {PARTICIPANTS_TABLE} p ON v.pid = p.pid
-            GROUP BY v.pid, p.gender
-        )
-        SELECT 
-            COUNT(DISTINCT pid) as count,
-            '{table_type}' as source,
-            SUM(CASE WHEN gender IN ('M', 'MALE') OR LOWER(gender) = 'male' THEN 1 ELSE 0 END) as male_count,
-            SUM(CASE WHEN gender IN ('F', 'FEMALE') OR LOWER(gender) = 'female' THEN 1 ELSE 0 END) as female_count,
-            SUM(CASE 
-                WHEN gender IS NULL THEN 0
-                WHEN gender NOT IN ('M', 'MALE', 'F', 'FEMALE') 
-                    AND LOWER(gender) NOT IN ('male', 'female') 
-                THEN 1 
-                ELSE 0 
-            END) as other_count
-        FROM ParticipantGenders
-    """
-        conditions = []
-        params = timepoint_params.copy()  # These are used in the IN clause of the CTE
-
-        # Handle thresholds
-        threshold_conditions = []
-        for threshold in thresholds:
-            variable_obj = threshold.get('variable')
-            operator = threshold.get('operator')
-            value = threshold.get('value')
-            value2 = threshold.get('value2')
-
-            if not variable_obj or not operator:
-                continue
-            if operator not in ['IS NULL','IS NOT NULL'] and value is None:
-                continue
+    # Only the first logic parameter is used; its cohorts select the tables
+    logic_param = logic_parameters[0] if logic_parameters else {}
+    return select_tables(modality_config, logic_param.get('cohorts') or []), logic_param
 
+def build_filter_queries(modality, logic_parameters):
+    """Build the SQL query for a specific modality and its logic parameters"""
+    selected_tables, logic_param = _selected_tables(modality, logic_parameters)
+    return compile_filter_query(selected_tables, logic_param, PARTICIPANTS_TABLE)
 
-            variable = variable_obj['name']  # Extract name from variable object
-            data_type = variable_obj['type']  # Use type from variable object
-
-            if operator == 'between' and value2:
-                threshold_conditions.append(f"t.{variable} BETWEEN ? AND ?")  # Reference variable with table alias
-                if data_type == 'number':
-                    params.extend([float(value), float(value2)])
-                elif data_type == 'datetime':
-                    params.extend([value, value2])  # Assuming ISO format dates
-                else:
-                    params.extend([value, value2])
-            elif operator in ['LIKE', 'NOT LIKE']:
-                threshold_conditions.append(f"t.{variable} {operator} ?")  # Reference variable with table alias
-                params.append(f"%{value}%")  # Add wildcards for contains/not contains
-            elif operator in ['IS NULL', 'IS NOT NULL']:
-                threshold_conditions.append(f"t.{variable} {operator}")  # Reference variable with table alias
-            else:
-                threshold_conditions.append(f"t.{variable} {operator} ?")  # Reference variable with table alias
-                if data_type == 'number':
-                    params.append(float(value))
-                elif data_type == 'datetime':
-                    params.append(value)  # Assuming ISO format dates
-                else:
-                    params.append(value)
-
-        # Modify the CTE to include threshold conditions
-        if threshold_conditions:
-            # Find the position of the first WHERE clause in the CTE
-            where_pos = base_query.find("WHERE t.time_point IN")
-            if where_pos != -1:
-                # Insert the threshold conditions after the existing WHERE clause
-                insert_pos = base_query.find("GROUP BY t.pid", where_pos)
-                if insert_pos != -1:
-                    base_query = (
-                        base_query[:insert_pos] +
-                        f" AND {' AND '.join(threshold_conditions)} " +
-                        base_query[insert_pos:]
-                    )
-        
-        queries.append(base_query)
-        all_params.extend(params)
-    
-    # If we have no queries, return a default query that returns no results
-    if not queries:
-        return "SELECT 0 as count, 'none' as source WHERE 1=0", []
-    
-            # If we have multiple tables, we'll need to combine their results
-    if len(queries) > 1:
-        # For SQL Server, we need to define all CTEs first, then do the UNION ALL
-        # Process threshold conditions for each CTE
-        threshold_conditions_1 = []
-        threshold_conditions_2 = []
-        
-        # Handle thresholds for both CTEs
-        for threshold in thresholds:
-            variable_obj = threshold.get('variable')
-            operator = threshold.get('operator')
-            value = threshold.get('value')
-            value2 = threshold.get('value2')
-
-            if not variable_obj or not operator:
-                continue
-            if operator not in ['IS NULL','IS NOT NULL'] and value is None:
-                continue
+def build_export_queries(modality, logic_parameters, include_variables=False):
+    """Build the per-table export queries for a modality filter (same semantics as build_filter_queries)"""
+    selected_tables, logic_param = _selected_tables(modality, logic_parameters)
+    return compile_export_queries(selected_tables, logic_param, include_variables)
 
+def _check_filter(modality, logic_parameters):
+    """Raise ValueError (or TypeError/KeyError) for a filter the query compiler would reject"""
+    _, logic_param = _selected_tables(modality, logic_parameters)
+    canonical_filter_spec(modality, logic_parameters)
+    compile_thresholds(logic_param.get('thresholds') or [])
 
-            variable = variable_obj['name']
-            data_type = variable_obj['type']
+def _is_baseline_request(logic_parameters):
+    """True when no logic parameters (or only empty ones) were given, so basic counts are returned"""
+    return not logic_parameters or (
+        len(logic_parameters) == 1 and
+        not logic_parameters[0].get('timepoints') and
+        not logic_parameters[0].get('thresholds') and
+        not logic_parameters[0].get('cohorts') and
+        not logic_parameters[0].get('variables')
+    )
 
-            if operator == 'between' and value2:
-                condition = f"t.{variable} BETWEEN ? AND ?"
-            elif operator in ['LIKE', 'NOT LIKE']:
-                condition = f"t.{variable} {operator} ?"
-            elif operator in ['IS NULL', 'IS NOT NULL']:
-                condition = f"t.{variable} {operator}"
-            else:
-                condition = f"t.{variable} {operator} ?"
-            
-            threshold_conditions_1.append(condition)
-            threshold_conditions_2.append(condition)
-
-        combined_query = """
-            WITH ParticipantGenders_1 AS (
-                SELECT 
-                    v.pid,
-                    COALESCE(p.gender, 'Unknown') as gender
-                FROM (
-                    SELECT t.pid
-                    FROM {table_name_1} t
-                    WHERE t.time_point IN ({timepoints_1})
-                    GROUP BY t.pid
-                    HAVING COUNT(DISTINCT t.time_point) = {len_timepoints_1}
-                ) v
-                LEFT JOIN {table_name_1} t ON v.pid = t.pid
-                LEFT JOIN {PARTICIPANTS_TABLE} p ON v.pid = p.pid
-                WHERE 1=1 {where_th_1}
-                GROUP BY v.pid, p.gender
-            ),
-            ParticipantGenders_2 AS (
-                SELECT 
-                    v.pid,
-                    COALESCE(p.gender, 'Unknown') as gender
-                FROM (
-                    SELECT t.pid
-                    FROM {table_name_2} t
-                    WHERE t.time_point IN ({timepoints_2})
-                    GROUP BY t.pid
-                    HAVING COUNT(DISTINCT t.time_point) = {len_timepoints_2}
-                ) v
-                LEFT JOIN {table_name_2} t ON v.pid = t.pid
-                LEFT JOIN {PARTICIPANTS_TABLE} p ON v.pid = p.pid
-                WHERE 1=1 {where_th_2}
-                GROUP BY v.pid, p.gender
-            )
-            SELECT 
-                COUNT(DISTINCT pid) as count,
-                '{type_1}' as source,
-                SUM(CASE WHEN gender IN ('M', 'MALE') OR LOWER(gender) = 'male' THEN 1 ELSE 0 END) as male_count,
-                SUM(CASE WHEN gender IN ('F', 'FEMALE') OR LOWER(gender) = 'female' THEN 1 ELSE 0 END) as female_count,
-                SUM(CASE 
-                    WHEN gender IS NULL THEN 0
-                    WHEN gender NOT IN ('M', 'MALE', 'F', 'FEMALE') 
-                        AND LOWER(gender) NOT IN ('male', 'female') 
-                    THEN 1 
-                    ELSE 0 
-                END) as other_count
-            FROM ParticipantGenders_1
-            UNION ALL
+def _empty_baseline_counts():
+    return {
+        'total': 0,
+        'children': 0,
+        'adults': 0,
+        'gender': {
+            'children': {'M': 0, 'F': 0},
+            'adults': {'M': 0, 'F': 0}
+        }
+    }
+
+def _baseline_table_counts(cursor, table_config):
+    """Count participants with all six timepoints in one table; returns (total, M, F, O) or None on error"""
+    table_name = table_config['name']
+    
+    try:
+        if PARTICIPANTS_DIMENSION_ENABLED and participants_dimension.ready([table_config]):
+            # Fetch the qualifying pids only and look their gender up in memory
+            cursor.execute(compile_baseline_pid_query(table_config))
+            pids = [row[0] for row in fetch_rows(cursor)]
+            pids = pid_array(pids)
+            order = np.argsort(pids, kind='stable')
+            codes = participants_dimension.codes(pids[order], table_config)
+            if codes is not None:
+                # NULL genders are part of the total but not of M/F/O; the participants and their
+                # codes are kept so a change can be applied to just the affected pids
+                return _counts_from_codes(codes) + ((pids[order], codes),)
+
+        # Get total count and gender counts for this table
+        gender_col = table_config['gender_column']
+        base_select = """
             SELECT 
-                COUNT(DISTINCT pid) as count,
-                '{type_2}' as source,
+                COUNT(pid) as total,
                 SUM(CASE WHEN gender IN ('M', 'MALE') OR LOWER(gender) = 'male' THEN 1 ELSE 0 END) as male_count,
                 SUM(CASE WHEN gender IN ('F', 'FEMALE') OR LOWER(gender) = 'female' THEN 1 ELSE 0 END) as female_count,
                 SUM(CASE 
@@ -442,55 +776,633 @@ def build_filter_queries(modality, logic_parameters):
                     THEN 1 
                     ELSE 0 
                 END) as other_count
-            FROM ParticipantGenders_2
-        """.format(
-            table_name_1=selected_tables[0]['name'],
-            table_name_2=selected_tables[1]['name'],
-            type_1=selected_tables[0]['type'],
-            type_2=selected_tables[1]['type'],
-            timepoints_1=','.join(['?' for _ in timepoints]),
-            timepoints_2=','.join(['?' for _ in timepoints]),
-            len_timepoints_1=len(timepoints),
-            len_timepoints_2=len(timepoints),
-            PARTICIPANTS_TABLE=PARTICIPANTS_TABLE,
-            where_th_1=(' AND ' + ' AND '.join(threshold_conditions_1)) if threshold_conditions_1 else '',
-            where_th_2=(' AND ' + ' AND '.join(threshold_conditions_2)) if threshold_conditions_2 else '',
-        )
-        # Create separate parameter lists for each CTE
-        params_1 = timepoint_params.copy()
-        params_2 = timepoint_params.copy()
+            FROM TimePointCounts
+        """
+        
+        # Choose query based on whether we need to get gender from participants table
+        if gender_col == '':
+            count_query = f"""
+                WITH TimePointCounts AS (
+                    SELECT 
+                        t.pid,
+                        COUNT(DISTINCT t.time_point) as tp_count,
+                        MIN(p.gender) as gender
+                    FROM {table_name} t
+                    LEFT JOIN {PARTICIPANTS_TABLE} p ON t.pid = p.pid
+                    WHERE t.time_point IN (1,2,3,4,5,6)
+                    GROUP BY t.pid
+                    HAVING COUNT(DISTINCT t.time_point) = 6  -- All timepoints required in this case
+                )
+                {base_select}
+            """
+        else:
+            count_query = f"""
+                WITH TimePointCounts AS (
+                    SELECT 
+                        pid,
+                        COUNT(DISTINCT time_point) as tp_count,
+                        MIN({gender_col}) as gender
+                    FROM {table_name}
+                    WHERE time_point IN (1,2,3,4,5,6)
+                    GROUP BY pid
+                    HAVING COUNT(DISTINCT time_point) = 6  -- All timepoints required in this case
+                )
+                {base_select}
+            """
+        cursor.execute(count_query)
+        row = cursor.fetchone()
+        # Use 0 if NULL
+        return row[0], row[1] or 0, row[2] or 0, row[3] or 0
+        
+    except pyodbc.Error as e:
+        print(f"Error counting rows in {table_name}: {e}")
+        return None
+
+def _counts_from_codes(codes):
+    genders = np.bincount(codes, minlength=4)
+    return len(codes), int(genders[GENDER_M]), int(genders[GENDER_F]), int(genders[GENDER_O])
+
+def _baseline_table_delta(cursor, table_config, members, pids):
+    """Re-check the given pids of one table's default counts; returns (total, M, F, O, members) or None"""
+    fresh = []
+    genders = []
+    for chunk in pid_chunks(pids):
+        cursor.execute(compile_baseline_delta_query(table_config, len(chunk)), chunk)
+        for pid, gender in fetch_rows(cursor):
+            fresh.append(pid)
+            genders.append(gender_code(gender))
+    fresh = pid_array(fresh).astype(members[0].dtype)
+    if table_config['gender_column']:
+        codes = np.array(genders, dtype=np.int8)
+    else:
+        codes = participants_dimension.codes(fresh)
+        if codes is None:
+            return None
+    keep = ~np.isin(members[0], pids)
+    merged_pids = np.concatenate([members[0][keep], fresh])
+    merged_codes = np.concatenate([members[1][keep], codes.astype(np.int8)])
+    order = np.argsort(merged_pids, kind='stable')
+    return _counts_from_codes(merged_codes) + ((merged_pids[order], merged_codes[order]),)
+
+def _merge_baseline_counts(counts, table_type, table_counts):
+    count, male_count, female_count, other_count = table_counts[:4]
+    counts[table_type] = count
+    counts['total'] += count
+    counts['gender'][table_type]['M'] = male_count
+    counts['gender'][table_type]['F'] = female_count
+    counts['gender'][table_type]['O'] = other_count
+
+def _filter_counts_by_lookup(cursor, modality, logic_parameters):
+    """List qualifying pids per table and take the gender breakdown from the participants dimension"""
+    selected_tables, logic_param = _selected_tables(modality, logic_parameters)
+    query, params = compile_pid_query(selected_tables, logic_param)
+    try:
+        cursor.execute(query, params)
+        pids = [[] for _ in selected_tables]
+        for table_index, pid in fetch_rows(cursor):
+            pids[table_index].append(pid)
+        counts = {
+            'total': 0,
+            'children': 0,
+            'adults': 0,
+            'gender': {
+                'children': {'M': 0, 'F': 0, 'O': 0},
+                'adults': {'M': 0, 'F': 0, 'O': 0}
+            }
+        }
+        members = {}
+        for table_config, table_pids in zip(selected_tables, pids):
+            table_pids = np.unique(pid_array(table_pids))
+            if not _count_members(counts, table_config['type'], table_pids):
+                return None
+            members[table_config['name'].lower()] = table_pids
+        return {
+            'counts': counts,
+            'query': query,
+            'members': members  # qualifying pids per table, kept with the cached result
+        }
+    except pyodbc.Error as e:
+        return {
+            'error': str(e),
+            'query': query  # Include failed query for debugging
+        }
+
+def _count_members(counts, table_type, pids):
+    """Set one table's filter counts from its qualifying pids; False when genders are not available"""
+    genders = participants_dimension.gender_counts(pids)
+    if genders is None:
+        return False
+    counts['total'] += len(pids) - counts[table_type]
+    counts[table_type] = len(pids)
+    counts['gender'][table_type]['M'] = int(genders[GENDER_M])
+    counts['gender'][table_type]['F'] = int(genders[GENDER_F])
+    # Missing participants and NULL genders are COALESCEd to 'Unknown', which counts as other
+    counts['gender'][table_type]['O'] = int(genders[GENDER_O] + genders[GENDER_NULL])
+    return True
+
+def _refresh_filter_counts(cursor, modality, logic_parameters, value, members, changed):
+    """Bring a cached filter result up to date by re-checking only the changed pids of each table
+
+    members are the qualifying pids per table the cached value was counted from and
+    changed the pids a data change touched since. Falls back to _filter_counts when
+    genders cannot be looked up.
+    """
+    selected_tables, logic_param = _selected_tables(modality, logic_parameters)
+    counts = json.loads(json.dumps(value['counts']))
+    members = dict(members)
+    try:
+        for table_config in selected_tables:
+            table = table_config['name'].lower()
+            if table not in changed:
+                continue
+            fresh = []
+            for chunk in pid_chunks(changed[table]):
+                query, params = compile_pid_query([table_config], logic_param, pids=chunk)
+                cursor.execute(query, params)
+                fresh.extend(pid for _, pid in fetch_rows(cursor))
+            table_pids = np.union1d(
+                np.setdiff1d(members[table], changed[table]), pid_array(fresh).astype(members[table].dtype)
+            )
+            if not _count_members(counts, table_config['type'], table_pids):
+                return _filter_counts(cursor, modality, logic_parameters)
+            members[table] = table_pids
+    except pyodbc.Error as e:
+        return {'error': str(e), 'query': value.get('query')}
+    return {**value, 'counts': counts, 'members': members}
+
+def _filter_counts(cursor, modality, logic_parameters):
+    """Run the build_filter_queries query for one modality and collect its counts"""
+    selected_tables, _ = _selected_tables(modality, logic_parameters)
+    filter_workload.record(
+        [table_config['name'] for table_config in selected_tables], canonical_filter_spec(modality, logic_parameters)
+    )
+    if PARTICIPANTS_DIMENSION_ENABLED and participants_dimension.ready():
+        result = _filter_counts_by_lookup(cursor, modality, logic_parameters)
+        if result is not None:
+            return result
+    query, params = build_filter_queries(modality, logic_parameters)
+    try:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        counts = {
+            'total': 0,
+            'children': 0,
+            'adults': 0,
+            'gender': {
+                'children': {'M': 0, 'F': 0, 'O': 0},
+                'adults': {'M': 0, 'F': 0, 'O': 0}
+            }
+        }
         
-        # Add threshold parameters for each CTE
-        for threshold in thresholds:
-            if threshold.get('variable') and threshold.get('operator') and threshold.get('value'):
-                if threshold.get('operator') == 'between' and threshold.get('value2'):
-                    params_1.extend([float(threshold['value']), float(threshold['value2'])])
-                    params_2.extend([float(threshold['value']), float(threshold['value2'])])
-                else:
-                    value = float(threshold['value']) if threshold['value'].replace('.', '').isdigit() else threshold['value']
-                    params_1.append(value)
-                    params_2.append(value)
+        for row in rows:
+            if row and len(row) >= 5:  # count, source, male_count, female_count, other_count
+                count = row[0] or 0  # Use 0 if count is None
+                source = row[1]
+                male_count = row[2] or 0
+                female_count = row[3] or 0
+                other_count = row[4] or 0
+                
+                # Normalize source type to match our expected keys
+                source_type = source.lower()  # Convert to lowercase to handle any case variations
+                if source_type in ['children', 'adults']:  # Make sure it's a valid source type
+                    counts[source_type] = count
+                    counts['total'] += count
+                    counts['gender'][source_type]['M'] = male_count
+                    counts['gender'][source_type]['F'] = female_count
+                    counts['gender'][source_type]['O'] = other_count
         
-        # Combine parameters in the correct order
-        all_params = params_1 + params_2
+        return {
+            'counts': counts,
+            'query': query
+        }
+    except pyodbc.Error as e:
+        return {
+            'error': str(e),
+            'query': query  # Include failed query for debugging
+        }
+
+def _run_coalesced(keyed_tasks):
+    """Run (key, task) pairs through query_executor, sharing one execution per key across requests
+
+    Tasks whose key is already executing (in this or another request) are not run
+    again; the caller waits for that execution and receives its outcome, error included.
+    """
+    flights = [query_flights.begin(key) for key, _ in keyed_tasks]
+    leading = [i for i, (_, leader) in enumerate(flights) if leader]
+    outcomes = [None] * len(keyed_tasks)
+    try:
+        for i, outcome in zip(leading, query_executor.run([keyed_tasks[i][1] for i in leading])):
+            outcomes[i] = outcome
+    except Exception as e:
+        for i in leading:
+            if outcomes[i] is None:
+                outcomes[i] = e
+        raise
+    finally:
+        for i in leading:
+            query_flights.finish(flights[i][0], outcomes[i])
+
+    # Same budget as the executor's backstop for the leader's own wait
+    budget = query_executor.timeout * 2 + 5 if query_executor.timeout else None
+    deadline = current_deadline.get()
+    for i, (flight, leader) in enumerate(flights):
+        if not leader:
+            outcomes[i] = flight.outcome if flight.wait(budget) else QueryTimeout(
+                f"Identical query in flight did not finish within {budget}s"
+            )
+            if isinstance(outcomes[i], DeadlineExceeded) and (deadline is None or deadline.cancelled is None):
+                # The leading request was cancelled (its deadline or its client), not this one
+                outcomes[i] = query_executor.run([keyed_tasks[i][1]])[0]
+    return outcomes
+
+def _filter_pid_sets(cursor, modality, logic_parameters):
+    """Qualifying pids of one modality filter, as a sorted array per cohort"""
+    pids = {cohort: [] for cohort in COHORTS}
+    if _is_baseline_request(logic_parameters):
+        for table_config in MODALITY_MAPPING[modality]['tables']:
+            cursor.execute(compile_baseline_pid_query(table_config))
+            pids[table_config['type']].extend(row[0] for row in fetch_rows(cursor))
     else:
-        combined_query = queries[0]
+        selected_tables, logic_param = _selected_tables(modality, logic_parameters)
+        query, params = compile_pid_query(selected_tables, logic_param)
+        cursor.execute(query, params)
+        for table_index, pid in fetch_rows(cursor):
+            pids[selected_tables[table_index]['type']].append(pid)
+    return {cohort: pid_set(values) for cohort, values in pids.items()}
 
-    return combined_query, all_params
+def _query_combined(filters, combine, use_cache):
+    """Count participants matching a combination (AND/OR/NOT) of modality filters"""
+    entries = [(f.get('modality'), f.get('logicParameters') or []) for f in filters]
+    invalid = [modality for modality, _ in entries if modality not in MODALITY_MAPPING]
+    if invalid:
+        return jsonify({'status': 'error', 'message': f"Invalid modality: {', '.join(map(str, invalid))}"}), 400
+    try:
+        tree = parse_combine(combine, len(entries))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    keys = [filter_cache_key(m, lps, baseline=_is_baseline_request(lps)) for m, lps in entries]
+    cache_key = json.dumps(['combined', tree, keys])
+    tables = {t for modality, _ in entries for t in _modality_tables(modality)}
+    if use_cache:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify({'status': 'success', 'combined': cached})
+    else:
+        result_cache.record_bypass()
+
+    # Each distinct filter is evaluated once, however often the expression uses it
+    used = list(dict.fromkeys(keys[i] for i in sorted(referenced_filters(tree))))
+    first_entry = {key: entries[keys.index(key)] for key in used}
+    outcomes = _run_coalesced([
+        (
+            ('pids', key),
+            partial(_run_with_connection, _filter_pid_sets, *first_entry[key], labels={'modality': first_entry[key][0]})
+        )
+        for key in used
+    ])
+    pid_sets = {}
+    for key, outcome in zip(used, outcomes):
+        if isinstance(outcome, ConnectionError):
+            return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+        if isinstance(outcome, DeadlineExceeded):
+            return _deadline_response(outcome)
+        if isinstance(outcome, Exception):
+            return jsonify({'status': 'error', 'message': str(outcome)}), 500
+        pid_sets[key] = outcome
+
+    if not participants_dimension.ready():
+        participants_dimension.refresh()
+
+    counts = {
+        'total': 0,
+        'children': 0,
+        'adults': 0,
+        'gender': {
+            'children': {'M': 0, 'F': 0, 'O': 0},
+            'adults': {'M': 0, 'F': 0, 'O': 0}
+        }
+    }
+    for cohort in COHORTS:
+        combined = evaluate(tree, [pid_sets.get(key, {}).get(cohort) for key in keys])
+        genders = participants_dimension.gender_counts(combined)
+        if genders is None:
+            return _genders_unavailable_response()
+        counts[cohort] = len(combined)
+        counts['total'] += len(combined)
+        counts['gender'][cohort]['M'] = int(genders[GENDER_M])
+        counts['gender'][cohort]['F'] = int(genders[GENDER_F])
+        # Missing participants and NULL genders count as other, as in the filter counts
+        counts['gender'][cohort]['O'] = int(genders[GENDER_O] + genders[GENDER_NULL])
+
+    result = {
+        'counts': counts,
+        'filters': [
+            {cohort: int(len(pid_sets[key][cohort])) for cohort in COHORTS} if key in pid_sets else None
+            for key in keys
+        ]
+    }
+    result_cache.put(cache_key, result, tables)
+    return jsonify({'status': 'success', 'combined': result})
+
+def _year_pid_sets(cursor, year, modality, logic_parameters):
+    """Qualifying pids of one modality filter in one study year with their gender codes, per cohort
+
+    Returns {cohort: (sorted pids, codes)}, or None while the year's gender maps are
+    not loaded. Genders follow the single-year counts: the table's own gender column
+    for default counts, the participants table for filters.
+    """
+    mapping = YEAR_MAPPINGS[year]
+    dimension = year_dimensions[year]
+    parts = {cohort: [] for cohort in COHORTS}
+    if _is_baseline_request(logic_parameters):
+        for table_config in mapping[modality]['tables']:
+            cursor.execute(compile_baseline_pid_query(table_config))
+            pids = np.unique(pid_array([row[0] for row in fetch_rows(cursor)]))
+            parts[table_config['type']].append((pids, dimension.codes(pids, table_config)))
+    else:
+        selected_tables, logic_param = _selected_tables(modality, logic_parameters, mapping)
+        query, params = compile_pid_query(selected_tables, logic_param)
+        cursor.execute(query, params)
+        pids = [[] for _ in selected_tables]
+        for table_index, pid in fetch_rows(cursor):
+            pids[table_index].append(pid)
+        for table_config, table_pids in zip(selected_tables, pids):
+            table_pids = np.unique(pid_array(table_pids))
+            parts[table_config['type']].append((table_pids, dimension.codes(table_pids)))
+    if any(codes is None for cohort_parts in parts.values() for _, codes in cohort_parts):
+        return None
+    return {cohort: union_participants(cohort_parts) for cohort, cohort_parts in parts.items()}
+
+def _query_years(filters, years, use_cache):
+    """Count participants matching each filter across several study years, each participant once
+
+    The filter runs in every selected year the modality exists in; all (filter, year)
+    queries run concurrently, so a request takes as long as its slowest year. Per
+    cohort the qualifying pids of the years are united, a participant in several years
+    taking the gender of the latest one. Per-year counts are returned alongside.
+    """
+    results = {}
+    pending = []  # (modality, logic_parameters, baseline, filter_key, cache_key, years the modality exists in)
+    for filter_item in filters:
+        modality = filter_item.get('modality')
+        logic_parameters = filter_item.get('logicParameters') or []
+        if not modality:
+            continue
+        if modality not in MODALITY_TABLES:
+            return jsonify({'status': 'error', 'message': f"Invalid modality: {modality}"}), 400
+        baseline = _is_baseline_request(logic_parameters)
+        filter_key = filter_cache_key(modality, logic_parameters, baseline=baseline)
+        cache_key = json.dumps(['years', years, filter_key])
+        if use_cache:
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                results[modality] = cached
+                continue
+        else:
+            result_cache.record_bypass()
+        modality_years = [year for year in years if modality in YEAR_MAPPINGS[year]]
+        pending.append((modality, logic_parameters, baseline, filter_key, cache_key, modality_years))
+
+    for year in sorted({year for *_, modality_years in pending for year in modality_years}):
+        if not year_dimensions[year].ready():
+            year_dimensions[year].refresh()
+    outcomes = iter(_run_coalesced([
+        (
+            ('year-pids', year, filter_key),
+            partial(
+                _run_with_connection, _year_pid_sets, year, modality, logic_parameters,
+                labels={'modality': modality, 'year': year}
+            )
+        )
+        for modality, logic_parameters, _, filter_key, _, modality_years in pending
+        for year in modality_years
+    ]))
+
+    for modality, _, baseline, _, cache_key, modality_years in pending:
+        by_year = {}
+        for year in modality_years:
+            outcome = next(outcomes)
+            if isinstance(outcome, ConnectionError):
+                return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+            if isinstance(outcome, DeadlineExceeded):
+                return _deadline_response(outcome)
+            if isinstance(outcome, Exception):
+                return jsonify({'status': 'error', 'message': str(outcome)}), 500
+            if outcome is None:
+                return _genders_unavailable_response()
+            by_year[year] = outcome
+
+        counts = {
+            'total': 0,
+            'children': 0,
+            'adults': 0,
+            'gender': {
+                'children': {'M': 0, 'F': 0, 'O': 0},
+                'adults': {'M': 0, 'F': 0, 'O': 0}
+            }
+        }
+        for cohort in COHORTS:
+            pids, codes = union_participants([by_year[year][cohort] for year in modality_years])
+            genders = np.bincount(codes, minlength=4)
+            counts[cohort] = len(pids)
+            counts['total'] += len(pids)
+            counts['gender'][cohort]['M'] = int(genders[GENDER_M])
+            counts['gender'][cohort]['F'] = int(genders[GENDER_F])
+            # As in the single-year counts: NULL genders are other in filters, left out of default counts
+            counts['gender'][cohort]['O'] = int(genders[GENDER_O] + (0 if baseline else genders[GENDER_NULL]))
+
+        result = {
+            'counts': counts,
+            'years': {
+                str(year): {cohort: int(len(by_year[year][cohort][0])) for cohort in COHORTS}
+                for year in modality_years
+            }
+        }
+        tables = [
+            name for year in modality_years
+            for name in [t['name'] for t in YEAR_MAPPINGS[year][modality]['tables']] +
+            [participants_table(PARTICIPANTS_TABLE_PATTERN, year)]
+        ]
+        result_cache.put(cache_key, result, tables)
+        results[modality] = result
+
+    return jsonify({'status': 'success', 'results': results})
+
+def _sweep_dimensions(sweep):
+    """Validate the sweep part of a /query-sweep body; returns [(variable, operator, cutoffs), ...]"""
+    if isinstance(sweep, dict):
+        sweep = [sweep]
+    if not isinstance(sweep, list) or not 1 <= len(sweep) <= 2:
+        raise ValueError("sweep must be one variable or a list of two for a grid")
+    dimensions = []
+    for item in sweep:
+        variable = item.get('variable') or {}
+        operator = item.get('operator')
+        if not variable.get('name') or variable.get('type') != 'number':
+            raise ValueError("Only numeric variables can be swept")
+        if operator not in SWEEP_OPERATORS:
+            raise ValueError(f"Operator {operator} cannot be swept; use one of {', '.join(SWEEP_OPERATORS)}")
+        if item.get('range'):
+            start, stop, step = (float(item['range'][k]) for k in ('start', 'stop', 'step'))
+            if step <= 0:
+                raise ValueError("range step must be positive")
+            cutoffs = [round(start + i * step, 10) for i in range(int((stop - start) / step + 1e-9) + 1)]
+        else:
+            cutoffs = [float(c) for c in item.get('cutoffs') or []]
+        if not cutoffs:
+            raise ValueError(f"No cutoffs given for {variable['name']}")
+        dimensions.append((variable, operator, cutoffs))
+    if np.prod([len(cutoffs) for _, _, cutoffs in dimensions]) > SWEEP_MAX_CELLS:
+        raise ValueError(f"A sweep can have at most {SWEEP_MAX_CELLS} cutoffs (or grid cells)")
+    return dimensions
+
+def _sweep_table(cursor, table_config, logic_param, timepoints, dimensions):
+    """Scan one table once and return (pids, qualifying[pid, cutoff...]) for a sweep"""
+    query, params = compile_sweep_query(table_config, logic_param, [v['name'] for v, _, _ in dimensions])
+    cursor.execute(query, params)
+    rows = list(fetch_rows(cursor))
+    values = [
+        np.array([np.nan if row[3 + i] is None else float(row[3 + i]) for row in rows], dtype=np.float64)
+        for i in range(len(dimensions))
+    ]
+    return sweep_qualifying(
+        [row[0] for row in rows],
+        np.array([row[1] for row in rows], dtype=np.int64),
+        np.array([row[2] for row in rows], dtype=np.int8),
+        values,
+        [(cutoffs, operator) for _, operator, cutoffs in dimensions],
+        timepoints
+    )
+
+def _wave_table(cursor, table_config, logic_param, waves):
+    """Scan one table once and return (pids, at_wave, through_wave) for a per-wave breakdown"""
+    query, params = compile_wave_query(table_config, logic_param)
+    cursor.execute(query, params)
+    rows = list(fetch_rows(cursor))
+    return wave_qualifying(
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        [row[2] for row in rows],
+        waves
+    )
+
+def _modality_tables(modality):
+    """Tables a modality's results are computed from (used for cache invalidation)"""
+    return [t['name'] for t in MODALITY_MAPPING[modality]['tables']] + [PARTICIPANTS_TABLE]
+
+def _compute_baseline_tables(table_configs):
+    """Run the baseline count query for each table concurrently"""
+    return query_executor.run([
+        partial(_run_with_connection, _baseline_table_counts, table_config, labels={'table': table_config['name']})
+        for table_config in table_configs
+    ])
+
+def _compute_baseline_deltas(items):
+    """Re-check the changed pids of each (table_config, members, pids) concurrently"""
+    return query_executor.run([
+        partial(
+            _run_with_connection, _baseline_table_delta, table_config, members, pids,
+            labels={'table': table_config['name']}
+        )
+        for table_config, members, pids in items
+    ])
+
+baseline_counts = BaselineCounts(
+    _compute_baseline_tables,
+    MODALITY_MAPPING,
+    PARTICIPANTS_TABLE,
+    refresh_interval=BASELINE_REFRESH_INTERVAL,
+    compute_delta=_compute_baseline_deltas
+)
+change_tracker.add_listener(baseline_counts.apply_changes)
+
+def _run_with_connection(fn, *args, labels=None):
+    """Run fn(cursor, *args) on its own pooled connection with the per-query timeout applied
+
+    labels (modality, table) are attached to the query timings recorded for /metrics. Within a
+    request deadline the timeout is capped at the time left, and the cursor is cancelled if the
+    deadline passes or the client disconnects (raising DeadlineExceeded).
+    """
+    deadline = current_deadline.get()
+    with query_labels(**(labels or {})):
+        if deadline is not None:
+            deadline.check()
+        conn = get_db_connection()
+        if not conn:
+            raise ConnectionError('Database connection failed')
+        try:
+            conn.timeout = _query_timeout(deadline)
+            cursor = conn.cursor()
+            if deadline is not None:
+                deadline.attach(cursor)
+            try:
+                result = fn(cursor, *args)
+            except Exception:
+                if deadline is not None and deadline.cancelled is not None:
+                    deadline.check()  # The driver's "operation canceled" error is the deadline's doing
+                raise
+            finally:
+                if deadline is not None:
+                    deadline.detach(cursor)
+                cursor.close()
+        finally:
+            conn.close()
+        if deadline is not None and deadline.cancelled is not None:
+            deadline.check()  # A cancelled statement's partial result is not returned
+        return result
+
+def _query_timeout(deadline):
+    """Per-query timeout in whole seconds (0 = none), capped at what is left of the request deadline"""
+    timeout = QUERY_CONCURRENCY['TIMEOUT']
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is None:
+        return timeout
+    remaining = max(1, math.ceil(remaining))
+    return min(timeout, remaining) if timeout else remaining
 
 @app.route('/query-data', methods=['POST'])
 def query_data():
     """Execute queries based on filter parameters and return counts"""
     try:
         filters = request.json.get('filters', [])
-        
-        # Get database connection
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+        use_cache = not request.json.get('bypassCache', False)
+        engine = str(request.json.get('engine') or QUERY_ENGINE).lower()
+        include_query = bool(request.json.get('debug')) or bool(request.args.get('debug'))
+        table_versions.check()
+        change_tracker.check()
+        baseline_counts.start()
+        if TIMEPOINT_INDEX_ENABLED:
+            timepoint_index.check()
+        if engine == 'columnar':
+            columnar_engine.check()
+        if PARTICIPANTS_DIMENSION_ENABLED:
+            participants_dimension.check()
+
+        # Malformed filters (e.g. 'between' with one value) are rejected before anything runs
+        try:
+            for filter_item in filters:
+                if filter_item.get('modality') in MODALITY_MAPPING:
+                    _check_filter(filter_item['modality'], filter_item.get('logicParameters') or [])
+        except (ValueError, TypeError, KeyError) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        # "combine" counts the participants matching an AND/OR/NOT expression over the filters
+        combine = request.json.get('combine')
+        try:
+            years = parse_years(request.json.get('years'), STUDY_YEARS)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        if years is not None and years != [DEFAULT_STUDY_YEAR]:
+            if combine is not None:
+                message = 'combine is only supported within the default study year'
+                return jsonify({'status': 'error', 'message': message}), 400
+            return _query_years(filters, years, use_cache)
+        if combine is not None:
+            return _query_combined(filters, combine, use_cache)
 
-        cursor = conn.cursor()
         results = {}
+        pending = []  # (modality, logic_parameters, baseline, cache_key, stale) still to compute
 
         # Process each filter
         for filter_item in filters:
@@ -500,150 +1412,534 @@ def query_data():
             if not modality:
                 continue
 
-            # If no logic parameters or all fields in logic parameter are empty, just get basic counts
-            if not logic_parameters or (
-                len(logic_parameters) == 1 and
-                not logic_parameters[0].get('timepoints') and
-                not logic_parameters[0].get('thresholds') and
-                not logic_parameters[0].get('cohorts') and
-                not logic_parameters[0].get('variables')
-            ):
-                counts = {
-                    'total': 0,
-                    'children': 0,
-                    'adults': 0,
-                    'gender': {
-                        'children': {'M': 0, 'F': 0},
-                        'adults': {'M': 0, 'F': 0}
-                    }
-                }
-                
-                # Get counts for each table in this modality
+            baseline = _is_baseline_request(logic_parameters)
+            if baseline:
+                # Default counts are materialized and refreshed in the background
+                materialized = baseline_counts.answer(modality)
+                if materialized is not None:
+                    results[modality] = materialized
+                    continue
+
+            cache_key = filter_cache_key(modality, logic_parameters, baseline=baseline)
+            stale = None
+            if use_cache:
+                cached = result_cache.get(cache_key)
+                if cached is not None:
+                    results[modality] = cached
+                    continue
+                if not baseline:
+                    # A cached result whose tables changed for some participants is re-checked for those only
+                    stale = result_cache.stale(cache_key)
+            else:
+                result_cache.record_bypass()
+
+            # Timepoint/cohort-only questions are answered from the bitmap index when possible
+            if TIMEPOINT_INDEX_ENABLED:
+                indexed = timepoint_index.answer(modality, logic_parameters, baseline=baseline)
+                if indexed is not None:
+                    results[modality] = indexed
+                    continue
+
+            # Thresholds are evaluated in process when the columnar engine is selected; anything
+            # it cannot evaluate exactly falls through to SQL
+            if engine == 'columnar' and not baseline:
+                evaluated = columnar_engine.answer(modality, logic_parameters)
+                if evaluated is not None:
+                    results[modality] = evaluated
+                    continue
+            pending.append((modality, logic_parameters, baseline, cache_key, stale))
+
+        # Independent queries (one per baseline table, one per filtered modality) run
+        # concurrently, each on its own pooled connection; identical ones already running for
+        # another request are waited on instead of executed again
+        tasks = []
+        for modality, logic_parameters, baseline, cache_key, stale in pending:
+            if baseline:
+                # If no logic parameters or all fields in logic parameter are empty, just get basic counts
                 for table_config in MODALITY_MAPPING[modality]['tables']:
-                    table_name = table_config['name']
-                    table_type = table_config['type']
-                    
-                    try:
-                        # Get total count and gender counts for this table
-                        gender_col = table_config['gender_column']
-                        base_select = """
-                            SELECT 
-                                COUNT(pid) as total,
-                                SUM(CASE WHEN gender IN ('M', 'MALE') OR LOWER(gender) = 'male' THEN 1 ELSE 0 END) as male_count,
-                                SUM(CASE WHEN gender IN ('F', 'FEMALE') OR LOWER(gender) = 'female' THEN 1 ELSE 0 END) as female_count,
-                                SUM(CASE 
-                                    WHEN gender IS NULL THEN 0
-                                    WHEN gender NOT IN ('M', 'MALE', 'F', 'FEMALE') 
-                                        AND LOWER(gender) NOT IN ('male', 'female') 
-                                    THEN 1 
-                                    ELSE 0 
-                                END) as other_count
-                            FROM TimePointCounts
-                        """
-                        
-                        # Choose query based on whether we need to get gender from participants table
-                        if gender_col == '':
-                            count_query = f"""
-                                WITH TimePointCounts AS (
-                                    SELECT 
-                                        t.pid,
-                                        COUNT(DISTINCT t.time_point) as tp_count,
-                                        MIN(p.gender) as gender
-                                    FROM {table_name} t
-                                    LEFT JOIN {PARTICIPANTS_TABLE} p ON t.pid = p.pid
-                                    WHERE t.time_point IN (1,2,3,4,5,6)
-                                    GROUP BY t.pid
-                                    HAVING COUNT(DISTINCT t.time_point) = 6  -- All timepoints required in this case
-                                )
-                                {base_select}
-                            """
-                        else:
-                            count_query = f"""
-                                WITH TimePointCounts AS (
-                                    SELECT 
-                                        pid,
-                                        COUNT(DISTINCT time_point) as tp_count,
-                                        MIN({gender_col}) as gender
-                                    FROM {table_name}
-                                    WHERE time_point IN (1,2,3,4,5,6)
-                                    GROUP BY pid
-                                    HAVING COUNT(DISTINCT time_point) = 6  -- All timepoints required in this case
-                                )
-                                {base_select}
-                            """
-                        cursor.execute(count_query)
-                        row = cursor.fetchone()
-                        count = row[0]
-                        male_count = row[1] or 0  # Use 0 if NULL
-                        female_count = row[2] or 0  # Use 0 if NULL
-                        other_count = row[3] or 0  # Use 0 if NULL
-                        
-                        # Update counts
-                        counts[table_type] = count
-                        counts['total'] += count
-                        counts['gender'][table_type]['M'] = male_count
-                        counts['gender'][table_type]['F'] = female_count
-                        counts['gender'][table_type]['O'] = other_count
-                        
-                    except pyodbc.Error as e:
-                        print(f"Error counting rows in {table_name}: {e}")
-                
-                results[modality] = {
-                    'counts': counts
-                }
+                    tasks.append((
+                        ('baseline', table_config['name']),
+                        partial(
+                            _run_with_connection, _baseline_table_counts, table_config,
+                            labels={'modality': modality, 'table': table_config['name']}
+                        )
+                    ))
+            elif stale is not None:
+                tasks.append((('delta', cache_key), partial(
+                    _run_with_connection, _refresh_filter_counts, modality, logic_parameters, *stale,
+                    labels={'modality': modality}
+                )))
             else:
                 # Original logic for when there are logic parameters
-                query, params = build_filter_queries(modality, logic_parameters)
-                try:
-                    cursor.execute(query, params)
-                    rows = cursor.fetchall()
-                    counts = {
-                        'total': 0,
-                        'children': 0,
-                        'adults': 0,
-                        'gender': {
-                            'children': {'M': 0, 'F': 0, 'O': 0},
-                            'adults': {'M': 0, 'F': 0, 'O': 0}
-                        }
-                    }
-                    
-                    for row in rows:
-                        if row and len(row) >= 5:  # count, source, male_count, female_count, other_count
-                            count = row[0] or 0  # Use 0 if count is None
-                            source = row[1]
-                            male_count = row[2] or 0
-                            female_count = row[3] or 0
-                            other_count = row[4] or 0
-                            
-                            # Normalize source type to match our expected keys
-                            source_type = source.lower()  # Convert to lowercase to handle any case variations
-                            if source_type in ['children', 'adults']:  # Make sure it's a valid source type
-                                counts[source_type] = count
-                                counts['total'] += count
-                                counts['gender'][source_type]['M'] = male_count
-                                counts['gender'][source_type]['F'] = female_count
-                                counts['gender'][source_type]['O'] = other_count
-                    
-                    results[modality] = {
-                        'counts': counts,
-                        'query': query
-                    }
-                except pyodbc.Error as e:
-                    results[modality] = {
-                        'error': str(e),
-                        'query': query  # Include failed query for debugging
-                    }
-
-        cursor.close()
-        conn.close()
+                tasks.append((cache_key, partial(
+                    _run_with_connection, _filter_counts, modality, logic_parameters, labels={'modality': modality}
+                )))
+        outcomes = iter(_run_coalesced(tasks))
 
+        for modality, logic_parameters, baseline, cache_key, stale in pending:
+            members = None
+            if baseline:
+                counts = _empty_baseline_counts()
+                for table_config in MODALITY_MAPPING[modality]['tables']:
+                    outcome = next(outcomes)
+                    if isinstance(outcome, ConnectionError):
+                        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+                    if isinstance(outcome, QueryTimeout):
+                        print(f"Error counting rows in {table_config['name']}: {outcome}")
+                    elif isinstance(outcome, Exception):
+                        raise outcome
+                    elif outcome is not None:
+                        _merge_baseline_counts(counts, table_config['type'], outcome)
+                result = {'counts': counts}
+            else:
+                result = next(outcomes)
+                if isinstance(result, ConnectionError):
+                    return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+                if isinstance(result, QueryTimeout):
+                    result = {'error': str(result)}
+                elif isinstance(result, Exception):
+                    raise result
+                # Outcomes can be shared with other requests, so the pids are split off a copy
+                members = result.get('members')
+                result = {k: v for k, v in result.items() if k != 'members'}
+
+            if stale is not None and 'error' not in result:
+                result_cache.resolve(cache_key, result, members, stale[2])
+            elif 'error' not in result:
+                result_cache.put(cache_key, result, _modality_tables(modality), members)
+            results[modality] = result
+
+        if not include_query:
+            # The generated SQL is only sent when asked for ("debug": true); cached results keep it
+            results = {m: {k: v for k, v in r.items() if k != 'query'} for m, r in results.items()}
         return jsonify({
             'status': 'success',
             'results': results
         })
 
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/export-data', methods=['POST'])
+def export_data():
+    """Stream the participants matching one modality filter as CSV or NDJSON"""
+    try:
+        modality = request.json.get('modality')
+        logic_parameters = request.json.get('logicParameters') or []
+        export_format = str(request.json.get('format') or 'csv').lower()
+        include_variables = bool(request.json.get('includeVariables', False))
+
+        if modality not in MODALITY_MAPPING:
+            return jsonify({'status': 'error', 'message': 'Invalid modality'}), 400
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'status': 'error', 'message': f"Unsupported export format: {export_format}"}), 400
+
+        try:
+            queries = build_export_queries(modality, logic_parameters, include_variables)
+        except (ValueError, TypeError, KeyError) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        if include_variables:
+            # Check the columns up front: errors after the first chunk can no longer change the status code
+            variables = [v['name'] for v in (logic_parameters[0].get('variables') or [])] if logic_parameters else []
+            selected_tables, _ = _selected_tables(modality, logic_parameters)
+            for table_config in selected_tables:
+                columns = schema_catalog.columns(table_config['name'])
+                if columns is None:
+                    continue
+                known = {name.lower() for name, _ in columns}
+                missing = [v for v in variables if v.lower() not in known]
+                if missing:
+                    return jsonify({
+                        'status': 'error',
+                        'message': f"Variables not in {table_config['name']}: {', '.join(missing)}"
+                    }), 400
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+        conn.timeout = QUERY_CONCURRENCY['TIMEOUT']
+
+        response = Response(
+            stream_export(conn, queries, export_format, batch_size=EXPORT_FETCH_SIZE),
+            mimetype=EXPORT_FORMATS[export_format],
+            headers={'Content-Disposition': f'attachment; filename="{modality}.{export_format}"'}
+        )
+        # A stream closed before its first chunk never runs the generator's cleanup
+        response.call_on_close(conn.close)
+        # Keep the export's admission slot until the stream is closed, not just until this view returns
+        admitted = g.pop('admitted', None)
+        if admitted is not None:
+            response.call_on_close(admitted.release)
+        return response
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/query-sweep', methods=['POST'])
+def query_sweep():
+    """Return /query-data counts for a list of cutoffs (or a grid over two variables) from one scan per table"""
+    try:
+        modality = request.json.get('modality')
+        logic_parameters = request.json.get('logicParameters') or []
+        use_cache = not request.json.get('bypassCache', False)
+        if modality not in MODALITY_MAPPING:
+            return jsonify({'status': 'error', 'message': 'Invalid modality'}), 400
+        try:
+            dimensions = _sweep_dimensions(request.json.get('sweep'))
+            selected_tables, logic_param = _selected_tables(modality, logic_parameters)
+            timepoints = canonical_filter_spec(modality, logic_parameters)['timepoints']
+            compile_thresholds(logic_param.get('thresholds') or [])  # Reject invalid base thresholds up front
+        except (ValueError, TypeError, KeyError) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        cache_key = json.dumps([
+            'sweep', filter_cache_key(modality, logic_parameters),
+            [[v['name'], operator, cutoffs] for v, operator, cutoffs in dimensions]
+        ])
+        if use_cache:
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                return jsonify({'status': 'success', **cached})
+        else:
+            result_cache.record_bypass()
+
+        outcomes = query_executor.run([
+            partial(
+                _run_with_connection, _sweep_table, table_config, logic_param, timepoints, dimensions,
+                labels={'modality': modality, 'table': table_config['name']}
+            )
+            for table_config in selected_tables
+        ])
+        if not participants_dimension.ready():
+            participants_dimension.refresh()
+
+        shape = tuple(len(cutoffs) for _, _, cutoffs in dimensions)
+        by_gender = {}  # table type -> (count per cell, M, F, O) arrays
+        for table_config, outcome in zip(selected_tables, outcomes):
+            if isinstance(outcome, ConnectionError):
+                return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+            if isinstance(outcome, DeadlineExceeded):
+                return _deadline_response(outcome)
+            if isinstance(outcome, Exception):
+                return jsonify({'status': 'error', 'message': str(outcome)}), 500
+            pids, qualifying = outcome
+            codes = participants_dimension.codes(pids)
+            if codes is None:
+                return _genders_unavailable_response()
+            cells = [qualifying[codes == code].sum(axis=0) for code in (GENDER_NULL, GENDER_M, GENDER_F, GENDER_O)]
+            # Missing participants and NULL genders count as other, as in the filter counts
+            by_gender[table_config['type']] = (qualifying.sum(axis=0), cells[1], cells[2], cells[0] + cells[3])
+
+        results = []
+        for cell in np.ndindex(*shape):
+            counts = {
+                'total': 0,
+                'children': 0,
+                'adults': 0,
+                'gender': {
+                    'children': {'M': 0, 'F': 0, 'O': 0},
+                    'adults': {'M': 0, 'F': 0, 'O': 0}
+                }
+            }
+            for table_type, (count, male_count, female_count, other_count) in by_gender.items():
+                counts[table_type] = int(count[cell])
+                counts['total'] += int(count[cell])
+                counts['gender'][table_type]['M'] = int(male_count[cell])
+                counts['gender'][table_type]['F'] = int(female_count[cell])
+                counts['gender'][table_type]['O'] = int(other_count[cell])
+            results.append({
+                'cutoffs': [dimensions[axis][2][i] for axis, i in enumerate(cell)],
+                'counts': counts
+            })
+
+        result = {
+            'variables': [{'name': v['name'], 'operator': operator} for v, operator, _ in dimensions],
+            'results': results
+        }
+        result_cache.put(cache_key, result, _modality_tables(modality))
+        return jsonify({'status': 'success', **result})
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/query-waves', methods=['POST'])
+def query_waves():
+    """Return the /query-data counts at each wave, through each prefix of waves and by waves attended
+
+    Takes one filter (modality and logicParameters, as in /query-data); its timepoints
+    select the waves (default 1-6). Each table is scanned once, grouped by pid and
+    timepoint, and every wave combination is evaluated from those groups in process.
+    """
+    try:
+        modality = request.json.get('modality')
+        logic_parameters = request.json.get('logicParameters') or []
+        use_cache = not request.json.get('bypassCache', False)
+        if modality not in MODALITY_MAPPING:
+            return jsonify({'status': 'error', 'message': 'Invalid modality'}), 400
+        try:
+            selected_tables, logic_param = _selected_tables(modality, logic_parameters)
+            waves = sorted(set(canonical_filter_spec(modality, logic_parameters)['timepoints']))
+            compile_thresholds(logic_param.get('thresholds') or [])  # Reject invalid thresholds up front
+        except (ValueError, TypeError, KeyError) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        logic_param = {**logic_param, 'timepoints': waves}
+
+        cache_key = json.dumps(['waves', filter_cache_key(modality, logic_parameters)])
+        if use_cache:
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                return jsonify({'status': 'success', **cached})
+        else:
+            result_cache.record_bypass()
+
+        outcomes = query_executor.run([
+            partial(
+                _run_with_connection, _wave_table, table_config, logic_param, waves,
+                labels={'modality': modality, 'table': table_config['name']}
+            )
+            for table_config in selected_tables
+        ])
+        if not participants_dimension.ready():
+            participants_dimension.refresh()
+
+        by_gender = {}  # table type -> {breakdown: (count, M, F, O) arrays}
+        for table_config, outcome in zip(selected_tables, outcomes):
+            if isinstance(outcome, ConnectionError):
+                return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+            if isinstance(outcome, DeadlineExceeded):
+                return _deadline_response(outcome)
+            if isinstance(outcome, Exception):
+                return jsonify({'status': 'error', 'message': str(outcome)}), 500
+            pids, at_wave, through_wave = outcome
+            codes = participants_dimension.codes(pids)
+            if codes is None:
+                return _genders_unavailable_response()
+            # Number of waves each participant qualifies at (a popcount of its wave mask)
+            attended = at_wave.sum(axis=1)
+            by_attendance = np.stack([attended == k for k in range(1, len(waves) + 1)], axis=1)
+            breakdowns = {}
+            for name, qualifying in (('waves', at_wave), ('through', through_wave), ('attendance', by_attendance)):
+                cells = [qualifying[codes == code].sum(axis=0) for code in (GENDER_NULL, GENDER_M, GENDER_F, GENDER_O)]
+                # Missing participants and NULL genders count as other, as in the filter counts
+                breakdowns[name] = (qualifying.sum(axis=0), cells[1], cells[2], cells[0] + cells[3])
+            by_gender[table_config['type']] = breakdowns
+
+        def counts_at(name, i):
+            counts = {
+                'total': 0,
+                'children': 0,
+                'adults': 0,
+                'gender': {
+                    'children': {'M': 0, 'F': 0, 'O': 0},
+                    'adults': {'M': 0, 'F': 0, 'O': 0}
+                }
+            }
+            for table_type, breakdowns in by_gender.items():
+                count, male_count, female_count, other_count = breakdowns[name]
+                counts[table_type] = int(count[i])
+                counts['total'] += int(count[i])
+                counts['gender'][table_type]['M'] = int(male_count[i])
+                counts['gender'][table_type]['F'] = int(female_count[i])
+                counts['gender'][table_type]['O'] = int(other_count[i])
+            return counts
+
+        result = {
+            'timepoints': waves,
+            'waves': [{'time_point': tp, 'counts': counts_at('waves', i)} for i, tp in enumerate(waves)],
+            'through': [
+                {'timepoints': waves[:i + 1], 'counts': counts_at('through', i)} for i in range(len(waves))
+            ],
+            'attendance': [{'waves': i + 1, 'counts': counts_at('attendance', i)} for i in range(len(waves))]
+        }
+        result_cache.put(cache_key, result, _modality_tables(modality))
+        return jsonify({'status': 'success', **result})
+
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/timepoint-index', methods=['GET', 'POST'])
+def timepoint_index_status():
+    """Report the timepoint index memory footprint and freshness (POST rebuilds it)"""
+    if request.method == 'POST':
+        timepoint_index.refresh(rebuild=True)
+    return jsonify({'status': 'success', 'index': timepoint_index.stats()})
+
+@app.route('/columnar-engine', methods=['GET', 'POST'])
+def columnar_engine_status():
+    """Report column snapshot sizes and how often the columnar engine fell back to SQL (POST reloads them)"""
+    if request.method == 'POST':
+        columnar_engine.refresh(rebuild=True)
+    return jsonify({'status': 'success', 'engine': columnar_engine.stats()})
+
+@app.route('/baseline-counts', methods=['GET', 'POST'])
+def baseline_counts_status():
+    """Report the materialized default counts and when each table was last refreshed (POST recomputes them)"""
+    if request.method == 'POST':
+        baseline_counts.refresh()
+    return jsonify({'status': 'success', 'baseline': baseline_counts.stats()})
+
+@app.route('/participants-dimension', methods=['GET', 'POST'])
+def participants_dimension_status():
+    """Report the participant gender maps and how often counts fell back to SQL genders (POST reloads them)"""
+    if request.method == 'POST':
+        participants_dimension.refresh(full=True)
+    return jsonify({'status': 'success', 'participants': participants_dimension.stats()})
+
+@app.route('/snapshots')
+def snapshots_status():
+    """Report the published on-disk snapshot versions and what this worker has mapped"""
+    if snapshot_store is None:
+        return jsonify({'status': 'success', 'snapshots': None, 'message': 'SNAPSHOT_DIR is not set'})
+    return jsonify({'status': 'success', 'snapshots': snapshot_store.stats()})
+
+@app.route('/data-freshness', methods=['GET', 'POST'])
+def data_freshness():
+    """Report per table when data last changed and which in-memory results still lag behind it
+
+    Changes narrowed down to pids are applied to the default counts and the timepoint
+    index as deltas; a component is behind while its last update predates the change.
+    POST checks for changes right away instead of waiting for the poll interval.
+    """
+    if request.method == 'POST':
+        change_tracker.poll()
+    tracked = change_tracker.stats()
+    applied = {
+        'baseline_counts': {t.lower(): at for t, at in baseline_counts.refreshed_at().items()},
+        'timepoint_index': {t.lower(): at for t, at in timepoint_index.updated_at().items()}
+    }
+    now = time.time()
+    tables = {}
+    for table, state in tracked['tables'].items():
+        changed_at = state['changed_at']
+        updated = {name: at.get(table.lower()) for name, at in applied.items() if table.lower() in at}
+        behind = sorted(name for name, at in updated.items() if changed_at and (at is None or at < changed_at))
+        tables[table] = {
+            **state,
+            'updated_at': updated,
+            'behind': behind,
+            'staleness_seconds': round(now - changed_at, 3) if behind else 0
+        }
+    return jsonify({'status': 'success', 'freshness': {**tracked, 'tables': tables}})
+
+@app.route('/query-coalescing')
+def query_coalescing_stats():
+    """Report how many query executions were saved by sharing identical in-flight queries"""
+    return jsonify({'status': 'success', 'coalescing': query_flights.stats()})
+
+@app.route('/variable-stats')
+def variable_stats_status():
+    """Report which tables have variable statistics and when they were built"""
+    return jsonify({'status': 'success', 'statistics': variable_statistics.stats()})
+
+@app.route('/slow-queries', methods=['GET', 'POST'])
+def slow_queries_status():
+    """Per-fingerprint query statistics and the slowest recent executions
+
+    ?fingerprint=<id> narrows the log to one query shape and includes its captured
+    plan; ?limit=N caps the fingerprint list; POST clears everything first.
+    """
+    if request.method == 'POST':
+        slow_queries.clear()
+    fingerprint = request.args.get('fingerprint')
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit must be an integer'}), 400
+    result = {
+        'threshold_ms': slow_queries.threshold_ms,
+        'capture_plans': slow_queries.capture_plans,
+        'fingerprints': slow_queries.fingerprints(limit),
+        'slow': slow_queries.entries(fingerprint)
+    }
+    if fingerprint:
+        result['fingerprints'] = [f for f in slow_queries.fingerprints(None) if f['fingerprint'] == fingerprint]
+        result['plan'] = slow_queries.plan(fingerprint)
+    return jsonify({'status': 'success', 'slow_queries': result})
+
+@app.route('/admission')
+def admission_status():
+    """Report running and queued query requests and exports, load shed with 503 and deadlines that expired"""
+    return jsonify({
+        'status': 'success',
+        'admission': admission.stats(),
+        'exports': export_admission.stats(),
+        'deadlines': deadline_watchdog.stats()
+    })
+
+@app.route('/index-advisor')
+def index_advisor():
+    """Recommend (pid, time_point) covering and filtered indexes from the recorded filter workload
+
+    ?dialect=sqlite emits DDL for a SQLite stand-in instead of SQL Server.
+    """
+    dialect = request.args.get('dialect', 'mssql')
+    if dialect not in DIALECTS:
+        return jsonify({'status': 'error', 'message': f'dialect must be one of {", ".join(DIALECTS)}'}), 400
+    try:
+        profiles = _run_with_connection(profile_workload, filter_workload, PARTICIPANTS_TABLE)
+    except ConnectionError:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    return jsonify({
+        'status': 'success',
+        'workload': filter_workload.stats(),
+        'recommendations': recommend(filter_workload, profiles, PARTICIPANTS_TABLE, dialect=dialect)
+    })
+
+def _component_metrics():
+    """Pool, cache and coalescing state exported as gauges on /metrics"""
+    pool = db_pool.stats()
+    cache = result_cache.stats()
+    flights = query_flights.stats()
+    samples = [
+        ('db_pool_connections', 'Pooled connections by state', {'state': state}, pool[state])
+        for state in ('size', 'in_use', 'idle', 'waiting')
+    ]
+    samples += [
+        ('result_cache_events', 'Result cache counters since start', {'event': event}, cache[event])
+        for event in ('hits', 'misses', 'bypasses', 'stores', 'evictions', 'invalidations', 'delta_refreshes')
+    ]
+    changes = change_tracker.stats()
+    samples += [
+        ('data_changes', 'Data changes detected per table by kind', {'table': table, 'kind': kind}, state[kind])
+        for table, state in changes['tables'].items()
+        for kind in ('delta_changes', 'full_changes')
+    ]
+    samples += [
+        ('query_coalescing', 'Query executions run and saved by coalescing', {'kind': kind}, flights[kind])
+        for kind in ('executions', 'coalesced', 'in_flight')
+    ]
+    admitted = admission.stats()
+    samples += [
+        ('query_admission', 'Query requests running, queued and shed', {'state': state}, admitted[state])
+        for state in ('running', 'waiting', 'rejected', 'timed_out')
+    ]
+    exports = export_admission.stats()
+    samples += [
+        ('export_admission', 'Exports running, queued and shed', {'state': state}, exports[state])
+        for state in ('running', 'waiting', 'rejected', 'timed_out')
+    ]
+    samples.append((
+        'query_deadlines_expired', 'Requests cancelled at their deadline', {}, deadline_watchdog.stats()['expired']
+    ))
+    return samples
+
+metrics.add_collector(_component_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of request/query latency histograms, error counters and gauges"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache-stats')
+def cache_stats():
+    """Report result cache hit/miss counters and size"""
+    return jsonify({'status': 'success', 'cache': result_cache.stats()})
+
+baseline_counts.start()
+
 if __name__ == '__main__':
     app.run(debug=True, host='localhost', port=5000)
\ No newline at end of file
@@ -0,0 +1,245 @@
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, db_pool, metrics
+
+# Async serving mode: `uvicorn asgi:application`
+ASGI_CONFIG = {
+    'MAX_WORKERS': int(os.getenv('ASGI_MAX_WORKERS', 64)),  # requests executing at once (threads blocked on the database)
+    'MAX_QUEUE': int(os.getenv('ASGI_MAX_QUEUE', 128)),  # requests waiting for a worker before new ones get 503
+    'SHUTDOWN_TIMEOUT': float(os.getenv('ASGI_SHUTDOWN_TIMEOUT', 30)),  # seconds to let running requests finish
+    'RETRY_AFTER': int(os.getenv('ASGI_RETRY_AFTER', 2))  # seconds clients are told to wait when load is shed
+}
+
+_END = object()
+
+
+def _next_chunk(iterator):
+    return next(iterator, _END)
+
+
+class WSGIBridge:
+    """ASGI front end that runs the Flask app's handlers on a bounded thread pool
+
+    The event loop only moves bytes: each request (including every chunk pulled
+    from a streaming response) runs on one of max_workers threads, where blocking
+    pyodbc calls release the GIL, so one process holds up to max_workers slow
+    queries at once. At most max_queue further requests wait for a thread; beyond
+    that, and while shutting down, requests are answered 503 with Retry-After
+    straight from the loop. When a client disconnects, the queries of its request
+    are cancelled and a streamed response's iterator is closed, which cancels the
+    export query behind it.
+    """
+
+    def __init__(self, wsgi_app, max_workers=64, max_queue=128, shutdown_timeout=30, retry_after=2,
+                 on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.shutdown_timeout = shutdown_timeout
+        self.retry_after = retry_after
+        self.on_shutdown = on_shutdown
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asgi')
+        self._active = 0  # admitted requests not yet finished (running or waiting for a thread)
+        self._idle = None
+        self._closing = False
+        self._counters = {'admitted': 0, 'rejected': 0, 'disconnected': 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._idle = asyncio.Event()
+                self._idle.set()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def shutdown(self):
+        """Stop admitting requests, give running ones shutdown_timeout seconds, then release resources"""
+        self._closing = True
+        if self._idle is not None and self._active:
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.shutdown_timeout)
+            except asyncio.TimeoutError:
+                print(f"Shutting down with {self._active} requests still running", file=sys.stderr)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.on_shutdown:
+            self.on_shutdown()
+
+    def stats(self):
+        return {
+            'active': self._active,
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'closing': self._closing,
+            **self._counters
+        }
+
+    async def _reject(self, send):
+        self._counters['rejected'] += 1
+        body = b'{"message":"Server is busy, retry shortly","status":"error"}\n'
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(self.retry_after).encode())
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _http(self, scope, receive, send):
+        if self._closing or self._active >= self.max_workers + self.max_queue:
+            await self._reject(send)
+            return
+        self._active += 1
+        self._counters['admitted'] += 1
+        if self._idle is not None:
+            self._idle.clear()
+        try:
+            await self._serve(scope, receive, send)
+        finally:
+            self._active -= 1
+            if not self._active and self._idle is not None:
+                self._idle.set()
+
+    async def _serve(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                self._counters['disconnected'] += 1
+                return
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+        environ = self._environ(scope, b''.join(body))
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        disconnected.add_done_callback(lambda task: task.cancelled() or self._cancel_request(environ))
+        try:
+            status, headers, result, iterator, chunk = await loop.run_in_executor(self._executor, self._start, environ)
+        except BaseException:
+            disconnected.cancel()
+            raise
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            while chunk is not _END:
+                if disconnected.done():
+                    self._counters['disconnected'] += 1
+                    return
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(self._executor, _next_chunk, iterator)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            disconnected.cancel()
+            close = getattr(result, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(self._executor, close)
+
+    @staticmethod
+    def _cancel_request(environ):
+        """Cancel the queries of a request whose client went away (see admission_control.Deadline)"""
+        deadline = environ.get('databaseapp.deadline')
+        if deadline is not None:
+            deadline.cancel('client disconnected')
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    def _start(self, environ):
+        """Call the WSGI app and pull the first chunk (runs on a worker thread)"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            return lambda data: None  # The write() callable is not supported; Flask never uses it
+
+        result = self.wsgi_app(environ, start_response)
+        iterator = iter(result)
+        try:
+            chunk = _next_chunk(iterator)  # Generators only call start_response once they run
+        except BaseException:
+            if hasattr(result, 'close'):
+                result.close()
+            raise
+        return response['status'], response['headers'], result, iterator, chunk
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+
+application = WSGIBridge(
+    app,
+    max_workers=ASGI_CONFIG['MAX_WORKERS'],
+    max_queue=ASGI_CONFIG['MAX_QUEUE'],
+    shutdown_timeout=ASGI_CONFIG['SHUTDOWN_TIMEOUT'],
+    retry_after=ASGI_CONFIG['RETRY_AFTER'],
+    on_shutdown=db_pool.close_all
+)
+
+
+def _bridge_metrics():
+    stats = application.stats()
+    return [
+        ('asgi_requests', 'ASGI requests admitted, running or rejected with 503', {'state': state}, stats[state])
+        for state in ('active', 'admitted', 'rejected', 'disconnected')
+    ]
+
+
+metrics.add_collector(_bridge_metrics)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(application, host='localhost', port=5000, timeout_graceful_shutdown=ASGI_CONFIG['SHUTDOWN_TIMEOUT'])
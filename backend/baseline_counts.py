@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+
+
+class BaselineCounts:
+    """Materialized default counts (all six timepoints, by gender) for every mapped table
+
+    The "no logic parameters" answer only changes when data is loaded, so it is
+    computed once per table and served from memory. A per-process scheduler thread
+    recomputes it every refresh_interval seconds, or right away for the tables passed
+    to invalidate().
+
+    When compute_tables also returns the qualifying participants of a table
+    ((sorted pids, gender codes) as a fifth element), changes narrowed down to pids
+    (apply_changes) are applied with compute_delta, which re-checks only those
+    participants, instead of recounting the table.
+    """
+
+    def __init__(self, compute_tables, modality_mapping, participants_table, refresh_interval=900,
+                 compute_delta=None):
+        self._compute_tables = compute_tables  # [table_config, ...] -> [(total, M, F, O[, members]) or None, ...]
+        # [(table_config, members, pids), ...] -> [(total, M, F, O, members) or None, ...]
+        self._compute_delta = compute_delta
+        self._mapping = modality_mapping
+        self.participants_table = participants_table
+        self.refresh_interval = refresh_interval
+        self._counts = {}  # table name -> ((total, M, F, O), refreshed_at)
+        self._members = {}  # table name -> (sorted pids, gender codes) of the counted participants
+        self._pending = set()
+        self._deltas = {}  # table name -> [pid arrays] waiting to be applied
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._scheduler_pid = None
+        self._counters = {
+            'served': 0, 'misses': 0, 'refreshes': 0, 'delta_refreshes': 0, 'refresh_errors': 0
+        }
+
+    def _all_tables(self):
+        return [t for m in self._mapping.values() for t in m['tables']]
+
+    def refresh(self, tables=None):
+        """Recompute counts for the given table names (default: every mapped table)"""
+        configs = [t for t in self._all_tables() if tables is None or t['name'] in tables]
+        outcomes = self._compute_tables(configs)
+        refreshed_at = time.time()
+        ok = True
+        with self._lock:
+            for table_config, outcome in zip(configs, outcomes):
+                if outcome is None or isinstance(outcome, Exception):
+                    ok = False
+                    self._counters['refresh_errors'] += 1
+                    continue
+                self._counts[table_config['name']] = (tuple(outcome[:4]), refreshed_at)
+                if len(outcome) > 4:
+                    self._members[table_config['name']] = outcome[4]
+                else:
+                    self._members.pop(table_config['name'], None)
+            self._counters['refreshes'] += 1
+        return ok
+
+    def refresh_deltas(self, deltas):
+        """Apply {table name: [pid arrays]}; tables whose delta cannot be applied are recounted"""
+        by_name = {t['name']: t for t in self._all_tables()}
+        with self._lock:
+            items = [
+                (by_name[name], self._members[name], np.unique(np.concatenate(pids)))
+                for name, pids in deltas.items() if name in self._members
+            ]
+        fallback = {name for name in deltas if name not in self._members}
+        outcomes = self._compute_delta(items) if items else []
+        refreshed_at = time.time()
+        with self._lock:
+            for (table_config, _, _), outcome in zip(items, outcomes):
+                if outcome is None or isinstance(outcome, Exception):
+                    fallback.add(table_config['name'])
+                    continue
+                self._counts[table_config['name']] = (tuple(outcome[:4]), refreshed_at)
+                self._members[table_config['name']] = outcome[4]
+                self._counters['delta_refreshes'] += 1
+        if fallback:
+            self.refresh(fallback)
+
+    def invalidate(self, tables):
+        """Schedule an immediate recompute of changed tables (a participants change recomputes all)"""
+        tables = {t.lower() for t in tables}
+        with self._lock:
+            for table_config in self._all_tables():
+                if table_config['name'].lower() in tables or self.participants_table.lower() in tables:
+                    self._pending.add(table_config['name'])
+        self._wake.set()
+
+    def apply_changes(self, changes):
+        """ChangeTracker listener: re-check the affected participants, or recount tables changed as a whole"""
+        if self._compute_delta is None or self.participants_table.lower() in {t.lower() for t in changes}:
+            self.invalidate(changes)
+            return
+        names = {t['name'].lower(): t['name'] for t in self._all_tables()}
+        with self._lock:
+            for table, pids in changes.items():
+                name = names.get(table.lower())
+                if name is None:
+                    continue
+                if pids is None:
+                    self._pending.add(name)
+                elif len(pids):
+                    self._deltas.setdefault(name, []).append(pids)
+        self._wake.set()
+
+    def refreshed_at(self):
+        """Time each table's counts were last computed"""
+        with self._lock:
+            return {name: refreshed_at for name, (_, refreshed_at) in self._counts.items()}
+
+    def _run_scheduler(self):
+        next_full = time.monotonic()
+        while True:
+            self._wake.wait(max(0, next_full - time.monotonic()))
+            self._wake.clear()
+            with self._lock:
+                pending, self._pending = self._pending, set()
+                deltas = {name: pids for name, pids in self._deltas.items() if name not in pending}
+                self._deltas = {}
+            try:
+                if time.monotonic() >= next_full:
+                    ok = self.refresh()
+                    # Retry sooner when the database was unavailable
+                    next_full = time.monotonic() + (self.refresh_interval if ok else min(60, self.refresh_interval))
+                else:
+                    if pending:
+                        self.refresh(pending)
+                    if deltas:
+                        self.refresh_deltas(deltas)
+            except Exception as e:
+                print(f"Error refreshing baseline counts: {e}")
+                self._counters['refresh_errors'] += 1
+                next_full = time.monotonic() + min(60, self.refresh_interval)
+
+    def start(self):
+        """Make sure this process runs a scheduler thread (threads do not survive fork())"""
+        with self._lock:
+            if self._scheduler_pid == os.getpid():
+                return
+            self._scheduler_pid = os.getpid()
+        threading.Thread(target=self._run_scheduler, name='baseline-counts', daemon=True).start()
+
+    def answer(self, modality):
+        """Return the materialized counts for a modality, or None if not all tables are available"""
+        counts = {
+            'total': 0,
+            'children': 0,
+            'adults': 0,
+            'gender': {
+                'children': {'M': 0, 'F': 0},
+                'adults': {'M': 0, 'F': 0}
+            }
+        }
+        refreshed = []
+        with self._lock:
+            for table_config in self._mapping.get(modality, {}).get('tables', []):
+                entry = self._counts.get(table_config['name'])
+                if entry is None:
+                    self._counters['misses'] += 1
+                    return None
+                (count, male_count, female_count, other_count), refreshed_at = entry
+                table_type = table_config['type']
+                counts[table_type] = count
+                counts['total'] += count
+                counts['gender'][table_type]['M'] = male_count
+                counts['gender'][table_type]['F'] = female_count
+                counts['gender'][table_type]['O'] = other_count
+                refreshed.append(refreshed_at)
+            if not refreshed:
+                return None
+            self._counters['served'] += 1
+        return {'counts': counts, 'refreshed_at': _isoformat(min(refreshed))}
+
+    def stats(self):
+        """Materialized counts and refresh time per table"""
+        with self._lock:
+            return {
+                'refresh_interval': self.refresh_interval,
+                'tables': {
+                    name: {
+                        'counts': list(values),
+                        'refreshed_at': _isoformat(refreshed_at),
+                        'delta_refresh': name in self._members
+                    }
+                    for name, (values, refreshed_at) in self._counts.items()
+                },
+                'pending': sorted(self._pending),
+                'pending_deltas': sorted(self._deltas),
+                **self._counters
+            }
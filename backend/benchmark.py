@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import synthetic_data
+
+MODALITY_VARIABLES = {
+    'Diet_Data_Totals': synthetic_data.ASA24_COLUMNS,
+    'Qualtrics_Data': synthetic_data.QUALTRICS_COLUMNS,
+    'Demographic_Data': ('age', 'grade', 'income', 'education')
+}
+COHORT_TYPES = ('children', 'adults')
+
+
+def _number(name):
+    return {'name': name, 'type': 'number'}
+
+
+def _filter(modality, timepoints=None, thresholds=None, cohorts=None, variables=None):
+    return {
+        'modality': modality,
+        'logicParameters': [{
+            'timepoints': timepoints or [],
+            'cohorts': cohorts or [],
+            'variables': [_number(v) for v in variables or []],
+            'thresholds': thresholds or []
+        }]
+    }
+
+
+def _timepoints(rng):
+    return sorted(rng.sample(synthetic_data.TIMEPOINTS, rng.randint(1, 6)))
+
+
+def _cohorts(rng):
+    return rng.choice([[], ['children'], ['adults'], ['children', 'adults']])
+
+
+# Scenario name -> function(rng) returning (method, path, body); bodies are randomized so each
+# request is a different question (results are not served from the result cache)
+SCENARIOS = {
+    'get_variables': lambda rng: (
+        'GET', f"/get-variables/{rng.choice(list(MODALITY_VARIABLES))}/{rng.choice(COHORT_TYPES)}", None
+    ),
+    'baseline': lambda rng: ('POST', '/query-data', {
+        'filters': [{'modality': m, 'logicParameters': []} for m in MODALITY_VARIABLES]
+    }),
+    'timepoints_only': lambda rng: ('POST', '/query-data', {
+        'filters': [_filter(rng.choice(list(MODALITY_VARIABLES)), _timepoints(rng), cohorts=_cohorts(rng))],
+        'bypassCache': True
+    }),
+    'single_threshold': lambda rng: ('POST', '/query-data', {
+        'filters': [_filter('Diet_Data_Totals', _timepoints(rng), [
+            {'variable': _number('KCAL'), 'operator': '>=', 'value': str(rng.randint(800, 3000))}
+        ])],
+        'bypassCache': True
+    }),
+    'multi_threshold': lambda rng: ('POST', '/query-data', {
+        'filters': [_filter('Qualtrics_Data', list(synthetic_data.TIMEPOINTS), [
+            {'variable': _number('Q1'), 'operator': '>=', 'value': str(rng.randint(1, 3))},
+            {'variable': _number('Q5'), 'operator': '<=', 'value': str(rng.randint(3, 5))},
+            {'variable': _number('Q10'), 'operator': 'IS NOT NULL'}
+        ], variables=['Q2'])],
+        'bypassCache': True
+    }),
+    'multi_modality': lambda rng: ('POST', '/query-data', {
+        'filters': [
+            _filter('Diet_Data_Totals', _timepoints(rng), [
+                {'variable': _number('PROT'), 'operator': '>', 'value': str(rng.randint(500, 2500))}
+            ]),
+            _filter('Qualtrics_Data', _timepoints(rng), [
+                {'variable': _number('Q3'), 'operator': '=', 'value': str(rng.randint(1, 5))}
+            ]),
+            _filter('Demographic_Data', _timepoints(rng), [
+                {'variable': _number('age'), 'operator': 'between', 'value': str(rng.randint(3, 30)),
+                 'value2': str(rng.randint(31, 60))}
+            ])
+        ],
+        'bypassCache': True
+    }),
+    'cached_repeat': lambda rng: ('POST', '/query-data', {
+        'filters': [_filter('Diet_Data_Totals', [1, 2, 3], [
+            {'variable': _number('KCAL'), 'operator': '>=', 'value': '1500'}
+        ])]
+    })
+}
+
+
+class InProcessClient:
+    """Requests against the Flask app in this process (no network in the measurement)"""
+
+    def __init__(self, flask_app):
+        self._app = flask_app
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class HTTPClient:
+    """Requests against a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data, method=method, headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-p * len(sorted_values) // 100)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(client, make_request, requests, concurrency, warmup, seed):
+    """Send `requests` requests from `concurrency` threads; returns latency percentiles and throughput"""
+    rng = random.Random(seed)
+    planned = [make_request(rng) for _ in range(warmup + requests)]
+    for method, path, body in planned[:warmup]:
+        client.request(method, path, body)
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    work = iter(planned[warmup:])
+
+    def worker():
+        while True:
+            with lock:
+                item = next(work, None)
+            if item is None:
+                return
+            method, path, body = item
+            started = time.perf_counter()
+            status, payload = client.request(method, path, body)
+            elapsed = time.perf_counter() - started
+            failed = status != 200 or b'"status":"error"' in payload.replace(b' ', b'')
+            with lock:
+                latencies.append(elapsed)
+                if failed:
+                    errors.append(f"{status}: {payload[:200].decode(errors='replace')}")
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'concurrency': concurrency,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _table_rows(path):
+    db = sqlite3.connect(path)
+    try:
+        tables = [synthetic_data.PARTICIPANTS_TABLE, *synthetic_data.TABLES]
+        return {t: db.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in tables}
+    finally:
+        db.close()
+
+
+def compare(results, baseline):
+    """Print p50/p95/p99 and throughput per scenario next to a previous results file"""
+    print(f"{'scenario':<18}{'metric':<16}{'before':>12}{'after':>12}{'change':>10}")
+    for name, after in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            old, new = before.get(metric), after.get(metric)
+            change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else ''
+            print(f"{name:<18}{metric:<16}{old!s:>12}{new!s:>12}{change:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark /get-variables and /query-data on synthetic study data in a SQLite stand-in'
+    )
+    parser.add_argument('--db', default='benchmark.db', help='SQLite stand-in database (generated if missing)')
+    parser.add_argument('--rows', type=int, default=10000, help='Approximate rows across the study tables')
+    parser.add_argument('--regenerate', action='store_true', help='Recreate the database even if it exists')
+    parser.add_argument('--url', help='Benchmark a running server instead of the app in this process')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated scenario names')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario')
+    parser.add_argument('--seed', type=int, default=2025)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='Previous results file to compare against')
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.scenarios.split(',') if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    if args.regenerate or not os.path.exists(args.db):
+        print(f"Generating {args.db} (~{args.rows} rows)...", file=sys.stderr)
+        synthetic_data.generate(args.db, synthetic_data.participants_for_rows(args.rows), args.seed)
+
+    if args.url:
+        client = HTTPClient(args.url)
+    else:
+        os.environ['DB_STANDIN_PATH'] = os.path.abspath(args.db)
+        from app import app  # Reads DB_STANDIN_PATH at import
+        client = InProcessClient(app)
+
+    results = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'target': args.url or 'in-process',
+        'dataset': {'path': args.db, 'seed': args.seed, 'tables': _table_rows(args.db)},
+        'settings': {
+            'requests': args.requests, 'concurrency': args.concurrency, 'warmup': args.warmup,
+            'env': {k: v for k, v in os.environ.items() if k.startswith(('QUERY_', 'TIMEPOINT_', 'PARTICIPANTS_',
+                                                                           'RESULT_CACHE_', 'DB_POOL_', 'COLUMNAR_'))}
+        },
+        'scenarios': {}
+    }
+    for offset, name in enumerate(names):
+        print(f"Running {name}...", file=sys.stderr)
+        results['scenarios'][name] = run_scenario(
+            client, SCENARIOS[name], args.requests, args.concurrency, args.warmup, args.seed + offset
+        )
+        summary = results['scenarios'][name]
+        print(f"  p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms, "
+              f"{summary['throughput_rps']} req/s, {summary['errors']} errors", file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import threading
+import time
+
+import numpy as np
+
+from timepoint_index import fetch_rows, pid_array, quote_identifier
+
+ROWVERSION_TYPES = ('timestamp', 'rowversion')
+
+
+def _display(value):
+    if isinstance(value, (bytes, bytearray)):
+        return '0x' + bytes(value).hex()
+    return str(value) if value is not None else None
+
+
+class ChangeTracker:
+    """Turns data changes in the mapped tables into the set of participants they affect
+
+    Each table is tracked by a rowversion column if it has one, otherwise by a
+    `watermark_column` (e.g. modified_at, set on insert and update). poll() reads
+    COUNT(*) and MAX(column) per table and, when the maximum moved, the DISTINCT
+    pids of the rows above the previous watermark. Listeners receive
+    {table: sorted pid array}, or {table: None} when the change cannot be narrowed
+    down to participants: tables without a tracking column, row counts that went
+    down (deletes), rows added without a tracking value, or a change reported by
+    TableVersionTracker (via tables_changed) that the watermark does not explain,
+    such as an update that did not touch the column.
+    """
+
+    def __init__(self, get_connection, tables, watermark_column='modified_at', poll_interval=30):
+        self._get_connection = get_connection
+        self.tables = sorted(set(tables))
+        self.watermark_column = watermark_column
+        self.poll_interval = poll_interval
+        self._names = {t.lower(): t for t in self.tables}
+        self._listeners = []
+        self._columns = None  # table -> (strategy, column) or (None, None)
+        self._state = {
+            t: {
+                'watermark': None, 'rows': None, 'checked_at': None, 'changed_at': None,
+                'changes': 0, 'delta_changes': 0, 'full_changes': 0, 'affected_pids': None, 'explained': False
+            }
+            for t in self.tables
+        }
+        self._polled_at = 0
+        self._polling = False
+        self._poll_lock = threading.Lock()  # one poll at a time
+        self._lock = threading.Lock()
+        self._counters = {'polls': 0, 'poll_errors': 0}
+
+    def add_listener(self, callback):
+        """Register callback(changes) with changes = {table: sorted pid array, or None for the whole table}"""
+        self._listeners.append(callback)
+
+    def _detect_columns(self, cursor):
+        placeholders = ','.join('?' for _ in self.tables)
+        cursor.execute(
+            f"""
+            SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_NAME IN ({placeholders})
+            """,
+            self.tables
+        )
+        columns = {t: (None, None) for t in self.tables}
+        for table_name, column_name, data_type in cursor.fetchall():
+            table = self._names.get(table_name.lower())
+            if table is None:
+                continue
+            if (data_type or '').lower() in ROWVERSION_TYPES:
+                columns[table] = ('rowversion', column_name)
+            elif column_name.lower() == self.watermark_column.lower() and columns[table][0] is None:
+                columns[table] = ('watermark', column_name)
+        return columns
+
+    def _changed_pids(self, cursor, table, column, low, high):
+        # >= low: rows stamped with the previous watermark but committed after it was read are included again
+        column = quote_identifier(column)
+        cursor.execute(f"SELECT DISTINCT pid FROM {table} WHERE {column} >= ? AND {column} <= ?", [low, high])
+        return np.unique(pid_array([row[0] for row in fetch_rows(cursor)]))
+
+    def poll(self, reported=()):
+        """Check every tracked table and notify listeners; reported = tables TableVersionTracker saw change"""
+        reported = {self._names[t.lower()] for t in reported if t.lower() in self._names}
+        with self._poll_lock:
+            changes = self._poll(reported)
+        if changes:
+            for callback in self._listeners:
+                try:
+                    callback(changes)
+                except Exception as e:
+                    print(f"Error in data change listener: {e}")
+        return changes
+
+    def _poll(self, reported):
+        conn = self._get_connection()
+        if not conn:
+            return {t: None for t in reported}
+        changes = {}
+        try:
+            cursor = conn.cursor()
+            try:
+                if self._columns is None or reported:
+                    self._columns = self._detect_columns(cursor)  # a reported change may be a schema change
+                for table in self.tables:
+                    strategy, column = self._columns[table]
+                    state = self._state[table]
+                    if strategy is None:
+                        if table in reported:
+                            changes[table] = None
+                        continue
+                    cursor.execute(f"SELECT COUNT(*), MAX({quote_identifier(column)}) FROM {table}")
+                    rows, watermark = cursor.fetchone()
+                    previous_rows, previous = state['rows'], state['watermark']
+                    with self._lock:
+                        state['rows'], state['watermark'], state['checked_at'] = rows, watermark, time.time()
+                    if previous_rows is None:
+                        if table in reported:
+                            changes[table] = None
+                        continue  # first poll establishes the baseline
+
+                    if rows < previous_rows:
+                        changes[table] = None
+                    elif watermark is not None and (previous is None or watermark > previous):
+                        if previous is None:
+                            changes[table] = None
+                        else:
+                            changes[table] = self._changed_pids(cursor, table, column, previous, watermark)
+                    elif rows != previous_rows or (table in reported and not state['explained']):
+                        changes[table] = None
+                    with self._lock:
+                        # A catalog report that follows a delta is explained by it
+                        state['explained'] = table in changes and changes[table] is not None and table not in reported
+            finally:
+                cursor.close()
+        except Exception as e:
+            print(f"Error polling data changes: {e}")
+            self._counters['poll_errors'] += 1
+            changes.update({t: None for t in reported if t not in changes})
+        finally:
+            conn.close()
+
+        now = time.time()
+        with self._lock:
+            self._polled_at = time.monotonic()
+            self._counters['polls'] += 1
+            for table, pids in changes.items():
+                state = self._state[table]
+                state['changed_at'] = now
+                state['changes'] += 1
+                state['delta_changes' if pids is not None else 'full_changes'] += 1
+                state['affected_pids'] = int(len(pids)) if pids is not None else None
+        return changes
+
+    def tables_changed(self, tables):
+        """TableVersionTracker listener: work out what changed in the reported tables"""
+        self.poll(tables)
+
+    def check(self):
+        """Start a background poll if the last one is older than poll_interval"""
+        if time.monotonic() - self._polled_at < self.poll_interval:
+            return
+        with self._lock:
+            if self._polling:
+                return
+            self._polling = True
+
+        def run():
+            try:
+                self.poll()
+            finally:
+                self._polling = False
+
+        threading.Thread(target=run, name='data-change-poll', daemon=True).start()
+
+    def stats(self):
+        """Tracking strategy, watermark and last detected change per table"""
+        columns = self._columns or {}
+        with self._lock:
+            tables = {
+                table: {
+                    'strategy': columns.get(table, (None, None))[0],
+                    'column': columns.get(table, (None, None))[1],
+                    'watermark': _display(state['watermark']),
+                    'rows': state['rows'],
+                    'checked_at': state['checked_at'],
+                    'changed_at': state['changed_at'],
+                    'changes': state['changes'],
+                    'delta_changes': state['delta_changes'],
+                    'full_changes': state['full_changes'],
+                    'last_affected_pids': state['affected_pids']
+                }
+                for table, state in self._state.items()
+            }
+            return {'poll_interval': self.poll_interval, 'tables': tables, **self._counters}
@@ -0,0 +1,103 @@
+from functools import reduce
+
+import numpy as np
+
+from timepoint_index import pid_array
+
+COHORTS = ('children', 'adults')
+
+
+def parse_combine(expression, filter_count):
+    """Validate a combine expression and return it as nested ('and' | 'or' | 'not' | 'filter', ...) tuples
+
+    An expression is a filter index, {"and": [...]}, {"or": [...]} or {"not": expr};
+    "AND" / "OR" combine every filter. NOT is a set difference, so it is only
+    accepted as an operand of an AND that has at least one positive operand.
+    """
+    if isinstance(expression, str) and expression.lower() in ('and', 'or'):
+        expression = {expression.lower(): list(range(filter_count))}
+    tree = _parse(expression, filter_count)
+    if tree[0] == 'not':
+        raise ValueError("NOT needs to be combined with AND, e.g. {\"and\": [0, {\"not\": 1}]}")
+    return tree
+
+
+def _parse(expression, filter_count):
+    if isinstance(expression, bool):
+        raise ValueError(f"Invalid combine expression: {expression!r}")
+    if isinstance(expression, int):
+        if not 0 <= expression < filter_count:
+            raise ValueError(f"Combine expression refers to filter {expression}, but only {filter_count} given")
+        return ('filter', expression)
+    if not isinstance(expression, dict) or len(expression) != 1:
+        raise ValueError(f"Invalid combine expression: {expression!r}")
+
+    op, operands = next(iter(expression.items()))
+    op = str(op).lower()
+    if op == 'not':
+        return ('not', _parse(operands, filter_count))
+    if op not in ('and', 'or') or not isinstance(operands, list) or not operands:
+        raise ValueError(f"Invalid combine expression: {expression!r}")
+    parsed = tuple(_parse(operand, filter_count) for operand in operands)
+    if op == 'or' and any(operand[0] == 'not' for operand in parsed):
+        raise ValueError("NOT can only be used inside AND")
+    if op == 'and' and all(operand[0] == 'not' for operand in parsed):
+        raise ValueError("AND needs at least one operand that is not negated")
+    return (op, parsed)
+
+
+def referenced_filters(tree):
+    """Indices of the filters an expression uses"""
+    if tree[0] == 'filter':
+        return {tree[1]}
+    if tree[0] == 'not':
+        return referenced_filters(tree[1])
+    return set().union(*(referenced_filters(operand) for operand in tree[1]))
+
+
+def pid_set(values):
+    """Sorted, de-duplicated pid array"""
+    return np.unique(pid_array(list(values)))
+
+
+# Empty sets short-circuit, so an empty (float) array never meets a string pid array
+
+def _union(left, right):
+    if not len(left):
+        return right
+    if not len(right):
+        return left
+    return np.union1d(left, right)
+
+
+def _intersect(left, right):
+    if not len(left):
+        return left
+    if not len(right):
+        return right
+    return np.intersect1d(left, right, assume_unique=True)
+
+
+def _difference(left, right):
+    if not len(left) or not len(right):
+        return left
+    return np.setdiff1d(left, right, assume_unique=True)
+
+
+def evaluate(tree, pid_sets):
+    """Evaluate an expression over sorted pid arrays (pid_sets[i] belongs to filter i)"""
+    kind = tree[0]
+    if kind == 'filter':
+        return pid_sets[tree[1]]
+    if kind == 'or':
+        return reduce(_union, (evaluate(operand, pid_sets) for operand in tree[1]))
+
+    positives = sorted(
+        (evaluate(operand, pid_sets) for operand in tree[1] if operand[0] != 'not'),
+        key=len  # Intersect the smallest sets first
+    )
+    result = reduce(_intersect, positives)
+    for operand in tree[1]:
+        if operand[0] == 'not' and len(result):
+            result = _difference(result, evaluate(operand[1], pid_sets))
+    return result
@@ -0,0 +1,401 @@
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+
+from filter_spec import ALL_TIMEPOINTS, canonical_filter_spec, select_tables
+from timepoint_index import (
+    GENDER_F, GENDER_M, GENDER_NULL, GENDER_O, fetch_rows, load_participant_genders, lookup, pid_array,
+    timepoint_mask
+)
+
+LIKE_WILDCARDS = ('%', '_', '[')
+SNAPSHOT_PREFIX = 'columnar-'
+
+
+def _fold(value):
+    """Compare strings the way SQL Server's default collation does: case-insensitive, trailing blanks ignored"""
+    return str(value).rstrip().casefold()
+
+
+def _column_kind(type_code, values):
+    if type_code is None:  # drivers without type information: infer from the first value
+        sample = next((v for v in values if v is not None), None)
+        type_code = type(sample) if sample is not None else None
+    if type_code is bool:
+        return None
+    if type_code in (int, float, Decimal):
+        return 'number'
+    if type_code in (datetime, date):
+        return 'datetime'
+    if type_code is str:
+        return 'string'
+    return None
+
+
+class Column:
+    """One column snapshot: values plus a null mask (strings dictionary-encoded)"""
+
+    __slots__ = ('kind', 'values', 'nulls', 'dictionary')
+
+    def __init__(self, kind, raw):
+        self.kind = kind
+        self.nulls = np.fromiter((v is None for v in raw), dtype=bool, count=len(raw))
+        self.dictionary = None
+        if kind == 'number':
+            self.values = np.array([np.nan if v is None else float(v) for v in raw], dtype=np.float64)
+        elif kind == 'datetime':
+            self.values = np.array(
+                [np.datetime64('NaT') if v is None else np.datetime64(v, 'us') for v in raw],
+                dtype='datetime64[us]'
+            )
+        else:
+            codes = {}
+            self.values = np.fromiter(
+                (-1 if v is None else codes.setdefault(v, len(codes)) for v in raw),
+                dtype=np.int32, count=len(raw)
+            )
+            self.dictionary = np.array(list(codes), dtype=object)
+
+    @classmethod
+    def from_arrays(cls, kind, values, nulls, dictionary=None):
+        """Column over existing arrays (e.g. memory-mapped from a snapshot store)"""
+        column = cls.__new__(cls)
+        column.kind = kind
+        column.values = values
+        column.nulls = nulls
+        column.dictionary = dictionary
+        return column
+
+    def nbytes(self):
+        size = self.values.nbytes + self.nulls.nbytes
+        if self.dictionary is not None:
+            size += self.dictionary.nbytes + sum(len(v) for v in self.dictionary)
+        return int(size)
+
+
+class TableSnapshot:
+    """Column snapshot of one study table with rows mapped to dense pid positions"""
+
+    def __init__(self, table_config, pids, pid_index, time_point, columns, participant_gender, built_at=None):
+        self.table_config = table_config
+        self.pids = pids
+        self.pid_index = pid_index
+        self.time_point = time_point
+        self.columns = columns  # lower-cased column name -> Column
+        self.participant_gender = participant_gender
+        self.built_at = built_at or time.time()
+
+    def to_arrays(self):
+        """(arrays, meta) for SnapshotStore.publish"""
+        arrays = {
+            'pids': self.pids, 'pid_index': self.pid_index, 'time_point': self.time_point,
+            'participant_gender': self.participant_gender
+        }
+        for name, column in self.columns.items():
+            arrays[f'column.{name}.values'] = column.values
+            arrays[f'column.{name}.nulls'] = column.nulls
+            if column.dictionary is not None:
+                arrays[f'column.{name}.dictionary'] = column.dictionary
+        return arrays, {'columns': {name: column.kind for name, column in self.columns.items()}}
+
+    @classmethod
+    def from_snapshot(cls, table_config, snapshot):
+        arrays = snapshot.arrays
+        columns = {
+            name: Column.from_arrays(
+                kind, arrays[f'column.{name}.values'], arrays[f'column.{name}.nulls'],
+                arrays.get(f'column.{name}.dictionary')
+            )
+            for name, kind in snapshot.meta['columns'].items()
+        }
+        return cls(
+            table_config, arrays['pids'], arrays['pid_index'], arrays['time_point'], columns,
+            arrays['participant_gender'], snapshot.created_at
+        )
+
+    def nbytes(self):
+        return int(
+            self.pids.nbytes + self.pid_index.nbytes + self.time_point.nbytes + self.participant_gender.nbytes +
+            sum(column.nbytes() for column in self.columns.values())
+        )
+
+
+class ColumnarEngine:
+    """Vectorized in-process evaluation of /query-data filters over NumPy column snapshots
+
+    Produces the same counts payload as the SQL built by compile_filter_query. answer()
+    returns None for anything it cannot evaluate exactly (unknown columns, LIKE
+    patterns with wildcards, ordering comparisons on strings, snapshots not loaded
+    yet, changed or older than max_age) so the caller falls back to SQL. With a SnapshotStore, each table's columns
+    are published to disk once and memory-mapped by every worker process.
+    """
+
+    def __init__(self, get_connection, modality_mapping, participants_table, max_age=3600, store=None):
+        self._get_connection = get_connection
+        self._mapping = modality_mapping
+        self.participants_table = participants_table
+        self.max_age = max_age
+        self._store = store
+        self._snapshots = {}
+        self._stale = {t['name'] for m in modality_mapping.values() for t in m['tables']}
+        self._generation = 0  # bumped by invalidate() so a reload that raced a change stays stale
+        self._building = False
+        self._lock = threading.Lock()
+        self._counters = {'answered': 0, 'fallbacks': 0, 'builds': 0, 'snapshot_loads': 0, 'build_errors': 0}
+
+    def _load_table(self, cursor, table_config, participants):
+        cursor.execute(f"SELECT * FROM {table_config['name']}")
+        description = cursor.description
+        names = [d[0] for d in description]
+        lower = [n.lower() for n in names]
+        rows = list(fetch_rows(cursor))
+        raw_columns = list(zip(*rows)) if rows else [() for _ in names]
+
+        pids, pid_index = np.unique(pid_array(list(raw_columns[lower.index('pid')])), return_inverse=True)
+        time_point = np.array(
+            [-1 if v is None else int(v) for v in raw_columns[lower.index('time_point')]], dtype=np.int16
+        )
+        columns = {}
+        for position, name in enumerate(lower):
+            if name in ('pid', 'time_point'):
+                continue
+            kind = _column_kind(description[position][1], raw_columns[position])
+            if kind:
+                columns[name] = Column(kind, raw_columns[position])
+        participant_gender = lookup(participants[0], participants[1], pids, GENDER_NULL)
+        return TableSnapshot(table_config, pids, pid_index.astype(np.int64), time_point, columns, participant_gender)
+
+    def refresh(self, tables=None, rebuild=False):
+        """Reload snapshots for the given table names (default: every mapped table)
+
+        With a snapshot store, tables whose current on-disk snapshot matches the data
+        are mapped instead of read (unless rebuild=True); the others are read and
+        published. Tables another worker is building stay stale until it publishes.
+        """
+        configs = [t for m in self._mapping.values() for t in m['tables'] if tables is None or t['name'] in tables]
+        source = {}
+
+        def read(table_config):
+            if 'cursor' not in source:
+                conn = self._get_connection()
+                if not conn:
+                    raise ConnectionError('Database connection failed')
+                source['conn'] = conn
+                source['cursor'] = conn.cursor()
+                source['participants'] = load_participant_genders(source['cursor'], self.participants_table)
+            return self._load_table(source['cursor'], table_config, source['participants'])
+
+        generation = self._generation
+        loaded = {}
+        pending = set()
+        snapshot_loads = 0
+        try:
+            for table_config in configs:
+                name = table_config['name']
+                if self._store is None:
+                    loaded[name] = read(table_config)
+                    continue
+                snapshot, built = self._store.get_or_build(
+                    SNAPSHOT_PREFIX + name,
+                    [name, self.participants_table],
+                    lambda: read(table_config).to_arrays(),
+                    max_age=self.max_age,
+                    rebuild=rebuild
+                )
+                if snapshot is None:
+                    pending.add(name)
+                    continue
+                loaded[name] = TableSnapshot.from_snapshot(table_config, snapshot)
+                snapshot_loads += not built
+        except ConnectionError:
+            pending.update(t['name'] for t in configs if t['name'] not in loaded)
+        except Exception as e:
+            print(f"Error loading column snapshots: {e}")
+            self._counters['build_errors'] += 1
+            return False
+        finally:
+            if 'cursor' in source:
+                source['cursor'].close()
+            if 'conn' in source:
+                source['conn'].close()
+        with self._lock:
+            self._snapshots = {**self._snapshots, **loaded}
+            if generation == self._generation:
+                self._stale -= set(loaded)
+            self._counters['builds'] += len(loaded) > snapshot_loads
+            self._counters['snapshot_loads'] += snapshot_loads
+        return not pending
+
+    def invalidate(self, tables):
+        """Mark snapshots of changed tables for reload (a participants change reloads all)"""
+        tables = {t.lower() for t in tables}
+        with self._lock:
+            self._generation += 1
+            for config in self._mapping.values():
+                for table_config in config['tables']:
+                    name = table_config['name']
+                    if name.lower() in tables or self.participants_table.lower() in tables:
+                        self._stale.add(name)
+
+    def check(self):
+        """Start a background reload of stale, missing or expired snapshots"""
+        now = time.time()
+        with self._lock:
+            expired = {name for name, snap in self._snapshots.items() if now - snap.built_at > self.max_age}
+            todo = self._stale | expired
+            if not todo or self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                self.refresh(todo)
+            finally:
+                self._building = False
+
+        threading.Thread(target=run, name='columnar-snapshot-load', daemon=True).start()
+
+    def _predicate(self, snapshot, threshold):
+        """Row mask for one canonical threshold, or None if it cannot be evaluated exactly"""
+        name, data_type, operator, value, value2 = threshold
+        column = snapshot.columns.get(name.lower())
+        if column is None or column.kind != data_type:
+            return None
+        valid = ~column.nulls
+        if operator == 'IS NULL':
+            return column.nulls.copy()
+        if operator == 'IS NOT NULL':
+            return valid
+
+        if column.kind == 'string':
+            folded = np.array([_fold(v) for v in column.dictionary], dtype=object)
+            if operator in ('=', '!='):
+                matches = folded == _fold(value)
+            elif operator in ('LIKE', 'NOT LIKE') and not any(w in str(value) for w in LIKE_WILDCARDS) \
+                    and str(value) == str(value).rstrip():
+                needle = str(value).casefold()
+                matches = np.array([needle in v for v in folded], dtype=bool)
+            else:
+                return None
+            if operator in ('!=', 'NOT LIKE'):
+                matches = ~matches
+            return valid & np.append(matches, False)[column.values]
+
+        try:
+            if column.kind == 'number':
+                if isinstance(value, str) or isinstance(value2, str):
+                    return None
+                left, right = value, value2
+            else:
+                left = np.datetime64(str(value).replace(' ', 'T'), 'us')
+                right = np.datetime64(str(value2).replace(' ', 'T'), 'us') if value2 else None
+        except ValueError:
+            return None
+
+        data = column.values
+        with np.errstate(invalid='ignore'):
+            if operator == 'between':
+                if not value2:
+                    return None
+                return valid & (data >= left) & (data <= right)
+            comparisons = {
+                '=': np.equal, '!=': np.not_equal, '>': np.greater,
+                '>=': np.greater_equal, '<': np.less, '<=': np.less_equal
+            }
+            if operator not in comparisons:
+                return None
+            return valid & comparisons[operator](data, left)
+
+    def _table_counts(self, snapshot, spec):
+        timepoints = spec['timepoints']
+        distinct = sorted(set(timepoints))
+        required = timepoint_mask(distinct)
+        rows = np.isin(snapshot.time_point, distinct)
+
+        for threshold in spec['thresholds']:
+            predicate = self._predicate(snapshot, threshold)
+            if predicate is None:
+                return None
+            rows &= predicate
+
+        present = np.zeros(len(snapshot.pids), dtype=np.uint8)
+        np.bitwise_or.at(present, snapshot.pid_index[rows], (1 << (snapshot.time_point[rows] - 1)).astype(np.uint8))
+        qualifying = present == required
+        if len(distinct) != len(timepoints):
+            qualifying[:] = False
+        # COUNT(CASE WHEN <variables not null> THEN 1 END) = N
+        counted = rows.copy()
+        for name in spec['variables']:
+            column = snapshot.columns.get(name.lower())
+            if column is None:
+                return None
+            counted &= ~column.nulls
+        qualifying &= np.bincount(snapshot.pid_index[counted], minlength=len(snapshot.pids)) == len(timepoints)
+        return np.bincount(snapshot.participant_gender[qualifying], minlength=4)
+
+    def answer(self, modality, logic_parameters):
+        """Evaluate a filter entry in process, or return None to fall back to SQL"""
+        result = self._answer(modality, logic_parameters)
+        if result is None:
+            self._counters['fallbacks'] += 1
+            self.check()
+            return None
+        self._counters['answered'] += 1
+        return result
+
+    def _answer(self, modality, logic_parameters):
+        if modality not in self._mapping:
+            return None
+        spec = canonical_filter_spec(modality, logic_parameters)
+        if any(tp not in ALL_TIMEPOINTS for tp in spec['timepoints']):
+            return None
+        tables = select_tables(self._mapping[modality], spec['cohorts'])
+
+        counts = {
+            'total': 0,
+            'children': 0,
+            'adults': 0,
+            'gender': {
+                'children': {'M': 0, 'F': 0, 'O': 0},
+                'adults': {'M': 0, 'F': 0, 'O': 0}
+            }
+        }
+        now = time.time()
+        for table_config in tables:
+            snapshot = self._snapshots.get(table_config['name'])
+            # A changed or expired snapshot no longer matches SQL; answer from SQL until it is reloaded
+            if snapshot is None or table_config['name'] in self._stale or now - snapshot.built_at > self.max_age:
+                return None
+            genders = self._table_counts(snapshot, spec)
+            if genders is None:
+                return None
+            table_type = table_config['type']
+            count = int(genders.sum())
+            counts[table_type] = count
+            counts['total'] += count
+            counts['gender'][table_type]['M'] = int(genders[GENDER_M])
+            counts['gender'][table_type]['F'] = int(genders[GENDER_F])
+            # Missing participants are COALESCEd to 'Unknown', which counts as other
+            counts['gender'][table_type]['O'] = int(genders[GENDER_O] + genders[GENDER_NULL])
+        return {'counts': counts, 'engine': 'columnar'}
+
+    def stats(self):
+        """Snapshot sizes, freshness and answered/fallback counters"""
+        tables = {
+            name: {
+                'rows': int(len(snap.time_point)),
+                'columns': len(snap.columns),
+                'bytes': snap.nbytes(),
+                'built_at': snap.built_at
+            }
+            for name, snap in self._snapshots.items()
+        }
+        return {
+            'tables': tables,
+            'total_bytes': sum(t['bytes'] for t in tables.values()),
+            'stale': sorted(self._stale),
+            **self._counters
+        }
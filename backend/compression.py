@@ -0,0 +1,34 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip is offered
+    brotli = None
+
+# Content-Encoding values in order of preference when the client accepts several equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Responses are compressed per request, so favour speed over the last few percent
+
+
+def compressible(response):
+    """True for complete (not streamed) JSON/text responses that are not encoded yet"""
+    return (
+        200 <= response.status_code < 300 and response.status_code != 204 and
+        not response.is_streamed and not response.direct_passthrough and
+        'Content-Encoding' not in response.headers and
+        (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+def negotiate(accept_encodings):
+    """Best Content-Encoding the client accepts (werkzeug Accept header), or None for identity"""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
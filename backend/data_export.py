@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _encode_csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(['' if v is None else v for v in row] for row in rows)
+    return buffer.getvalue()
+
+
+def _encode_ndjson(columns, rows):
+    return ''.join(json.dumps(dict(zip(columns, row)), default=_json_value) + '\n' for row in rows)
+
+
+def stream_export(conn, queries, export_format, batch_size=5000):
+    """Yield CSV or NDJSON chunks for each (source, query, params), one fetchmany batch at a time
+
+    Only one batch is held in memory. If the client disconnects, the server closes
+    the generator: the running statement is cancelled and the connection returned
+    to the pool. A database error mid-stream ends the output (NDJSON gets a final
+    {"error": ...} line, since the status code has already been sent).
+    """
+    cursor = conn.cursor()
+    finished = False
+    header = export_format == 'csv'
+    exported = 0
+    try:
+        for source, query, params in queries:
+            cursor.execute(query, params)
+            columns = [d[0] for d in cursor.description]
+            if header:
+                yield _encode_csv([columns])
+                header = False
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                exported += len(rows)
+                yield _encode_csv(rows) if export_format == 'csv' else _encode_ndjson(columns, rows)
+        finished = True
+    except Exception as e:
+        finished = True
+        print(f"Error during export after {exported} rows: {e}")
+        if export_format == 'ndjson':
+            yield json.dumps({'error': str(e)}) + '\n'
+    finally:
+        if not finished:
+            # GeneratorExit: the client went away while a statement may still be running
+            try:
+                cursor.cancel()
+            except Exception:
+                pass
+        try:
+            cursor.close()
+        except Exception:
+            pass
+        conn.close()
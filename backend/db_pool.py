@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available before the checkout timeout"""
+
+
+class PooledConnection:
+    """Checked-out connection; close() hands it back to the pool instead of disconnecting"""
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_overrides', {})
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise AttributeError(f"Connection already returned to the pool (accessing {name})")
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        # Settings such as conn.timeout apply to the physical connection; remember the
+        # original so the next borrower does not inherit it
+        if name not in self._overrides:
+            self._overrides[name] = getattr(self._conn, name)
+        setattr(self._conn, name, value)
+
+    def cursor(self):
+        cursor = self.__getattr__('cursor')()
+        wrap = self._pool.wrap_cursor
+        return wrap(cursor) if wrap else cursor
+
+    def _take(self):
+        conn = self._conn
+        object.__setattr__(self, '_conn', None)
+        for name, value in self._overrides.items():
+            try:
+                setattr(conn, name, value)
+            except Exception:
+                pass
+        return conn
+
+    def close(self):
+        """Return the connection to the pool"""
+        if self._conn is not None:
+            self._pool._release(self._take())
+
+    def invalidate(self):
+        """Drop the underlying connection instead of reusing it (e.g. after a link failure)"""
+        if self._conn is not None:
+            self._pool._release(self._take(), broken=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of DB-API connections with idle eviction and liveness checks"""
+
+    def __init__(self, connect, min_size=1, max_size=10, idle_timeout=300,
+                 checkout_timeout=30, ping_interval=5, ping_query='SELECT 1', wrap_cursor=None):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.ping_interval = ping_interval
+        self.ping_query = ping_query
+        self.wrap_cursor = wrap_cursor  # e.g. instrumentation applied to every checked-out connection's cursors
+        # Connections inherited across fork() share their socket with the parent, so they
+        # are parked here (never closed or garbage collected) rather than reused.
+        self._orphans = []
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()  # (conn, last_used) pairs, most recently used on the right
+        self._size = 0  # open connections, including ones being opened
+        self._in_use = 0
+        self._waiting = 0
+        self._latencies = deque(maxlen=1024)
+        self._counters = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'connects': 0,
+            'connect_errors': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'evicted': 0
+        }
+
+    def _after_fork(self):
+        self._orphans.extend(conn for conn, _ in self._idle)
+        self._reset()
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._counters['connect_errors'] += 1
+            raise
+        with self._cond:
+            self._counters['connects'] += 1
+        return conn
+
+    def _ping(self, conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self.ping_query)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle_locked(self):
+        """Pop connections idle longer than idle_timeout while keeping min_size open"""
+        evicted = []
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._counters['evicted'] += 1
+            evicted.append(conn)
+        return evicted
+
+    def acquire(self):
+        """Check out a live connection, opening or waiting for one as needed"""
+        if os.getpid() != self._pid:
+            self._after_fork()
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        entry = None
+        with self._cond:
+            evicted = self._evict_idle_locked()
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.checkout_timeout}s "
+                        f"({self._in_use} in use, max {self.max_size})"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            if self._idle:
+                entry = self._idle.pop()
+            else:
+                self._size += 1
+            self._in_use += 1
+        for conn in evicted:
+            self._close_quietly(conn)
+
+        try:
+            if entry is None:
+                conn = self._open()
+            else:
+                conn, last_used = entry
+                if time.monotonic() - last_used >= self.ping_interval and not self._ping(conn):
+                    # Stale or broken link: replace it in the same slot
+                    self._close_quietly(conn)
+                    with self._cond:
+                        self._counters['reconnects'] += 1
+                    conn = self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._counters['checkouts'] += 1
+            self._latencies.append(time.monotonic() - started)
+        return PooledConnection(self, conn)
+
+    def _release(self, conn, broken=False):
+        if os.getpid() != self._pid:
+            # Checked out before a fork; the child must not touch it
+            self._orphans.append(conn)
+            return
+        if not broken:
+            try:
+                conn.rollback()  # Reset transaction state before reuse
+            except Exception:
+                broken = True
+        with self._cond:
+            self._in_use -= 1
+            if broken:
+                self._size -= 1
+                self._counters['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken:
+            self._close_quietly(conn)
+
+    def warm(self):
+        """Open connections until min_size are available"""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def warm_in_background(self):
+        """Open min_size connections in a background thread so startup is not blocked on the database"""
+        def run():
+            try:
+                self.warm()
+            except Exception as e:
+                print(f"Error opening initial database connections: {e}")
+
+        threading.Thread(target=run, name='db-pool-warm', daemon=True).start()
+
+    def close_all(self):
+        """Close every idle connection; checked-out ones are closed when released"""
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Return pool occupancy, counters and checkout latency (ms) for sizing"""
+        with self._cond:
+            latencies = sorted(self._latencies)
+            stats = {
+                'pid': self._pid,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                **self._counters
+            }
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+        stats['checkout_ms'] = {
+            'samples': len(latencies),
+            'avg': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0,
+            'p50': percentile(0.50) if latencies else 0,
+            'p95': percentile(0.95) if latencies else 0,
+            'max': round(latencies[-1] * 1000, 3) if latencies else 0
+        }
+        return stats
@@ -0,0 +1,77 @@
+import json
+
+ALL_TIMEPOINTS = [1, 2, 3, 4, 5, 6]
+
+
+def _normalize_value(value, data_type):
+    if value is None:
+        return None
+    if data_type == 'number':
+        try:
+            number = float(value)
+            return 0.0 if number == 0 else number  # fold -0.0 into 0.0
+        except (TypeError, ValueError):
+            pass
+    return str(value)
+
+
+def canonical_filter_spec(modality, logic_parameters):
+    """Reduce a (modality, logicParameters) entry to a normalized, order-independent form
+
+    Mirrors the way build_filter_queries reads the request: only the first logic
+    parameter is used, empty or 'all' timepoints mean all six, 'adult' is an alias
+    for 'adults' and incomplete thresholds are ignored.
+    """
+    logic_param = logic_parameters[0] if logic_parameters else {}
+
+    timepoints = logic_param.get('timepoints') or []
+    if 'all' in timepoints:
+        timepoints = []
+    # Duplicates are kept: build_filter_queries compares COUNT(DISTINCT time_point) with len(timepoints)
+    timepoints = sorted(int(tp) for tp in timepoints) or list(ALL_TIMEPOINTS)
+
+    cohorts = sorted({'adults' if c == 'adult' else c for c in (logic_param.get('cohorts') or [])})
+    variables = sorted({v['name'] for v in (logic_param.get('variables') or [])})
+
+    thresholds = []
+    for threshold in logic_param.get('thresholds') or []:
+        variable_obj = threshold.get('variable')
+        operator = threshold.get('operator')
+        value = threshold.get('value')
+        if not variable_obj or not operator:
+            continue
+        if operator not in ['IS NULL', 'IS NOT NULL'] and value is None:
+            continue
+        data_type = variable_obj.get('type')
+        thresholds.append([
+            variable_obj['name'],
+            data_type,
+            operator,
+            _normalize_value(value, data_type) if operator not in ['IS NULL', 'IS NOT NULL'] else None,
+            _normalize_value(threshold.get('value2'), data_type) if operator == 'between' else None
+        ])
+    thresholds.sort(key=json.dumps)
+
+    return {
+        'modality': modality,
+        'timepoints': timepoints,
+        'cohorts': cohorts,
+        'variables': variables,
+        'thresholds': thresholds
+    }
+
+
+def select_tables(modality_config, cohorts):
+    """Return the table configs of a modality that match the selected cohorts
+
+    No cohorts, or both cohorts, selects every table.
+    """
+    has_children = 'children' in cohorts
+    has_adults = 'adults' in cohorts or 'adult' in cohorts
+    if not cohorts or (has_children and has_adults):
+        return list(modality_config['tables'])
+    return [
+        table_config for table_config in modality_config['tables']
+        if (table_config['type'] == 'children' and has_children) or
+           (table_config['type'] == 'adults' and has_adults)
+    ]
@@ -0,0 +1,333 @@
+import argparse
+import json
+import sys
+import threading
+from collections import Counter
+
+from query_compiler import quote_identifier
+
+KEY_COLUMNS = ('pid', 'time_point')
+DIALECTS = ('mssql', 'sqlite')
+
+
+class FilterWorkload:
+    """How often each filter shape (tables, timepoints, thresholded columns and operators) reached SQL
+
+    Literal values are not kept. With a path, every recorded filter is also
+    appended to that file as one JSON line, which is what the command-line
+    advisor reads.
+    """
+
+    def __init__(self, path=None, max_shapes=10000):
+        self.path = path
+        self.max_shapes = max_shapes
+        self._shapes = {}  # JSON key -> [entry, count]
+        self._counters = {'recorded': 0, 'dropped': 0, 'write_errors': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def entry(table_names, spec):
+        """Workload entry of a canonical filter spec (see filter_spec.canonical_filter_spec)"""
+        return {
+            'tables': sorted(table_names),
+            'timepoints': spec['timepoints'],
+            'predicates': sorted({(name, operator) for name, _, operator, _, _ in spec['thresholds']}),
+            'columns': spec['variables']
+        }
+
+    def record(self, table_names, spec):
+        self.add(self.entry(table_names, spec), persist=True)
+
+    def add(self, entry, count=1, persist=False):
+        entry = {**entry, 'predicates': [list(p) for p in entry['predicates']]}
+        key = json.dumps(entry, sort_keys=True)
+        with self._lock:
+            self._counters['recorded'] += count
+            shape = self._shapes.get(key)
+            if shape is not None:
+                shape[1] += count
+            elif len(self._shapes) < self.max_shapes:
+                self._shapes[key] = [entry, count]
+            else:
+                self._counters['dropped'] += count
+            if persist and self.path:
+                try:
+                    with open(self.path, 'a') as f:
+                        f.write(key + '\n')
+                except OSError as e:
+                    self._counters['write_errors'] += 1
+                    print(f"Error writing filter workload: {e}")
+
+    @classmethod
+    def load(cls, path):
+        """Workload from a file of JSON lines written by record()"""
+        workload = cls()
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    workload.add(json.loads(line))
+        return workload
+
+    def shapes(self):
+        """[(entry, count)], most frequent first"""
+        with self._lock:
+            shapes = [(entry, count) for entry, count in self._shapes.values()]
+        return sorted(shapes, key=lambda s: (-s[1], json.dumps(s[0], sort_keys=True)))
+
+    def stats(self):
+        with self._lock:
+            return {'shapes': len(self._shapes), 'path': self.path, **self._counters}
+
+
+def table_profile(cursor, table_name, columns, timepoints=True):
+    """Row count, column count, non-null counts of the given columns and rows per time_point
+
+    Uses only portable SQL, so it runs on SQL Server and on a SQLite stand-in alike.
+    """
+    cursor.execute(f"SELECT * FROM {table_name} WHERE 1=0")
+    existing = {d[0].lower(): d[0] for d in cursor.description}
+    cursor.fetchall()
+    present = sorted({existing[c.lower()] for c in columns if c.lower() in existing})
+    counts = ''.join(f", COUNT({quote_identifier(c)})" for c in present)
+    cursor.execute(f"SELECT COUNT(*){counts} FROM {table_name}")
+    row = cursor.fetchone()
+    if timepoints:
+        cursor.execute(f"SELECT time_point, COUNT(*) FROM {table_name} GROUP BY time_point")
+        timepoints = {int(tp): int(n) for tp, n in cursor.fetchall() if tp is not None}
+    else:
+        timepoints = {}
+    return {
+        'rows': int(row[0]),
+        'width': len(existing),
+        'non_null': {c.lower(): int(n) for c, n in zip(present, row[1:])},
+        'timepoints': timepoints
+    }
+
+
+def _index_name(table_name, suffix):
+    return f"ix_{table_name}_{suffix}"[:128]
+
+
+def index_ddl(recommendation, dialect='mssql'):
+    """CREATE INDEX statement for a recommendation
+
+    SQLite has no INCLUDE, so there the included columns are appended to the key.
+    """
+    table = recommendation['table']
+    keys = [quote_identifier(c) for c in recommendation['key_columns']]
+    include = [quote_identifier(c) for c in recommendation['include']]
+    where = f" WHERE {recommendation['where']}" if recommendation['where'] else ''
+    if dialect == 'sqlite':
+        return f"CREATE INDEX IF NOT EXISTS {quote_identifier(recommendation['name'])} " \
+               f"ON {table} ({', '.join(keys + include)}){where};"
+    include_text = f" INCLUDE ({', '.join(include)})" if include else ''
+    return f"CREATE NONCLUSTERED INDEX {quote_identifier(recommendation['name'])} " \
+           f"ON {table} ({', '.join(keys)}){include_text}{where};"
+
+
+def _choose_columns(entries, total, max_include, min_share):
+    usage = Counter()
+    for entry, count in entries:
+        for column in _entry_columns(entry):
+            usage[column] += count
+    ranked = sorted(usage, key=lambda c: (-usage[c], c.lower()))
+    return [c for c in ranked if usage[c] / total >= min_share][:max_include]
+
+
+def _entry_columns(entry):
+    return {name for name, _ in entry['predicates']} | set(entry['columns'])
+
+
+def _candidate(table_name, profile, entries, include, where_column, suffix):
+    """Estimate a candidate index over the entries it can answer without touching the table
+
+    Cost is counted in cells read: a table scan reads rows x width, an index scan
+    reads its rows x (key + included columns).
+    """
+    rows, width = profile['rows'], max(profile['width'], 1)
+    index_rows = profile['non_null'].get(where_column.lower(), rows) if where_column else rows
+    index_width = len(KEY_COLUMNS) + len(include)
+    lowered = {c.lower() for c in include}
+    scan_cost = covered = saved = 0
+    for entry, count in entries:
+        scan_cost += count * rows * width
+        if not {c.lower() for c in _entry_columns(entry)} <= lowered:
+            continue
+        if where_column and [where_column.lower(), 'IS NOT NULL'] not in [[n.lower(), o] for n, o in entry['predicates']]:
+            continue
+        covered += count
+        saved += count * max(rows * width - index_rows * index_width, 0)
+    if not covered:
+        return None
+    return {
+        'table': table_name,
+        'name': _index_name(table_name, suffix),
+        'key_columns': list(KEY_COLUMNS),
+        'include': list(include),
+        'where': f"{quote_identifier(where_column)} IS NOT NULL" if where_column else None,
+        'queries': sum(count for _, count in entries),
+        'covered_queries': covered,
+        'index_rows': index_rows,
+        'estimated_cells_saved': saved,
+        'estimated_read_reduction': round(saved / scan_cost, 4) if scan_cost else 0.0
+    }
+
+
+def recommend(workload, profiles, participants_table=None, max_include=16, min_share=0.05,
+              filtered_share=0.25, min_null_fraction=0.2, dialect='mssql'):
+    """Index recommendations for a workload, best estimated benefit first
+
+    Filter queries read a whole study table to group the rows of the selected
+    timepoints by pid. An index keyed on (pid, time_point) that includes the
+    columns they filter on is far narrower and already in pid order. Per table this
+    proposes one such covering index over the columns used by at least min_share of
+    its queries, plus filtered indexes (WHERE col IS NOT NULL) for columns that at
+    least filtered_share of its queries restrict with IS NOT NULL and that are at
+    least min_null_fraction NULL. time_point lists are parameterized, and SQL Server
+    does not match filtered indexes to parameters, so they are never index filters.
+
+    profiles maps table name -> table_profile(); tables without one are skipped.
+    """
+    by_table = {}
+    for entry, count in workload.shapes():
+        for table_name in entry['tables']:
+            by_table.setdefault(table_name, []).append((entry, count))
+
+    recommendations = []
+    for table_name in sorted(by_table):
+        profile = profiles.get(table_name)
+        if not profile or not profile['rows']:
+            continue
+        entries = by_table[table_name]
+        total = sum(count for _, count in entries)
+
+        include = _choose_columns(entries, total, max_include, min_share)
+        candidate = _candidate(table_name, profile, entries, include, None, 'pid_tp')
+        if candidate:
+            recommendations.append(candidate)
+
+        not_null = Counter()
+        for entry, count in entries:
+            for name, operator in entry['predicates']:
+                if operator == 'IS NOT NULL':
+                    not_null[name] += count
+        for column in sorted(not_null, key=lambda c: (-not_null[c], c.lower())):
+            present = profile['non_null'].get(column.lower())
+            if present is None or not_null[column] / total < filtered_share:
+                continue
+            if 1 - present / profile['rows'] < min_null_fraction:
+                continue
+            restricted = [
+                (entry, count) for entry, count in entries
+                if [column, 'IS NOT NULL'] in [list(p) for p in entry['predicates']]
+            ]
+            candidate = _candidate(
+                table_name, profile, restricted,
+                _choose_columns(restricted, sum(c for _, c in restricted), max_include, min_share),
+                column, f"pid_tp_{column}_nn"
+            )
+            if candidate:
+                recommendations.append(candidate)
+
+    participants = profiles.get(participants_table) if participants_table else None
+    if participants and by_table and participants['width'] > 2:
+        # Gender breakdowns join every qualifying pid to the participants table
+        queries = sum(count for _, count in workload.shapes())
+        recommendations.append({
+            'table': participants_table,
+            'name': _index_name(participants_table, 'pid_gender'),
+            'key_columns': ['pid'],
+            'include': ['gender'],
+            'where': None,
+            'queries': queries,
+            'covered_queries': queries,
+            'index_rows': participants['rows'],
+            'estimated_cells_saved': queries * participants['rows'] * (participants['width'] - 2),
+            'estimated_read_reduction': round(1 - 2 / participants['width'], 4)
+        })
+
+    for recommendation in recommendations:
+        recommendation['ddl'] = index_ddl(recommendation, dialect)
+    return sorted(recommendations, key=lambda r: (-r['estimated_cells_saved'], r['table'], r['name']))
+
+
+def profile_workload(cursor, workload, participants_table=None):
+    """table_profile() of every table in the workload (and the participants table), keyed by name"""
+    columns = {}
+    for entry, _ in workload.shapes():
+        for table_name in entry['tables']:
+            columns.setdefault(table_name, set()).update(_entry_columns(entry))
+    if participants_table and columns:
+        columns.setdefault(participants_table, {'gender'})
+    profiles = {}
+    for table_name in sorted(columns):
+        try:
+            profiles[table_name] = table_profile(
+                cursor, table_name, columns[table_name], timepoints=table_name != participants_table
+            )
+        except Exception as e:
+            print(f"Error profiling {table_name}: {e}", file=sys.stderr)
+    return profiles
+
+
+def _sql_server_connection():
+    import os
+    import pyodbc
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return pyodbc.connect(
+        f"DRIVER={{{os.getenv('DB_DRIVER', 'ODBC Driver 17 for SQL Server')}}};"
+        f"SERVER={os.getenv('DB_SERVER')};"
+        f"DATABASE={os.getenv('DB_DATABASE')};"
+        f"UID={os.getenv('DB_USERNAME')};"
+        f"PWD={os.getenv('DB_PASSWORD')};"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Recommend indexes for the mapped study tables from a recorded filter workload'
+    )
+    parser.add_argument('--workload', required=True, help='JSON-lines workload file written by the app')
+    parser.add_argument('--sqlite', help='Profile a local SQLite stand-in database instead of SQL Server')
+    parser.add_argument('--participants-table', default='participants_2025')
+    parser.add_argument('--dialect', choices=DIALECTS, help='DDL dialect (default: sqlite with --sqlite, else mssql)')
+    parser.add_argument('--max-include', type=int, default=16, help='Most INCLUDE columns per index')
+    parser.add_argument('--min-share', type=float, default=0.05, help='Share of queries a column needs to be included')
+    parser.add_argument('--ddl', action='store_true', help='Print only the CREATE INDEX statements')
+    parser.add_argument('--apply', action='store_true', help='Create the indexes (SQLite stand-in only)')
+    args = parser.parse_args(argv)
+    if args.apply and not args.sqlite:
+        parser.error('--apply is only supported with --sqlite')
+
+    if args.sqlite:
+        import sqlite3
+        conn = sqlite3.connect(args.sqlite)
+    else:
+        conn = _sql_server_connection()
+    dialect = args.dialect or ('sqlite' if args.sqlite else 'mssql')
+
+    workload = FilterWorkload.load(args.workload)
+    try:
+        cursor = conn.cursor()
+        profiles = profile_workload(cursor, workload, args.participants_table)
+        recommendations = recommend(
+            workload, profiles, args.participants_table,
+            max_include=args.max_include, min_share=args.min_share, dialect=dialect
+        )
+        if args.apply:
+            for recommendation in recommendations:
+                cursor.execute(recommendation['ddl'])
+            conn.commit()
+    finally:
+        conn.close()
+
+    if args.ddl:
+        print('\n'.join(r['ddl'] for r in recommendations))
+    else:
+        print(json.dumps({'workload': workload.stats(), 'recommendations': recommendations}, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
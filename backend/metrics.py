@@ -0,0 +1,284 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus default buckets, extended for slow report queries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                labels = _label_text(self.labels + ('le',), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collect):
+        """Register a callable returning [(name, help, {labels}, value), ...] gauges read at scrape time"""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            described = set()
+            for name, help_text, labels, value in samples:
+                if name not in described:
+                    lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+                    described.add(name)
+                lines.append(f"{name}{_label_text(tuple(labels), tuple(labels.values()))} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimer:
+    """Time spent per phase (connect, execute, fetch, serialize, ...) during one request"""
+
+    __slots__ = ('route', 'started', 'spans', '_lock')
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.spans = {}  # phase -> [seconds, count]
+        self._lock = threading.Lock()  # Queries of one request run on several worker threads
+
+    def add(self, phase, seconds):
+        with self._lock:
+            span = self.spans.setdefault(phase, [0.0, 0])
+            span[0] += seconds
+            span[1] += 1
+
+    def server_timing(self):
+        """Server-Timing header value (durations in milliseconds)"""
+        with self._lock:
+            parts = [f"{phase};dur={seconds * 1000:.1f}" for phase, (seconds, _) in self.spans.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ', '.join(parts)
+
+
+current_timer = contextvars.ContextVar('request_timer', default=None)
+current_labels = contextvars.ContextVar('query_labels', default={})
+
+
+@contextmanager
+def span(phase):
+    """Add the duration of the block to the current request's timer"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer = current_timer.get()
+        if timer is not None:
+            timer.add(phase, time.perf_counter() - started)
+
+
+@contextmanager
+def query_labels(**labels):
+    """Attach labels (modality, table) to the database timings recorded inside the block"""
+    token = current_labels.set({**current_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        current_labels.reset(token)
+
+
+class TimedCursor:
+    """Cursor wrapper that records execute and fetch time per route/modality/table
+
+    With on_statement, each statement is also reported once complete (its results
+    exhausted, the next execute, or close) as on_statement(sql, params, seconds,
+    rows, error), where seconds covers the execute and all of its fetches.
+    """
+
+    def __init__(self, cursor, on_time, on_error, on_statement=None):
+        self._cursor = cursor
+        self._on_time = on_time
+        self._on_error = on_error
+        self._on_statement = on_statement
+        self._statement = None  # [sql, params, seconds, rows, labels]
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, phase, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        except Exception as e:
+            self._on_error(phase)
+            if self._statement is not None:
+                self._statement[2] += time.perf_counter() - started
+                self._finish_statement(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            timer = current_timer.get()
+            if timer is not None:
+                timer.add(phase, elapsed)
+            self._on_time(phase, elapsed)
+            if self._statement is not None:
+                self._statement[2] += elapsed
+
+    def _finish_statement(self, error=None):
+        statement, self._statement = self._statement, None
+        if statement is not None:
+            sql, params, seconds, rows, labels = statement
+            token = current_labels.set(labels)  # Labels of the execute, even if finished elsewhere
+            try:
+                self._on_statement(sql, params, seconds, rows, error)
+            except Exception as e:
+                print(f"Error recording statement: {e}")
+            finally:
+                current_labels.reset(token)
+
+    def execute(self, sql, *params):
+        if self._on_statement is not None:
+            self._finish_statement()
+            # Both execute(sql, [a, b]) and execute(sql, a, b) are accepted
+            values = params[0] if len(params) == 1 and isinstance(params[0], (list, tuple)) else params
+            self._statement = [sql, list(values), 0.0, 0, current_labels.get()]
+        self._timed('execute', self._cursor.execute, sql, *params)
+        return self
+
+    def fetchone(self):
+        row = self._timed('fetch', self._cursor.fetchone)
+        if self._statement is not None:
+            if row is None:
+                self._finish_statement()
+            else:
+                self._statement[3] += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._timed('fetch', self._cursor.fetchmany, *args)
+        if self._statement is not None:
+            if rows:
+                self._statement[3] += len(rows)
+            else:
+                self._finish_statement()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed('fetch', self._cursor.fetchall)
+        if self._statement is not None:
+            self._statement[3] += len(rows)
+            self._finish_statement()
+        return rows
+
+    def close(self):
+        if self._statement is not None:
+            self._finish_statement()
+        return self._cursor.close()
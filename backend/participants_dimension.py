@@ -0,0 +1,281 @@
+import threading
+import time
+
+import numpy as np
+
+from timepoint_index import GENDER_NULL, fetch_rows, gender_code, lookup, pid_array
+
+SNAPSHOT_NAME = 'participants-dimension'
+
+
+def _gender_map(rows):
+    """(sorted pids, int8 gender codes) from (pid, gender) rows; the first row of a pid wins"""
+    pids, first = np.unique(pid_array([row[0] for row in rows]), return_index=True)
+    codes = np.array([gender_code(row[1]) for row in rows], dtype=np.int8)
+    return pids, codes[first]
+
+
+class ParticipantsDimension:
+    """In-memory pid -> normalized gender code lookup for the count queries
+
+    Holds one map for the participants table and one per mapped table with a
+    gender_column (MIN(gender) per pid, as the baseline query reads it), so count
+    queries only return qualifying pids and the gender breakdown is a vectorized
+    lookup. When the participants table changes, rows with a pid above the last
+    loaded one are appended; any other difference (deleted or back-filled rows)
+    triggers a full reload, as does max_age. Lookups return None while a map is
+    missing or stale so callers fall back to the SQL CASE expressions. With a
+    SnapshotStore, one worker refreshes the maps and publishes them; the others
+    memory-map the published version.
+    """
+
+    def __init__(self, get_connection, modality_mapping, participants_table, max_age=3600, store=None):
+        self._get_connection = get_connection
+        self._mapping = modality_mapping
+        self.participants_table = participants_table
+        self.max_age = max_age
+        self._store = store
+        self._snapshot_version = None
+        self._participants = None  # (sorted pids, codes)
+        self._participant_rows = 0
+        self._watermark = None  # MAX(pid) covered by the participants map
+        self._loaded_at = None
+        self._table_genders = {}  # table name -> (sorted pids, codes)
+        self._stale = {t['name'] for t in self._gender_tables()} | {participants_table}
+        self._generation = 0  # bumped by invalidate() so a refresh that raced a change stays stale
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._counters = {
+            'lookups': 0, 'fallbacks': 0, 'full_loads': 0, 'incremental_loads': 0,
+            'rows_appended': 0, 'snapshot_loads': 0, 'refresh_errors': 0
+        }
+
+    def _gender_tables(self):
+        return [t for m in self._mapping.values() for t in m['tables'] if t['gender_column']]
+
+    def _source_tables(self):
+        return [self.participants_table] + [t['name'] for t in self._gender_tables()]
+
+    def _load_participants(self, cursor, full):
+        cursor.execute(f"SELECT COUNT(*), MAX(pid) FROM {self.participants_table}")
+        total, watermark = cursor.fetchone()
+        with self._lock:
+            current, rows_loaded, previous = self._participants, self._participant_rows, self._watermark
+
+        if not full and current is not None and previous is not None and watermark is not None:
+            cursor.execute(
+                f"SELECT pid, gender FROM {self.participants_table} WHERE pid > ? AND pid <= ?",
+                [previous, watermark]
+            )
+            rows = list(fetch_rows(cursor))
+            if rows_loaded + len(rows) == total:
+                if rows:
+                    added = _gender_map(rows)
+                    merged_pids = np.concatenate([current[0], added[0]])
+                    merged_codes = np.concatenate([current[1], added[1]])
+                    # Already-loaded pids come first, so np.unique keeps their codes
+                    pids, first = np.unique(merged_pids, return_index=True)
+                    current = (pids, merged_codes[first])
+                self._counters['incremental_loads'] += 1
+                self._counters['rows_appended'] += len(rows)
+                return current, total, watermark
+
+        rows = []
+        if watermark is not None:
+            cursor.execute(f"SELECT pid, gender FROM {self.participants_table} WHERE pid <= ?", [watermark])
+            rows = list(fetch_rows(cursor))
+        self._counters['full_loads'] += 1
+        return _gender_map(rows), len(rows), watermark
+
+    def _load_table_genders(self, cursor, table_config):
+        gender_col = table_config['gender_column']
+        cursor.execute(
+            f"SELECT pid, MIN({gender_col}) FROM {table_config['name']} "
+            f"WHERE time_point IN (1,2,3,4,5,6) GROUP BY pid"
+        )
+        return _gender_map(list(fetch_rows(cursor)))
+
+    def refresh(self, full=False):
+        """Load stale maps (every map when full=True); returns False if the database was unreachable
+
+        With a snapshot store, a current published version is mapped instead (unless
+        full=True), and only one worker at a time reads from the database; the others
+        return False and pick up its snapshot on their next check.
+        """
+        release = None
+        if self._store is not None:
+            if not full and self._load_snapshot():
+                return True
+            release = self._store.claim(SNAPSHOT_NAME)
+            if release is None:
+                return False
+        try:
+            if self._store is not None and not full and self._load_snapshot():
+                return True
+            return self._refresh(full)
+        finally:
+            if release is not None:
+                release()
+
+    def _refresh(self, full):
+        with self._lock:
+            generation = self._generation
+            todo = set(self._stale)
+            if full or self._loaded_at is None or time.time() - self._loaded_at > self.max_age:
+                full = True
+                todo = {t['name'] for t in self._gender_tables()} | {self.participants_table}
+        token = self._store.data_version(self._source_tables()) if self._store is not None else None
+        conn = self._get_connection()
+        if not conn:
+            return False
+        try:
+            cursor = conn.cursor()
+            try:
+                participants = None
+                if self.participants_table in todo:
+                    participants = self._load_participants(cursor, full)
+                tables = {
+                    t['name']: self._load_table_genders(cursor, t) for t in self._gender_tables() if t['name'] in todo
+                }
+            finally:
+                cursor.close()
+        except Exception as e:
+            print(f"Error loading participants dimension: {e}")
+            self._counters['refresh_errors'] += 1
+            return False
+        finally:
+            conn.close()
+        with self._lock:
+            if participants is not None:
+                self._participants, self._participant_rows, self._watermark = participants
+            self._table_genders = {**self._table_genders, **tables}
+            if full:
+                self._loaded_at = time.time()
+            if generation == self._generation:
+                self._stale -= todo
+            complete = not self._stale and self._participants is not None
+        if self._store is not None and complete and (participants is not None or tables):
+            self._publish(token)
+        return True
+
+    def _publish(self, token):
+        with self._lock:
+            arrays = {'participants.pids': self._participants[0], 'participants.codes': self._participants[1]}
+            for name, (pids, codes) in self._table_genders.items():
+                arrays[f'{name}.pids'] = pids
+                arrays[f'{name}.codes'] = codes
+            watermark = self._watermark
+            meta = {
+                'participant_rows': self._participant_rows,
+                'watermark': watermark if watermark is None or isinstance(watermark, (int, str)) else str(watermark),
+                'loaded_at': self._loaded_at
+            }
+        snapshot = self._store.publish(SNAPSHOT_NAME, arrays, meta, data_version=token)
+        if snapshot is not None:
+            self._install(snapshot)
+
+    def _load_snapshot(self):
+        """Map the published maps if they are current and newer than ours"""
+        generation = self._generation
+        snapshot = self._store.load(SNAPSHOT_NAME, self._source_tables(), self.max_age)
+        if snapshot is None or snapshot.version == self._snapshot_version:
+            return False
+        self._install(snapshot, generation)
+        self._counters['snapshot_loads'] += 1
+        return True
+
+    def _install(self, snapshot, generation=None):
+        """Switch to a published snapshot's maps; with the generation it was checked at, they are current"""
+        arrays = snapshot.arrays
+        with self._lock:
+            self._participants = (arrays['participants.pids'], arrays['participants.codes'])
+            self._participant_rows = snapshot.meta['participant_rows']
+            self._watermark = snapshot.meta['watermark']
+            self._loaded_at = snapshot.meta['loaded_at']
+            self._table_genders = {
+                t['name']: (arrays[f"{t['name']}.pids"], arrays[f"{t['name']}.codes"]) for t in self._gender_tables()
+            }
+            self._snapshot_version = snapshot.version
+            if generation == self._generation:
+                self._stale.clear()
+
+    def invalidate(self, tables):
+        """Mark the participants map or a table's gender map for reload"""
+        tables = {t.lower() for t in tables}
+        with self._lock:
+            self._generation += 1
+            if self.participants_table.lower() in tables:
+                self._stale.add(self.participants_table)
+            self._stale.update(t['name'] for t in self._gender_tables() if t['name'].lower() in tables)
+
+    def check(self):
+        """Start a background refresh of stale, missing or expired maps"""
+        with self._lock:
+            expired = self._loaded_at is None or time.time() - self._loaded_at > self.max_age
+            if (not self._stale and not expired) or self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='participants-dimension-load', daemon=True).start()
+
+    def _source(self, table_config):
+        if table_config is not None and table_config['gender_column']:
+            return table_config['name'], self._table_genders.get(table_config['name'])
+        return self.participants_table, self._participants
+
+    def ready(self, table_configs=None):
+        """True when the maps needed for these tables (default: the participants map) are current"""
+        with self._lock:
+            for table_config in table_configs or [None]:
+                source, genders = self._source(table_config)
+                if genders is None or source in self._stale:
+                    self._counters['fallbacks'] += 1
+                    return False
+        return True
+
+    def codes(self, pids, table_config=None):
+        """Gender code per pid, or None to fall back to SQL
+
+        pids are looked up in the participants map, or in the table's own gender map
+        when a table_config with a gender_column is given; unknown pids get GENDER_NULL.
+        """
+        with self._lock:
+            source, genders = self._source(table_config)
+            if genders is None or source in self._stale:
+                self._counters['fallbacks'] += 1
+                return None
+            self._counters['lookups'] += 1
+        return lookup(genders[0], genders[1], pid_array(pids), GENDER_NULL)
+
+    def gender_counts(self, pids, table_config=None):
+        """Counts per gender code (NULL, M, F, O) for a set of pids, or None to fall back to SQL"""
+        codes = self.codes(pids, table_config)
+        if codes is None:
+            return None
+        return np.bincount(codes, minlength=4)
+
+    def stats(self):
+        """Map sizes, freshness and lookup/load counters"""
+        with self._lock:
+            participants = self._participants
+            tables = {
+                name: {'participants': int(len(pids)), 'bytes': int(pids.nbytes + codes.nbytes)}
+                for name, (pids, codes) in self._table_genders.items()
+            }
+            return {
+                'participants': int(len(participants[0])) if participants else 0,
+                'participants_bytes': int(participants[0].nbytes + participants[1].nbytes) if participants else 0,
+                'watermark': str(self._watermark) if self._watermark is not None else None,
+                'tables': tables,
+                'loaded_at': self._loaded_at,
+                'max_age': self.max_age,
+                'snapshot_version': self._snapshot_version,
+                'stale': sorted(self._stale),
+                **self._counters
+            }
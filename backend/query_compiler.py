@@ -0,0 +1,274 @@
+from filter_spec import ALL_TIMEPOINTS
+
+COMPARISON_OPERATORS = ['=', '!=', '>', '>=', '<', '<=']
+NULL_OPERATORS = ['IS NULL', 'IS NOT NULL']
+LIKE_OPERATORS = ['LIKE', 'NOT LIKE']
+
+GENDER_COUNTS = """
+        SUM(CASE WHEN gender IN ('M', 'MALE') OR LOWER(gender) = 'male' THEN 1 ELSE 0 END) as male_count,
+        SUM(CASE WHEN gender IN ('F', 'FEMALE') OR LOWER(gender) = 'female' THEN 1 ELSE 0 END) as female_count,
+        SUM(CASE
+            WHEN gender IS NULL THEN 0
+            WHEN gender NOT IN ('M', 'MALE', 'F', 'FEMALE')
+                AND LOWER(gender) NOT IN ('male', 'female')
+            THEN 1
+            ELSE 0
+        END) as other_count"""
+
+EMPTY_QUERY = "SELECT 0 as count, 'none' as source WHERE 1=0"
+
+
+def quote_identifier(name):
+    """Bracket-quote a column name coming from the request"""
+    return '[' + str(name).replace(']', ']]') + ']'
+
+
+def _typed_value(value, data_type):
+    if data_type == 'number':
+        return float(value)
+    return value  # datetimes are passed through as ISO strings
+
+
+def compile_thresholds(thresholds):
+    """Turn request thresholds into SQL conditions on alias t and their parameters"""
+    conditions = []
+    params = []
+    for threshold in thresholds:
+        variable_obj = threshold.get('variable')
+        operator = threshold.get('operator')
+        value = threshold.get('value')
+        value2 = threshold.get('value2')
+
+        if not variable_obj or not operator:
+            continue
+        if operator not in NULL_OPERATORS and value is None:
+            continue
+
+        column = f"t.{quote_identifier(variable_obj['name'])}"
+        data_type = variable_obj['type']
+
+        if operator == 'between':
+            if not value2:
+                raise ValueError(f"Operator 'between' needs two values for {variable_obj['name']}")
+            conditions.append(f"{column} BETWEEN ? AND ?")
+            params.extend([_typed_value(value, data_type), _typed_value(value2, data_type)])
+        elif operator in LIKE_OPERATORS:
+            conditions.append(f"{column} {operator} ?")
+            params.append(f"%{value}%")  # Add wildcards for contains/not contains
+        elif operator in NULL_OPERATORS:
+            conditions.append(f"{column} {operator}")
+        elif operator in COMPARISON_OPERATORS:
+            conditions.append(f"{column} {operator} ?")
+            params.append(_typed_value(value, data_type))
+        else:
+            raise ValueError(f"Unsupported operator: {operator}")
+    return conditions, params
+
+
+def _filter_predicates(logic_param):
+    """Timepoint parameters, WHERE conditions with their parameters and the variable not-null check"""
+    logic_param = logic_param or {}
+    timepoints = logic_param.get('timepoints') or []
+    if 'all' in timepoints:
+        timepoints = []
+    timepoint_params = [int(tp) for tp in timepoints] or list(ALL_TIMEPOINTS)
+    variables = logic_param.get('variables') or []
+    threshold_conditions, threshold_params = compile_thresholds(logic_param.get('thresholds') or [])
+
+    where = [f"t.time_point IN ({','.join('?' for _ in timepoint_params)})"] + threshold_conditions
+    not_null = ' AND '.join(f"t.{quote_identifier(v['name'])} IS NOT NULL" for v in variables) or '1=1'
+    return timepoint_params, ' AND '.join(where), timepoint_params + threshold_params, not_null
+
+
+def _qualified_pids(tables, logic_param, pids=None):
+    """Per-table Qualified_<n> CTEs, the UNION ALL of their pids and the statement parameters
+
+    Each table is scanned once: timepoint and threshold predicates are applied in the
+    WHERE clause of its pid aggregation, and a participant qualifies when it has a
+    row at every requested timepoint and exactly N rows with all selected variables
+    non-null. With pids, only those participants are considered.
+    """
+    timepoint_params, where, where_params, not_null = _filter_predicates(logic_param)
+    if pids:
+        where += f" AND t.pid IN ({','.join('?' for _ in pids)})"
+        where_params = where_params + list(pids)
+
+    ctes = []
+    qualified = []
+    params = []
+    for index, table_config in enumerate(tables):
+        ctes.append(f"""
+    Qualified_{index} AS (
+        SELECT t.pid
+        FROM {table_config['name']} t
+        WHERE {where}
+        GROUP BY t.pid
+        HAVING COUNT(DISTINCT t.time_point) = {len(timepoint_params)}
+        AND COUNT(CASE WHEN {not_null} THEN 1 END) = {len(timepoint_params)}
+    )""")
+        qualified.append(f"SELECT {index} as table_index, '{table_config['type']}' as source, pid FROM Qualified_{index}")
+        params.extend(where_params)
+    return ','.join(ctes), ' UNION ALL '.join(qualified), params
+
+
+def compile_filter_query(tables, logic_param, participants_table):
+    """Compile one parameterized count query over any number of tables
+
+    Qualifying pids of all tables (see _qualified_pids) are joined to the
+    participants table once and counted per table, returning one
+    (count, source, male_count, female_count, other_count, table_index) row for each
+    table that has at least one qualifying participant.
+    """
+    if not tables:
+        return EMPTY_QUERY, []
+
+    ctes, qualified, params = _qualified_pids(tables, logic_param)
+    query = f"""
+    WITH{ctes},
+    ParticipantGenders AS (
+        SELECT
+            q.table_index,
+            q.source,
+            q.pid,
+            COALESCE(p.gender, 'Unknown') as gender
+        FROM (
+            {qualified}
+        ) q
+        LEFT JOIN {participants_table} p ON q.pid = p.pid
+        GROUP BY q.table_index, q.source, q.pid, p.gender
+    )
+    SELECT
+        COUNT(DISTINCT pid) as count,
+        source,{GENDER_COUNTS},
+        table_index
+    FROM ParticipantGenders
+    GROUP BY table_index, source
+    ORDER BY table_index
+    """
+    return query, params
+
+
+def compile_pid_query(tables, logic_param, pids=None):
+    """Compile the filter as a (table_index, pid) listing of qualifying participants
+
+    Used when genders are looked up in memory instead of joined and classified in SQL,
+    and (with pids) to re-check just the participants a data change touched.
+    """
+    if not tables:
+        return "SELECT 0 as table_index, NULL as pid WHERE 1=0", []
+
+    ctes, qualified, params = _qualified_pids(tables, logic_param, pids)
+    query = f"""
+    WITH{ctes}
+    SELECT table_index, pid
+    FROM (
+        {qualified}
+    ) q
+    """
+    return query, params
+
+
+def compile_baseline_pid_query(table_config):
+    """Pids of a table with rows at all six timepoints (the default-count population)"""
+    return f"""
+    SELECT pid
+    FROM {table_config['name']}
+    WHERE time_point IN ({','.join(str(tp) for tp in ALL_TIMEPOINTS)})
+    GROUP BY pid
+    HAVING COUNT(DISTINCT time_point) = {len(ALL_TIMEPOINTS)}
+    """
+
+
+def compile_baseline_delta_query(table_config, pid_count):
+    """(pid, gender) of the given participants that are in a table's default-count population
+
+    gender is MIN(gender_column) as in the baseline count query, or NULL for tables
+    whose gender comes from the participants table. Takes pid_count pid parameters.
+    """
+    gender = f"MIN({table_config['gender_column']})" if table_config['gender_column'] else 'NULL'
+    return f"""
+    SELECT pid, {gender} as gender
+    FROM {table_config['name']}
+    WHERE time_point IN ({','.join(str(tp) for tp in ALL_TIMEPOINTS)})
+    AND pid IN ({','.join('?' for _ in range(pid_count))})
+    GROUP BY pid
+    HAVING COUNT(DISTINCT time_point) = {len(ALL_TIMEPOINTS)}
+    """
+
+
+def compile_wave_query(table_config, logic_param):
+    """Compile the single grouped scan behind a per-wave breakdown
+
+    Returns one (pid, time_point, counted) row per participant and timepoint that
+    has rows passing the thresholds at the requested timepoints, where counted is
+    the number of those rows with all selected variables non-null. Every
+    combination of waves can be evaluated from these groups in process.
+    """
+    _, where, where_params, not_null = _filter_predicates(logic_param)
+    query = f"""
+    SELECT t.pid, t.time_point, COUNT(CASE WHEN {not_null} THEN 1 END) as counted
+    FROM {table_config['name']} t
+    WHERE {where}
+    GROUP BY t.pid, t.time_point
+    """
+    return query, where_params
+
+
+def compile_export_queries(tables, logic_param, include_variables=False):
+    """Compile one (source, query, params) per table listing the participants a filter selects
+
+    Without include_variables each query returns (source, pid) for the qualifying
+    pids; with it, their (source, pid, time_point, <variables>) rows at the requested
+    timepoints that pass the thresholds, i.e. the rows the filter counted.
+    """
+    _, where, where_params, _ = _filter_predicates(logic_param)
+    variables = (logic_param or {}).get('variables') or []
+    columns = ''.join(f", t.{quote_identifier(v['name'])}" for v in variables)
+
+    queries = []
+    for table_config in tables:
+        ctes, _, params = _qualified_pids([table_config], logic_param)
+        if include_variables:
+            query = f"""
+    WITH{ctes}
+    SELECT '{table_config['type']}' as source, t.pid, t.time_point{columns}
+    FROM {table_config['name']} t
+    WHERE {where}
+    AND t.pid IN (SELECT pid FROM Qualified_0)
+    ORDER BY t.pid, t.time_point
+    """
+            params = params + where_params
+        else:
+            query = f"""
+    WITH{ctes}
+    SELECT '{table_config['type']}' as source, pid
+    FROM Qualified_0
+    ORDER BY pid
+    """
+        queries.append((table_config['type'], query, params))
+    return queries
+
+
+def compile_sweep_query(table_config, logic_param, sweep_columns):
+    """Compile the single scan behind a threshold sweep
+
+    Returns the (pid, time_point, counted, <sweep columns>) rows that pass the base
+    filter's timepoint and threshold predicates, where counted flags rows with all
+    selected variables non-null. Only pids that have every requested timepoint under
+    the base filter are read, since an extra threshold can only remove rows.
+    """
+    timepoint_params, where, where_params, not_null = _filter_predicates(logic_param)
+    columns = ''.join(f", t.{quote_identifier(name)}" for name in sweep_columns)
+    query = f"""
+    SELECT t.pid, t.time_point, CASE WHEN {not_null} THEN 1 ELSE 0 END as counted{columns}
+    FROM {table_config['name']} t
+    WHERE {where}
+    AND t.pid IN (
+        SELECT t.pid
+        FROM {table_config['name']} t
+        WHERE {where}
+        GROUP BY t.pid
+        HAVING COUNT(DISTINCT t.time_point) = {len(timepoint_params)}
+    )
+    """
+    return query, where_params + where_params
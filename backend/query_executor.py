@@ -0,0 +1,72 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class QueryTimeout(Exception):
+    """Raised in place of a result when a task did not finish within its time budget"""
+
+
+class QueryExecutor:
+    """Bounded thread pool for running independent database queries concurrently
+
+    The pool is shared by all requests (max_workers caps total database concurrency
+    from this process) while per_request caps how many tasks a single request may
+    have in flight, so one large request cannot occupy every worker.
+    """
+
+    def __init__(self, max_workers=8, per_request=4, timeout=60):
+        self.max_workers = max_workers
+        self.per_request = max(1, min(per_request, max_workers))
+        self.timeout = timeout
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        # Worker threads do not survive fork(), so each process builds its own pool
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='query')
+                self._pid = os.getpid()
+            return self._pool
+
+    def run(self, tasks):
+        """Run callables concurrently and return their results (or raised exceptions) in order"""
+        if not tasks:
+            return []
+        if len(tasks) == 1:
+            try:
+                return [tasks[0]()]
+            except Exception as e:
+                return [e]
+
+        pool = self._get_pool()
+        results = [None] * len(tasks)
+        queue = list(enumerate(tasks))
+        queue.reverse()
+        running = {}
+        # The database enforces the per-query timeout; this is a backstop for the wait itself
+        budget = self.timeout * 2 + 5 if self.timeout else None
+        while queue or running:
+            while queue and len(running) < self.per_request:
+                index, task = queue.pop()
+                # Run in a copy of the caller's context so request-scoped state (timings) follows the task
+                running[pool.submit(contextvars.copy_context().run, task)] = index
+            done, _ = wait(running, timeout=budget, return_when=FIRST_COMPLETED)
+            if not done:
+                for future, index in running.items():
+                    future.cancel()
+                    results[index] = QueryTimeout(f"Query did not finish within {budget}s")
+                running.clear()
+                for index, _ in queue:
+                    results[index] = QueryTimeout("Request time budget exhausted")
+                break
+            for future in done:
+                index = running.pop(future)
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = e
+        return results
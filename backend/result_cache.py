@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from filter_spec import canonical_filter_spec
+
+
+def filter_cache_key(modality, logic_parameters, baseline=False):
+    """Return the cache key for one filter entry of a /query-data request"""
+    if baseline:
+        return json.dumps(['baseline', modality])
+    return json.dumps(['filter', canonical_filter_spec(modality, logic_parameters)], sort_keys=True)
+
+
+class ResultCache:
+    """Thread-safe LRU cache with a TTL and an approximate memory bound
+
+    Every entry records the tables it was computed from so that a data change in
+    one table only drops the results that depend on it. Entries stored with the
+    qualifying pids of each table (members) survive changes narrowed down to pids
+    (apply_changes): they are held back from get() until the caller re-checks just
+    those participants (stale() / resolve()).
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024, ttl=600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at, tables, size, members, pending)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'bypasses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+            'delta_pending': 0,
+            'delta_refreshes': 0
+        }
+
+    def _remove_locked(self, key):
+        size = self._entries.pop(key)[3]
+        self._bytes -= size
+
+    def get(self, key):
+        """Return the cached value or None, counting a hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                self._remove_locked(key)
+                self._counters['expirations'] += 1
+                entry = None
+            if entry is None or entry[5]:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[0]
+
+    def record_bypass(self):
+        with self._lock:
+            self._counters['bypasses'] += 1
+
+    def put(self, key, value, tables, members=None):
+        """Store a value computed from the given tables
+
+        members ({table: sorted pid array}) makes the entry refreshable per participant.
+        """
+        size = len(key) + len(json.dumps(value, default=str))
+        if members is not None:
+            members = {t.lower(): pids for t, pids in members.items()}
+            size += sum(int(pids.nbytes) for pids in members.values())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove_locked(key)
+            self._entries[key] = (
+                value, time.monotonic() + self.ttl, frozenset(t.lower() for t in tables), size, members, None
+            )
+            self._bytes += size
+            self._counters['stores'] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove_locked(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def invalidate_tables(self, tables):
+        """Drop every entry that depends on any of the given tables"""
+        tables = {t.lower() for t in tables}
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[2] & tables]
+            for key in stale:
+                self._remove_locked(key)
+            self._counters['invalidations'] += len(stale)
+        return len(stale)
+
+    def apply_changes(self, changes):
+        """ChangeTracker listener: mark entries for a per-participant refresh, drop the rest
+
+        Entries without members for every changed table they depend on (or with a
+        change that is not narrowed down to pids) are dropped as in invalidate_tables.
+        """
+        changes = {t.lower(): pids for t, pids in changes.items()}
+        with self._lock:
+            dropped = 0
+            for key, entry in list(self._entries.items()):
+                value, expires_at, tables, size, members, pending = entry
+                affected = tables & changes.keys()
+                if not affected:
+                    continue
+                if members is None or any(changes[t] is None or t not in members for t in affected):
+                    self._remove_locked(key)
+                    dropped += 1
+                    continue
+                pending = dict(pending or {})
+                for t in affected:
+                    pending[t] = np.union1d(pending[t], changes[t]) if t in pending else changes[t]
+                self._entries[key] = (value, expires_at, tables, size, members, pending)
+                self._counters['delta_pending'] += 1
+            self._counters['invalidations'] += dropped
+        return dropped
+
+    def stale(self, key):
+        """(value, members, pending) of an entry waiting for a per-participant refresh, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry[5] or entry[1] < time.monotonic():
+                return None
+            return entry[0], entry[4], entry[5]
+
+    def resolve(self, key, value, members, pending):
+        """Store the refreshed value of a stale() entry; changes that arrived meanwhile stay pending"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return
+        self.put(key, value, entry[2], members)
+        with self._lock:
+            self._counters['delta_refreshes'] += 1
+            current = self._entries.get(key)
+            if current is not None and entry[5] is not pending and entry[5]:
+                # Re-checking the earlier pids again is harmless, so keep the merged set
+                self._entries[key] = current[:5] + (entry[5],)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hit_ratio': round(self._counters['hits'] / lookups, 4) if lookups else None,
+                **self._counters
+            }
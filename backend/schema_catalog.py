@@ -0,0 +1,170 @@
+import hashlib
+import threading
+import time
+
+# SQL Server INFORMATION_SCHEMA.DATA_TYPE names grouped into the simplified types the frontend uses
+NUMBER_TYPES = {'int', 'bigint', 'smallint', 'tinyint', 'decimal', 'numeric', 'float', 'real', 'money', 'smallmoney'}
+DATETIME_TYPES = {'datetime', 'date', 'time', 'datetime2', 'datetimeoffset', 'smalldatetime'}
+STRING_TYPES = {'char', 'varchar', 'text', 'nchar', 'nvarchar', 'ntext'}
+
+
+def classify_sql_type(type_name):
+    """Map a SQL Server data type name to 'number', 'datetime', 'string' or 'other'"""
+    type_name = (type_name or '').lower()
+    if type_name in NUMBER_TYPES:
+        return 'number'
+    elif type_name in DATETIME_TYPES:
+        return 'datetime'
+    elif type_name in STRING_TYPES:
+        return 'string'
+    return 'other'
+
+
+class SchemaCatalog:
+    """In-process column metadata for every table in MODALITY_MAPPING
+
+    Columns for all mapped tables are loaded with a single INFORMATION_SCHEMA.COLUMNS
+    query. Afterwards the catalog is served from memory; every check_interval seconds
+    a background thread compares sys.tables.modify_date and reloads only if a mapped
+    table's definition changed.
+    """
+
+    def __init__(self, get_connection, modality_mapping, operators_for_type, check_interval=300):
+        self._get_connection = get_connection
+        self._mapping = modality_mapping
+        self._operators_for_type = operators_for_type
+        self.check_interval = check_interval
+        self.tables = sorted({t['name'] for m in modality_mapping.values() for t in m['tables']})
+        self._load_lock = threading.Lock()
+        self._flag_lock = threading.Lock()
+        self._columns = None  # lower-cased table name -> [(column, simplified type), ...]
+        self._variables = {}  # (modality, cohort_type) -> sorted variable list served by /get-variables
+        self._version = None
+        self._loaded_at = None
+        self._checked_at = 0
+        self._refreshing = False
+
+    def _fetch_version(self, cursor):
+        placeholders = ','.join('?' for _ in self.tables)
+        cursor.execute(
+            f"SELECT name, modify_date FROM sys.tables WHERE name IN ({placeholders})",
+            self.tables
+        )
+        return tuple(sorted((row[0].lower(), str(row[1])) for row in cursor.fetchall()))
+
+    def _fetch_columns(self, cursor):
+        placeholders = ','.join('?' for _ in self.tables)
+        cursor.execute(
+            f"""
+            SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_NAME IN ({placeholders})
+            ORDER BY TABLE_NAME, ORDINAL_POSITION
+            """,
+            self.tables
+        )
+        columns = {}
+        for table_name, column_name, data_type in cursor.fetchall():
+            columns.setdefault(table_name.lower(), []).append((column_name, classify_sql_type(data_type)))
+        return columns
+
+    def _build_variables(self, columns):
+        operators = {}
+        variables_by_key = {}
+        for modality, config in self._mapping.items():
+            for cohort_type in {t['type'] for t in config['tables']}:
+                variables = {}
+                for table in config['tables']:
+                    if table['type'] != cohort_type:
+                        continue
+                    for col_name, data_type in columns.get(table['name'].lower(), []):
+                        # Only update if not exists or if current type is more specific
+                        if col_name not in variables or variables[col_name]['type'] == 'other':
+                            if data_type not in operators:
+                                operators[data_type] = self._operators_for_type(data_type)
+                            variables[col_name] = {
+                                'name': col_name,
+                                'type': data_type,
+                                'operators': operators[data_type]
+                            }
+                variables_by_key[(modality, cohort_type)] = sorted(variables.values(), key=lambda x: x['name'])
+        return variables_by_key
+
+    def refresh(self, force=False):
+        """Reload the catalog if the schema version changed; returns False if the database was unreachable"""
+        with self._load_lock:
+            conn = self._get_connection()
+            if not conn:
+                return False
+            try:
+                cursor = conn.cursor()
+                try:
+                    version = self._fetch_version(cursor)
+                    if force or self._columns is None or version != self._version:
+                        columns = self._fetch_columns(cursor)
+                        self._variables = self._build_variables(columns)
+                        self._columns = columns
+                        self._version = version
+                        self._loaded_at = time.time()
+                finally:
+                    cursor.close()
+                self._checked_at = time.monotonic()
+                return True
+            except Exception as e:
+                print(f"Error loading schema catalog: {e}")
+                return False
+            finally:
+                conn.close()
+
+    def _refresh_in_background(self):
+        with self._flag_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='schema-catalog-refresh', daemon=True).start()
+
+    def warm(self):
+        """Load the catalog in a background thread so startup is not blocked on the database"""
+        self._refresh_in_background()
+
+    def _ensure_loaded(self):
+        if self._columns is None:
+            return self.refresh()
+        if time.monotonic() - self._checked_at > self.check_interval:
+            self._refresh_in_background()
+        return True
+
+    def variables(self, modality, cohort_type):
+        """Return the sorted variable list for a modality/cohort, or None if the catalog cannot be loaded"""
+        if not self._ensure_loaded():
+            return None
+        return self._variables.get((modality, cohort_type), [])
+
+    def columns(self, table_name):
+        """Return [(column, simplified type), ...] for a mapped table, or None if the catalog cannot be loaded"""
+        if not self._ensure_loaded():
+            return None
+        return self._columns.get(table_name.lower(), [])
+
+    def version(self):
+        """Token of the loaded schema version (changes when a mapped table's definition does), or None"""
+        if not self._ensure_loaded() or self._version is None:
+            return None
+        return hashlib.sha1(repr(self._version).encode()).hexdigest()[:16]
+
+    def stats(self):
+        """Describe what is cached and how fresh it is"""
+        return {
+            'loaded': self._columns is not None,
+            'loaded_at': self._loaded_at,
+            'seconds_since_check': round(time.monotonic() - self._checked_at, 1) if self._checked_at else None,
+            'check_interval': self.check_interval,
+            'tables': {t: len((self._columns or {}).get(t.lower(), [])) for t in self.tables}
+        }
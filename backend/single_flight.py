@@ -0,0 +1,61 @@
+import threading
+
+
+class Flight:
+    """One in-flight execution that identical callers wait on"""
+
+    __slots__ = ('key', 'outcome', '_done', 'waiters')
+
+    def __init__(self, key):
+        self.key = key
+        self.outcome = None
+        self._done = threading.Event()
+        self.waiters = 0
+
+    def wait(self, timeout=None):
+        """Block until the leader finishes; returns False on timeout"""
+        return self._done.wait(timeout)
+
+
+class SingleFlight:
+    """Coalesce identical concurrent executions so only one of them does the work
+
+    The first caller for a key becomes the leader and runs the work; callers
+    arriving while it runs get the same Flight and wait for its outcome, which is
+    shared as-is (results and exceptions alike). Nothing is kept once the leader
+    finishes, so this only merges requests that overlap in time.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counters = {'executions': 0, 'coalesced': 0}
+
+    def begin(self, key):
+        """Return (flight, leader); the leader must call finish() exactly once"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self._counters['coalesced'] += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            self._counters['executions'] += 1
+            return flight, True
+
+    def finish(self, flight, outcome):
+        """Publish the leader's outcome (a result or an exception) and wake the waiters"""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.outcome = outcome
+        flight._done.set()
+
+    def stats(self):
+        """Executions run, executions saved by coalescing, and what is in flight now"""
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'waiting': sum(f.waiters for f in self._flights.values()),
+                **self._counters
+            }
@@ -0,0 +1,154 @@
+import hashlib
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRINGS = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'(?<![\w\]])[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b')
+_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """SQL with comments removed, literals and IN lists replaced by ? and whitespace collapsed"""
+    sql = _COMMENTS.sub(' ', sql)
+    sql = _STRINGS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = _IN_LISTS.sub('(?+)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+@lru_cache(maxsize=2048)
+def fingerprint_sql(sql):
+    """Stable id of a query shape: same tables/columns/operators, any literal values"""
+    return hashlib.sha1(normalize_sql(sql).lower().encode()).hexdigest()[:16]
+
+
+class SlowQueryLog:
+    """Per-fingerprint query statistics plus a bounded log of queries slower than threshold_ms
+
+    Every completed statement (execute plus its fetches) is aggregated under its
+    fingerprint. Slow ones are also kept with their parameters, row count and labels.
+    With capture_plans, the estimated plan of each slow fingerprint is fetched once
+    in the background (SET SHOWPLAN_XML ON, which compiles without executing).
+    """
+
+    def __init__(self, get_connection, threshold_ms=1000, max_entries=200, capture_plans=False):
+        self._get_connection = get_connection
+        self.threshold_ms = threshold_ms
+        self.capture_plans = capture_plans
+        self._entries = deque(maxlen=max_entries)
+        self._fingerprints = {}  # fingerprint -> aggregate dict
+        self._plans = {}  # fingerprint -> plan XML (or error text)
+        self._capturing = set()
+        self._plan_thread = threading.local()  # Set while capturing, so SHOWPLAN statements are not recorded
+        self._lock = threading.Lock()
+
+    def record(self, sql, params, seconds, rows, labels=None, error=None):
+        if getattr(self._plan_thread, 'active', False):
+            return
+        fingerprint = fingerprint_sql(sql)
+        slow = seconds * 1000 >= self.threshold_ms
+        with self._lock:
+            stats = self._fingerprints.get(fingerprint)
+            if stats is None:
+                stats = self._fingerprints[fingerprint] = {
+                    'fingerprint': fingerprint,
+                    'query': normalize_sql(sql),
+                    'calls': 0,
+                    'slow_calls': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'rows': 0,
+                    'errors': 0,
+                    'last_seen': None
+                }
+            stats['calls'] += 1
+            stats['total_ms'] += seconds * 1000
+            stats['max_ms'] = max(stats['max_ms'], seconds * 1000)
+            stats['rows'] += rows
+            if error is not None:
+                stats['errors'] += 1
+            stats['last_seen'] = time.time()
+            if slow:
+                stats['slow_calls'] += 1
+                self._entries.append({
+                    'fingerprint': fingerprint,
+                    'at': time.time(),
+                    'duration_ms': round(seconds * 1000, 3),
+                    'rows': rows,
+                    'params': [p if isinstance(p, (int, float, str)) or p is None else str(p) for p in params or []],
+                    'labels': dict(labels or {}),
+                    'error': str(error) if error is not None else None,
+                    'query': sql
+                })
+            capture = slow and self.capture_plans and fingerprint not in self._plans \
+                and fingerprint not in self._capturing
+            if capture:
+                self._capturing.add(fingerprint)
+        if capture:
+            threading.Thread(
+                target=self._capture_plan, args=(fingerprint, sql, params), name='slow-query-plan', daemon=True
+            ).start()
+
+    def _capture_plan(self, fingerprint, sql, params):
+        plan = None
+        self._plan_thread.active = True
+        conn = self._get_connection()
+        if not conn:
+            with self._lock:
+                self._capturing.discard(fingerprint)
+            return
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SET SHOWPLAN_XML ON")
+                try:
+                    cursor.execute(sql, params or [])
+                    plan = ''.join(str(row[0]) for row in cursor.fetchall())
+                finally:
+                    cursor.execute("SET SHOWPLAN_XML OFF")
+            finally:
+                cursor.close()
+        except Exception as e:
+            plan = f"Plan capture failed: {e}"
+            conn.invalidate()  # Do not hand a session that may still have SHOWPLAN on back to the pool
+        finally:
+            conn.close()
+        with self._lock:
+            self._plans[fingerprint] = plan
+            self._capturing.discard(fingerprint)
+
+    def fingerprints(self, limit=50):
+        """Aggregates per fingerprint, most total time first"""
+        with self._lock:
+            stats = sorted(self._fingerprints.values(), key=lambda s: s['total_ms'], reverse=True)[:limit]
+            return [
+                {
+                    **s,
+                    'total_ms': round(s['total_ms'], 3),
+                    'max_ms': round(s['max_ms'], 3),
+                    'avg_ms': round(s['total_ms'] / s['calls'], 3),
+                    'has_plan': s['fingerprint'] in self._plans
+                }
+                for s in stats
+            ]
+
+    def entries(self, fingerprint=None):
+        """Logged slow executions, newest first"""
+        with self._lock:
+            return [e for e in reversed(self._entries) if fingerprint is None or e['fingerprint'] == fingerprint]
+
+    def plan(self, fingerprint):
+        with self._lock:
+            return self._plans.get(fingerprint)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._fingerprints.clear()
+            self._plans.clear()
@@ -0,0 +1,276 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = '.building'
+
+
+def _disk_array(array):
+    """Array as it is written to disk: object (string) arrays become fixed-width unicode so they can be mapped"""
+    array = np.asarray(array)
+    if array.dtype == object:
+        array = array.astype(str)
+    return array
+
+
+class Snapshot:
+    """One published version of a named snapshot, with its arrays memory-mapped read-only"""
+
+    def __init__(self, name, version, manifest, arrays):
+        self.name = name
+        self.version = version
+        self.data_version = manifest.get('data_version')
+        self.created_at = manifest.get('created_at')
+        self.meta = manifest.get('meta', {})
+        self.arrays = arrays
+
+    def nbytes(self):
+        return int(sum(a.nbytes for a in self.arrays.values()))
+
+
+class SnapshotStore:
+    """Versioned on-disk snapshots of in-memory study data, shared by every worker process
+
+    A snapshot is a directory of .npy files (one per array) plus a manifest, under
+    root/<name>/<version>/. publish() writes a new version to a temporary directory,
+    renames it into place and then atomically replaces root/<name>/CURRENT, so a
+    reader sees either the old or the new version, never a partial one. load()
+    memory-maps the arrays read-only: the operating system shares the pages between
+    processes, so N workers hold one copy in RAM, and a restarted worker maps the
+    current version instead of re-reading the tables from SQL Server. Old versions
+    are removed once `keep` newer ones exist; readers that still map them keep
+    working (the files stay until unmapped; on Windows removal is retried later).
+
+    Snapshots are tagged with a data version token (see
+    TableVersionTracker.token), so a worker only reuses a snapshot that matches the
+    data it would otherwise read.
+    """
+
+    def __init__(self, root, data_version=None, keep=2, lock_timeout=600):
+        self.root = root
+        self._data_version = data_version  # callable(tables) -> token or None
+        self.keep = keep
+        self.lock_timeout = lock_timeout
+        self._mapped = {}  # name -> Snapshot mapped by this process
+        self._lock = threading.Lock()
+        self._counters = {'loads': 0, 'reused': 0, 'outdated': 0, 'publishes': 0, 'publish_errors': 0, 'pruned': 0}
+
+    def _path(self, name, *parts):
+        return os.path.join(self.root, name, *parts)
+
+    def data_version(self, tables):
+        """Current data version token of these tables, or None if it is unknown"""
+        if self._data_version is None:
+            return None
+        try:
+            return self._data_version(tables)
+        except Exception as e:
+            print(f"Error reading data version for snapshot: {e}")
+            return None
+
+    def current_version(self, name):
+        try:
+            with open(self._path(name, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def load(self, name, tables=None, max_age=None):
+        """Map the current version of a snapshot, or return None if it is missing or outdated
+
+        With tables, the snapshot is only used when it is younger than max_age and
+        its data version matches the tables' current token (any version is accepted
+        while the token is unknown, e.g. the database is unreachable).
+        """
+        version = self.current_version(name)
+        if version is None:
+            return None
+        with self._lock:
+            snapshot = self._mapped.get(name)
+        if snapshot is None or snapshot.version != version:
+            try:
+                snapshot = self._open(name, version)
+            except (OSError, ValueError) as e:
+                print(f"Error opening snapshot {name}/{version}: {e}")
+                return None
+            with self._lock:
+                self._mapped[name] = snapshot
+                self._counters['loads'] += 1
+
+        if tables is not None:
+            token = self.data_version(tables)
+            expired = max_age is not None and time.time() - (snapshot.created_at or 0) > max_age
+            if expired or (token is not None and token != snapshot.data_version):
+                self._counters['outdated'] += 1
+                return None
+        self._counters['reused'] += 1
+        return snapshot
+
+    def _open(self, name, version):
+        directory = self._path(name, version)
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        arrays = {
+            key: np.load(os.path.join(directory, entry['file']), mmap_mode='r', allow_pickle=False).view(np.ndarray)
+            for key, entry in manifest['arrays'].items()
+        }
+        return Snapshot(name, version, manifest, arrays)
+
+    def publish(self, name, arrays, meta=None, tables=None, data_version=None):
+        """Write a new version and make it current; returns the mapped Snapshot, or None on error
+
+        Pass the data version token read *before* the data was loaded (so a change
+        that races the load leaves the snapshot outdated rather than mislabelled);
+        with only tables, the current token is used.
+        """
+        if data_version is None and tables is not None:
+            data_version = self.data_version(tables)
+        version = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        staging = self._path(name, f".tmp-{version}")
+        try:
+            os.makedirs(staging)
+            entries = {}
+            for position, (key, array) in enumerate(arrays.items()):
+                array = _disk_array(array)
+                file_name = f"{position:04d}.npy"
+                np.save(os.path.join(staging, file_name), array, allow_pickle=False)
+                entries[key] = {'file': file_name, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            manifest = {
+                'name': name,
+                'version': version,
+                'data_version': data_version,
+                'created_at': time.time(),
+                'meta': meta or {},
+                'arrays': entries
+            }
+            with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f)
+            os.rename(staging, self._path(name, version))
+
+            pointer = self._path(name, f"{CURRENT_FILE}.{version}")
+            with open(pointer, 'w') as f:
+                f.write(version)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(pointer, self._path(name, CURRENT_FILE))
+        except (OSError, ValueError) as e:
+            print(f"Error publishing snapshot {name}: {e}")
+            self._counters['publish_errors'] += 1
+            shutil.rmtree(staging, ignore_errors=True)
+            return None
+        self._counters['publishes'] += 1
+        self._prune(name, version)
+        return self.load(name)
+
+    def _prune(self, name, current):
+        """Remove all but the newest `keep` versions (leftover staging directories too)"""
+        directory = self._path(name)
+        versions = sorted(
+            (v for v in os.listdir(directory) if os.path.isdir(os.path.join(directory, v))),
+            key=lambda v: os.path.getmtime(os.path.join(directory, v)), reverse=True
+        )
+        kept = 0
+        for version in versions:
+            path = os.path.join(directory, version)
+            if version.startswith('.tmp-'):
+                if time.time() - os.path.getmtime(path) > self.lock_timeout:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            if version == current or kept < self.keep:
+                kept += 1
+                continue
+            try:
+                shutil.rmtree(path)
+                self._counters['pruned'] += 1
+            except OSError:
+                pass  # still mapped by a reader on a platform that forbids removal; retried on the next publish
+
+    def get_or_build(self, name, tables, build, max_age=None, rebuild=False):
+        """Current snapshot of `name`, or build() one, publish it and map it
+
+        build() -> (arrays, meta) reads the data; it runs in at most one process at a
+        time. Returns (snapshot, built); snapshot is None when another process is
+        building right now. If publishing fails the built arrays are returned
+        unmapped, so the caller still gets its data.
+        """
+        if not rebuild:
+            snapshot = self.load(name, tables, max_age)
+            if snapshot is not None:
+                return snapshot, False
+        release = self.claim(name)
+        if release is None:
+            return None, False
+        try:
+            if not rebuild:
+                snapshot = self.load(name, tables, max_age)  # published while we waited for the claim
+                if snapshot is not None:
+                    return snapshot, False
+            token = self.data_version(tables)  # before reading, so a racing change leaves it outdated
+            arrays, meta = build()
+            snapshot = self.publish(name, arrays, meta, data_version=token)
+            if snapshot is None:
+                manifest = {'data_version': token, 'created_at': time.time(), 'meta': meta}
+                snapshot = Snapshot(name, None, manifest, arrays)
+            return snapshot, True
+        finally:
+            release()
+
+    def claim(self, name):
+        """Try to become the process that builds the next version of `name`
+
+        Returns a release() callable, or None when another process holds the claim
+        (it will publish shortly; keep serving the current version meanwhile).
+        Claims older than lock_timeout are treated as abandoned.
+        """
+        os.makedirs(self._path(name), exist_ok=True)
+        path = self._path(name, LOCK_FILE)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) <= self.lock_timeout:
+                        return None
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+
+            def release():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+            return release
+        return None
+
+    def stats(self):
+        """Current version, data version and mapped size per snapshot"""
+        snapshots = {}
+        names = sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []
+        with self._lock:
+            mapped = dict(self._mapped)
+        for name in names:
+            version = self.current_version(name)
+            if version is None:
+                continue
+            snapshot = mapped.get(name)
+            snapshots[name] = {
+                'version': version,
+                'mapped_version': snapshot.version if snapshot else None,
+                'data_version': snapshot.data_version if snapshot else None,
+                'created_at': snapshot.created_at if snapshot else None,
+                'bytes': snapshot.nbytes() if snapshot else None,
+                'building': os.path.exists(self._path(name, LOCK_FILE))
+            }
+        return {'root': self.root, 'keep': self.keep, 'snapshots': snapshots, **self._counters}
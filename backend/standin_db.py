@@ -0,0 +1,173 @@
+import sqlite3
+import time
+
+import pyodbc
+
+# SQLite column types the synthetic tables declare (SQL Server names, so the schema catalog classifies them)
+_TYPE_ALIASES = {'integer': 'int', 'real': 'float', 'text': 'nvarchar'}
+
+
+def quote_name(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sql_server_type(declared):
+    declared = (declared or '').split('(')[0].strip().lower()
+    return _TYPE_ALIASES.get(declared, declared)
+
+
+class StandinCursor:
+    """pyodbc-style cursor over SQLite
+
+    SQLite errors are raised as pyodbc errors so the app's error handling applies
+    unchanged. SQLite has no sys.* catalog views, so the app's catalog queries
+    (schema_catalog, table_versions) are answered from sqlite_master and
+    PRAGMA table_info; with SET SHOWPLAN_XML ON, statements return SQLite's
+    EXPLAIN QUERY PLAN instead of running.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursor = connection._db.cursor()
+        self._rows = None  # Result of an emulated catalog query
+        self.description = None
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        params = list(params)
+        self._rows = None
+        statement = sql.strip().upper()
+        try:
+            if statement.startswith('SET SHOWPLAN_XML'):
+                self._connection.showplan = statement.endswith('ON')
+                self._emulated([], ['plan'])
+            elif self._connection.showplan:
+                self._cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                plan = '\n'.join(f"{row[0]} {row[1]} {row[3]}" for row in self._cursor.fetchall())
+                self._emulated([(plan,)], ['plan'])
+            elif 'INFORMATION_SCHEMA.COLUMNS' in statement:
+                self._emulated(self._catalog_columns(params), ['TABLE_NAME', 'COLUMN_NAME', 'DATA_TYPE'])
+            elif 'FROM SYS.TABLES' in statement:
+                self._emulated(self._catalog_tables(params, 'ROW_COUNT' in statement), None)
+            else:
+                self._connection.start_statement()
+                self._cursor.execute(sql, params)
+                self.description = self._cursor.description
+        except sqlite3.OperationalError as e:
+            raise self._connection.translate(e) from e
+        except sqlite3.Error as e:
+            raise pyodbc.Error(str(e)) from e
+        return self
+
+    def _emulated(self, rows, columns):
+        self._rows = iter(rows)
+        columns = columns or ['name', 'modify_date', 'row_count', 'last_update']
+        self.description = [(name, None, None, None, None, None, True) for name in columns]
+
+    def _catalog_columns(self, tables):
+        rows = []
+        for table_name in sorted(tables):
+            for column in self._connection._db.execute(f"PRAGMA table_info({quote_name(table_name)})").fetchall():
+                rows.append((table_name, column[1], _sql_server_type(column[2])))
+        return rows
+
+    def _catalog_tables(self, tables, with_rows):
+        db = self._connection._db
+        existing = {name.lower(): name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        version = db.execute("PRAGMA schema_version").fetchone()[0]
+        rows = []
+        for table_name in tables:
+            name = existing.get(table_name.lower())
+            if name is None:
+                continue
+            if with_rows:
+                row_count = db.execute(f"SELECT COUNT(*) FROM {quote_name(name)}").fetchone()[0]
+                rows.append((name, str(version), row_count, None))
+            else:
+                rows.append((name, str(version)))
+        return rows
+
+    def _fetch(self, method, *args):
+        try:
+            return method(*args)
+        except sqlite3.OperationalError as e:
+            raise self._connection.translate(e) from e
+        except sqlite3.Error as e:
+            raise pyodbc.Error(str(e)) from e
+
+    def fetchone(self):
+        if self._rows is not None:
+            return next(self._rows, None)
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        if self._rows is not None:
+            return [row for _, row in zip(range(size or 1), self._rows)]
+        return self._fetch(self._cursor.fetchmany, size or self._cursor.arraysize)
+
+    def fetchall(self):
+        if self._rows is not None:
+            return list(self._rows)
+        return self._fetch(self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def cancel(self):
+        self._connection.cancel()
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandinConnection:
+    """pyodbc-style connection to a local SQLite database standing in for SQL Server
+
+    timeout works like pyodbc's query timeout (seconds, 0 = none), enforced with a
+    progress handler; cancel() interrupts the running statement.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)  # The pool hands connections between threads
+        self.timeout = 0
+        self.showplan = False
+        self._expires = None
+        self._cancelled = False
+        self._db.set_progress_handler(self._progress, 10000)
+
+    def _progress(self):
+        """Non-zero aborts the running statement"""
+        return self._cancelled or (self._expires is not None and time.monotonic() > self._expires)
+
+    def start_statement(self):
+        self._cancelled = False
+        self._expires = time.monotonic() + self.timeout if self.timeout else None
+
+    def translate(self, error):
+        if str(error) == 'interrupted':
+            if self._cancelled:
+                return pyodbc.OperationalError('HY008', 'Operation canceled')
+            return pyodbc.OperationalError('HYT00', 'Query timeout expired')
+        return pyodbc.OperationalError(str(error))
+
+    def cancel(self):
+        self._cancelled = True
+        self._db.interrupt()
+
+    def cursor(self):
+        return StandinCursor(self)
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def close(self):
+        self._db.close()
+
+
+def connect(path):
+    """Open a stand-in connection to the SQLite database at path"""
+    return StandinConnection(path)
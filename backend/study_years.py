@@ -0,0 +1,55 @@
+import numpy as np
+
+from timepoint_index import GENDER_NULL, pid_array
+
+
+def participants_table(pattern, year):
+    return pattern.format(year=year)
+
+
+def study_mapping(modality_tables, year):
+    """MODALITY_MAPPING of one study year from table names with a {year} placeholder
+
+    A modality with a 'years' list is only mapped in those years; without one it
+    is mapped in every study year.
+    """
+    return {
+        modality: {'tables': [{**t, 'name': t['name'].format(year=year)} for t in config['tables']]}
+        for modality, config in modality_tables.items()
+        if not config.get('years') or year in config['years']
+    }
+
+
+def parse_years(value, study_years):
+    """Validate a `years` selector: a list of study years (sorted, unique), or None when absent"""
+    if value is None:
+        return None
+    if not isinstance(value, list) or not value:
+        raise ValueError("years must be a non-empty list of study years")
+    try:
+        years = sorted({int(year) for year in value})
+    except (TypeError, ValueError):
+        raise ValueError("years must be a non-empty list of study years")
+    unknown = [year for year in years if year not in study_years]
+    if unknown:
+        raise ValueError(
+            f"Unknown study years: {', '.join(map(str, unknown))} (available: {', '.join(map(str, study_years))})"
+        )
+    return years
+
+
+def union_participants(parts):
+    """Union of (sorted pids, gender codes) parts, each participant counted once
+
+    Parts are given from lowest to highest priority (e.g. oldest to newest year): a
+    participant's gender code comes from the last part that knows it.
+    """
+    parts = [(pid_array(pids), codes) for pids, codes in parts if len(pids)]
+    if not parts:
+        return pid_array([]), np.zeros(0, dtype=np.int8)
+    pids = np.unique(np.concatenate([p for p, _ in parts]))
+    codes = np.full(len(pids), GENDER_NULL, dtype=np.int8)
+    for part_pids, part_codes in parts:
+        known = part_codes != GENDER_NULL
+        codes[np.searchsorted(pids, part_pids[known])] = part_codes[known]
+    return pids, codes
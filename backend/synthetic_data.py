@@ -0,0 +1,225 @@
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+
+TIMEPOINTS = (1, 2, 3, 4, 5, 6)
+
+# Gender strings as they appear in the study data: mixed case, trailing spaces, free text, blanks and NULLs
+GENDER_VALUES = (
+    ('M', 20), ('F', 20), ('Male', 10), ('female', 10), ('MALE', 5), ('FEMALE', 5), ('male ', 3), ('Female ', 2),
+    ('Other', 3), ('Non-binary', 2), ('Prefer not to say', 2), ('', 3), (None, 15)
+)
+
+ASA24_COLUMNS = ('KCAL', 'PROT', 'TFAT', 'CARB', 'MOIS', 'ALC', 'CAFF', 'SUGR', 'FIBE', 'CALC', 'IRON', 'SODI',
+                 'VC', 'VD')
+QUALTRICS_COLUMNS = tuple(f'Q{i}' for i in range(1, 21))
+
+# name -> (cohort, gender column or None, [(column, SQL Server type, generator kind)])
+TABLES = {
+    'asa24_children_totals_2025': ('children', None, [(c, 'float', 'nutrient') for c in ASA24_COLUMNS] +
+                                   [('ReportingDate', 'date', 'date')]),
+    'asa24_parents_totals_2025': ('adults', None, [(c, 'float', 'nutrient') for c in ASA24_COLUMNS] +
+                                  [('ReportingDate', 'date', 'date')]),
+    'qualtrics_children_data_2025': ('children', 'gender', [(c, 'int', 'likert') for c in QUALTRICS_COLUMNS] +
+                                     [('StartDate', 'datetime2', 'date'), ('comments', 'nvarchar', 'text')]),
+    'qualtrics_parent_data_2025': ('adults', 'gender_v2', [(c, 'int', 'likert') for c in QUALTRICS_COLUMNS] +
+                                   [('StartDate', 'datetime2', 'date'), ('comments', 'nvarchar', 'text')]),
+    'child_demographics_2025': ('children', 'gender', [('age', 'float', 'age_child'), ('grade', 'int', 'small'),
+                                                       ('race', 'nvarchar', 'category'),
+                                                       ('zipcode', 'nvarchar', 'zip')]),
+    'parent_demographics_2025': ('adults', 'gender_v2', [('age', 'float', 'age_adult'), ('income', 'int', 'income'),
+                                                         ('education', 'int', 'small'),
+                                                         ('race', 'nvarchar', 'category'),
+                                                         ('zipcode', 'nvarchar', 'zip')])
+}
+PARTICIPANTS_TABLE = 'participants_2025'
+BASE_YEAR = 2025
+# Change tracking column (see CHANGE_TRACKING_COLUMN): set on insert by its default and on update by a trigger
+MODIFIED_COLUMN = 'modified_at'
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+CATEGORIES = np.array(['White', 'Black', 'Asian', 'Hispanic', 'Multiracial', 'Other'], dtype=object)
+WORDS = np.array(['fine', 'tired', 'busy week', 'ate out', 'sick', 'holiday', 'n/a'], dtype=object)
+
+
+def participants_for_rows(rows):
+    """Participants per cohort that give roughly `rows` rows across all study tables"""
+    # Six tables, six waves, ~80% attendance and a few repeated ASA24 recalls
+    return max(10, int(rows / (len(TABLES) * len(TIMEPOINTS) * 0.8 * 1.03)))
+
+
+def _ages(pid, time_point, low, high, rng):
+    """Age at enrolment per participant, growing half a year per wave"""
+    enrolled = dict(zip(np.unique(pid).tolist(), rng.uniform(low, high, len(np.unique(pid))).tolist()))
+    return (np.array([enrolled[p] for p in pid.tolist()]) + (time_point - 1) * 0.5).round(1)
+
+
+def _values(kind, n, rng):
+    if kind == 'nutrient':
+        return rng.lognormal(7.5, 0.5, n).round(2)
+    if kind == 'likert':
+        return rng.integers(1, 6, n)
+    if kind == 'small':
+        return rng.integers(1, 13, n)
+    if kind == 'income':
+        return rng.integers(1, 11, n)
+    if kind == 'date':
+        days = rng.integers(0, 6 * 365, n)
+        return np.datetime_as_string(np.datetime64('2019-01-01') + days.astype('timedelta64[D]')).astype(object)
+    if kind == 'category':
+        return CATEGORIES[rng.integers(0, len(CATEGORIES), n)]
+    if kind == 'zip':
+        return np.char.zfill(rng.integers(501, 99951, n).astype(str), 5).astype(object)
+    return WORDS[rng.integers(0, len(WORDS), n)]
+
+
+def _genders(n, rng):
+    values = np.array([v for v, _ in GENDER_VALUES], dtype=object)
+    weights = np.array([w for _, w in GENDER_VALUES], dtype=float)
+    return values[rng.choice(len(values), n, p=weights / weights.sum())]
+
+
+def _with_nulls(values, null_rate, rng):
+    values = values.astype(object)
+    values[rng.random(len(values)) < null_rate] = None
+    return values
+
+
+def _insert(db, table_name, columns, arrays, batch_size=50000):
+    statement = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    for start in range(0, len(arrays[0]), batch_size):
+        db.executemany(statement, zip(*(a[start:start + batch_size].tolist() for a in arrays)))
+
+
+def _track_modifications(db, table_name):
+    db.execute(
+        f"CREATE TRIGGER {table_name}_{MODIFIED_COLUMN} AFTER UPDATE ON {table_name} "
+        f"WHEN NEW.{MODIFIED_COLUMN} IS OLD.{MODIFIED_COLUMN} "
+        f"BEGIN UPDATE {table_name} SET {MODIFIED_COLUMN} = {NOW} WHERE rowid = NEW.rowid; END"
+    )
+
+
+def year_table(table_name, year):
+    """Name of a table in another study year (the 2025 names with the year replaced)"""
+    return table_name.replace(f'_{BASE_YEAR}', f'_{year}')
+
+
+def _cohort_pids(participants, years, rng):
+    """pids per (year, cohort): about 70% of a year's participants return the next year, new ones join"""
+    next_pid = 1
+    pids = {}
+    for index, year in enumerate(years):
+        for cohort in ('children', 'adults'):
+            previous = pids.get((years[index - 1], cohort)) if index else None
+            returning = previous[rng.random(len(previous)) < 0.7] if previous is not None else np.array([], dtype=int)
+            joining = np.arange(next_pid, next_pid + participants - len(returning))
+            next_pid += len(joining)
+            pids[(year, cohort)] = np.sort(np.concatenate([returning, joining]))
+    return pids
+
+
+def generate(path, participants=2000, seed=2025, years=(BASE_YEAR,)):
+    """Write the participants table and the six mapped study tables of each year to a SQLite database at path
+
+    Each cohort has `participants` pids per year, about 70% of them returning from
+    the year before. Every wave is attended by fewer of them (95% down to 65%),
+    ASA24 tables repeat ~10% of recalls, each variable gets its own NULL rate
+    (2-30%) and gender strings are as messy as the real ones. Gender columns are
+    declared COLLATE NOCASE to match SQL Server's case-insensitive collation. Every
+    table has a modified_at column maintained on insert and update. Returns
+    {table: rows}.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = np.random.default_rng(seed)
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode = OFF')
+    db.execute('PRAGMA synchronous = OFF')
+
+    years = sorted(years)
+    year_pids = _cohort_pids(participants, years, rng)
+    every_pid = np.unique(np.concatenate(list(year_pids.values())))
+    gender_of = dict(zip(every_pid.tolist(), _genders(len(every_pid), rng).tolist()))
+    counts = {}
+    for year in years:
+        pids = {cohort: year_pids[(year, cohort)] for cohort in ('children', 'adults')}
+        counts.update(_generate_year(db, year, pids, gender_of, rng))
+    db.commit()
+    db.close()
+    return counts
+
+
+def _generate_year(db, year, pids, gender_of, rng):
+    participants_table = year_table(PARTICIPANTS_TABLE, year)
+    all_pids = np.concatenate([pids['children'], pids['adults']])
+    genders = np.array([gender_of[p] for p in all_pids.tolist()], dtype=object)
+    db.execute(
+        f"CREATE TABLE {participants_table} (pid int PRIMARY KEY, gender nvarchar COLLATE NOCASE, "
+        f"{MODIFIED_COLUMN} datetime2 DEFAULT ({NOW}))"
+    )
+    _track_modifications(db, participants_table)
+    _insert(db, participants_table, ['pid', 'gender'], [all_pids.astype(object), genders])
+    counts = {participants_table: len(all_pids)}
+
+    for base_name, (cohort, gender_column, columns) in TABLES.items():
+        table_name = year_table(base_name, year)
+        cohort_pids = pids[cohort]
+        attended = [cohort_pids[rng.random(len(cohort_pids)) < 0.95 - 0.06 * (tp - 1)] for tp in TIMEPOINTS]
+        pid = np.concatenate(attended)
+        time_point = np.concatenate([np.full(len(a), tp) for a, tp in zip(attended, TIMEPOINTS)])
+        if base_name.startswith('asa24'):
+            repeated = rng.random(len(pid)) < 0.1
+            pid = np.concatenate([pid, pid[repeated]])
+            time_point = np.concatenate([time_point, time_point[repeated]])
+        order = np.lexsort((time_point, pid))
+        pid, time_point = pid[order], time_point[order]
+
+        names = ['pid', 'time_point']
+        arrays = [pid.astype(object), time_point.astype(object)]
+        definitions = ['pid int', 'time_point int']
+        if gender_column:
+            # Mostly the participant's registered gender, sometimes answered differently in a wave
+            answered = np.array([gender_of[p] for p in pid.tolist()], dtype=object)
+            changed = rng.random(len(pid)) < 0.05
+            answered[changed] = _genders(int(changed.sum()), rng)
+            names.append(gender_column)
+            arrays.append(answered)
+            definitions.append(f'{gender_column} nvarchar COLLATE NOCASE')
+        for column, sql_type, kind in columns:
+            if kind == 'age_child':
+                values = _ages(pid, time_point, 3, 15, rng)
+            elif kind == 'age_adult':
+                values = _ages(pid, time_point, 22, 55, rng)
+            else:
+                values = _values(kind, len(pid), rng)
+            names.append(column)
+            arrays.append(_with_nulls(values, rng.uniform(0.02, 0.3), rng))
+            definitions.append(f'{column} {sql_type}')
+
+        definitions.append(f'{MODIFIED_COLUMN} datetime2 DEFAULT ({NOW})')
+        db.execute(f"CREATE TABLE {table_name} ({', '.join(definitions)})")
+        _track_modifications(db, table_name)
+        _insert(db, table_name, names, arrays)
+        counts[table_name] = len(pid)
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic study data in a SQLite stand-in database')
+    parser.add_argument('path', help='SQLite database file to (re)create')
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument('--participants', type=int, help='Participants per cohort')
+    size.add_argument('--rows', type=int, default=10000, help='Approximate rows across all study tables')
+    parser.add_argument('--seed', type=int, default=2025)
+    parser.add_argument('--years', default=str(BASE_YEAR), help='Comma-separated study years (e.g. 2025,2026)')
+    args = parser.parse_args(argv)
+    participants = args.participants or participants_for_rows(args.rows)
+    years = [int(year) for year in args.years.split(',') if year.strip()]
+    for table_name, rows in generate(args.path, participants, args.seed, years).items():
+        print(f"{table_name}: {rows} rows")
+
+
+if __name__ == '__main__':
+    main()
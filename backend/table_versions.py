@@ -0,0 +1,136 @@
+import hashlib
+import json
+import threading
+import time
+
+# Row counts catch inserts/deletes, last_user_update catches in-place updates and modify_date
+# catches schema changes. dm_db_index_usage_stats needs VIEW SERVER STATE, so there is a
+# fallback query without it.
+VERSION_QUERY = """
+    SELECT
+        t.name,
+        t.modify_date,
+        (SELECT SUM(p.rows) FROM sys.partitions p
+         WHERE p.object_id = t.object_id AND p.index_id IN (0, 1)) as row_count,
+        (SELECT MAX(u.last_user_update) FROM sys.dm_db_index_usage_stats u
+         WHERE u.database_id = DB_ID() AND u.object_id = t.object_id) as last_update
+    FROM sys.tables t
+    WHERE t.name IN ({placeholders})
+"""
+
+FALLBACK_VERSION_QUERY = """
+    SELECT
+        t.name,
+        t.modify_date,
+        (SELECT SUM(p.rows) FROM sys.partitions p
+         WHERE p.object_id = t.object_id AND p.index_id IN (0, 1)) as row_count,
+        NULL as last_update
+    FROM sys.tables t
+    WHERE t.name IN ({placeholders})
+"""
+
+
+class TableVersionTracker:
+    """Detects data changes in the mapped study tables from cheap catalog metadata
+
+    poll() is triggered lazily from the request path at most every poll_interval
+    seconds and runs in a background thread, so requests never wait on it. Listeners
+    are called with the set of table names whose version token changed.
+    """
+
+    def __init__(self, get_connection, tables, poll_interval=30):
+        self._get_connection = get_connection
+        self.tables = sorted(set(tables))
+        self.poll_interval = poll_interval
+        self._listeners = []
+        self._versions = {}
+        self._polled_at = 0
+        self._use_fallback = False
+        self._lock = threading.Lock()
+        self._polling = False
+
+    def add_listener(self, callback):
+        """Register callback(changed_tables) to run when any tracked table changes"""
+        self._listeners.append(callback)
+
+    def _fetch(self, cursor):
+        placeholders = ','.join('?' for _ in self.tables)
+        if not self._use_fallback:
+            try:
+                cursor.execute(VERSION_QUERY.format(placeholders=placeholders), self.tables)
+                return cursor.fetchall()
+            except Exception as e:
+                print(f"Index usage stats unavailable, tracking row counts only: {e}")
+                self._use_fallback = True
+        cursor.execute(FALLBACK_VERSION_QUERY.format(placeholders=placeholders), self.tables)
+        return cursor.fetchall()
+
+    def poll(self):
+        """Fetch current version tokens and notify listeners about changed tables"""
+        conn = self._get_connection()
+        if not conn:
+            return set()
+        try:
+            cursor = conn.cursor()
+            try:
+                rows = self._fetch(cursor)
+            finally:
+                cursor.close()
+        except Exception as e:
+            print(f"Error polling table versions: {e}")
+            return set()
+        finally:
+            conn.close()
+
+        versions = {row[0]: (str(row[1]), row[2], str(row[3])) for row in rows}
+        with self._lock:
+            previous = self._versions
+            self._versions = versions
+            self._polled_at = time.monotonic()
+        if not previous:
+            return set()  # first poll establishes the baseline
+        changed = {name for name in set(previous) | set(versions) if previous.get(name) != versions.get(name)}
+        if changed:
+            for callback in self._listeners:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    print(f"Error in table change listener: {e}")
+        return changed
+
+    def check(self):
+        """Start a background poll if the last one is older than poll_interval"""
+        if time.monotonic() - self._polled_at < self.poll_interval:
+            return
+        with self._lock:
+            if self._polling:
+                return
+            self._polling = True
+
+        def run():
+            try:
+                self.poll()
+            finally:
+                self._polling = False
+
+        threading.Thread(target=run, name='table-version-poll', daemon=True).start()
+
+    def versions(self):
+        """Return the last seen version token per table"""
+        with self._lock:
+            return dict(self._versions)
+
+    def token(self, tables):
+        """Data version token of a set of tables (for on-disk snapshots), or None if unknown
+
+        Polls once synchronously if nothing has been seen yet. Table names are
+        matched case-insensitively, like the change listeners.
+        """
+        if not self._versions:
+            self.poll()
+        with self._lock:
+            versions = {name.lower(): version for name, version in self._versions.items()}
+        if not versions:
+            return None
+        key = [[name, versions.get(name.lower())] for name in sorted(tables, key=str.lower)]
+        return hashlib.sha1(json.dumps(key, default=str).encode()).hexdigest()[:16]
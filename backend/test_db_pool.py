@@ -0,0 +1,166 @@
+import threading
+import time
+
+from db_pool import ConnectionPool, PoolTimeout
+
+# Unit checks of the connection pool with fake DB-API connections: checkout limits,
+# liveness checks, idle eviction, per-borrower settings and warm-up.
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql, *params):
+        if not self._conn.alive:
+            raise RuntimeError('Communication link failure')
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+        self.timeout = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def unavailable():
+    raise RuntimeError('Server unavailable')
+
+
+def make_pool(**options):
+    """A pool of FakeConnections; returns (pool, opened connections)"""
+    opened = []
+
+    def connect():
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+
+    return ConnectionPool(connect, **options), opened
+
+
+def test_timeout_at_max_size():
+    """A checkout waits for a connection at max_size and raises PoolTimeout when none is returned in time"""
+    pool, opened = make_pool(min_size=0, max_size=2, checkout_timeout=0.2)
+    first, second = pool.acquire(), pool.acquire()
+    started = time.monotonic()
+    try:
+        pool.acquire()
+        raise AssertionError("A third connection was checked out of a pool of two")
+    except PoolTimeout:
+        pass
+    assert time.monotonic() - started >= 0.2, "The checkout did not wait for its timeout"
+    assert pool.stats()['timeouts'] == 1
+
+    # A waiting checkout gets the connection as soon as it is returned
+    threading.Timer(0.05, first.close).start()
+    third = pool.acquire()
+    assert third._conn is opened[0] and len(opened) == 2
+    second.close()
+    third.close()
+    stats = pool.stats()
+    assert (stats['size'], stats['in_use'], stats['idle']) == (2, 0, 2), stats
+    print("Checkouts wait at max_size and time out")
+
+
+def test_failed_ping_is_replaced():
+    """An idle connection that fails its ping is closed and replaced in the same slot"""
+    pool, opened = make_pool(min_size=0, max_size=1, ping_interval=0)
+    pool.acquire().close()
+    opened[0].alive = False
+    conn = pool.acquire()
+    assert conn._conn is opened[1], "The broken connection was handed out again"
+    assert opened[0].closed, "The broken connection was not closed"
+    conn.close()
+    stats = pool.stats()
+    assert (stats['reconnects'], stats['size']) == (1, 1), stats
+
+    # A link that fails its ping but cannot be reopened frees the slot
+    opened[1].alive = False
+    pool._connect = unavailable
+    try:
+        pool.acquire()
+        raise AssertionError("A broken connection was handed out")
+    except RuntimeError:
+        pass
+    stats = pool.stats()
+    assert (stats['size'], stats['in_use'], stats['connect_errors']) == (0, 0, 1), stats
+    print("Connections failing their ping are replaced")
+
+
+def test_idle_eviction_keeps_min_size():
+    """Connections idle past idle_timeout are closed down to min_size, most recently used kept"""
+    pool, opened = make_pool(min_size=1, max_size=3, idle_timeout=0.05)
+    borrowed = [pool.acquire() for _ in range(3)]
+    for conn in borrowed:
+        conn.close()
+    time.sleep(0.1)
+    conn = pool.acquire()
+    assert conn._conn is opened[2], "The most recently used connection was not kept"
+    assert opened[0].closed and opened[1].closed and not opened[2].closed
+    conn.close()
+    stats = pool.stats()
+    assert (stats['size'], stats['idle'], stats['evicted']) == (1, 1, 2), stats
+    print("Idle connections are evicted down to min_size")
+
+
+def test_overrides_reset_on_return():
+    """Settings a borrower changes (conn.timeout) are restored before the next borrower gets the connection"""
+    pool, opened = make_pool(min_size=0, max_size=1)
+    conn = pool.acquire()
+    conn.timeout = 30
+    assert opened[0].timeout == 30
+    conn.close()
+    assert opened[0].timeout == 0, "The borrower's timeout stayed on the connection"
+    try:
+        conn.cursor()
+        raise AssertionError("A returned connection was still usable")
+    except AttributeError:
+        pass
+    conn = pool.acquire()
+    assert conn._conn is opened[0] and conn.timeout == 0
+    conn.close()
+    print("Borrower settings are reset on return")
+
+
+def test_warm():
+    """warm() opens min_size connections; warm_in_background() logs a failure instead of raising"""
+    pool, opened = make_pool(min_size=2, max_size=4)
+    pool.warm()
+    stats = pool.stats()
+    assert (stats['size'], stats['idle'], stats['connects']) == (2, 2, 2), stats
+    pool.warm()
+    assert len(opened) == 2, "warm() opened more than min_size"
+
+    pool = ConnectionPool(unavailable, min_size=2)
+    pool.warm_in_background()
+    waited = time.monotonic() + 5
+    while pool.stats()['connect_errors'] == 0:
+        assert time.monotonic() < waited, "The background warm-up never tried to connect"
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert pool.stats()['size'] == 0, "A failed warm-up kept its slot"
+    print("warm() opens min_size connections")
+
+
+if __name__ == "__main__":
+    test_timeout_at_max_size()
+    test_failed_ping_is_replaced()
+    test_idle_eviction_keeps_min_size()
+    test_overrides_reset_on_return()
+    test_warm()
@@ -0,0 +1,380 @@
+import itertools
+import random
+import sqlite3
+
+from filter_spec import select_tables
+from query_compiler import compile_filter_query, compile_pid_query, compile_wave_query
+from wave_breakdown import wave_qualifying
+
+# Differential check of compile_filter_query against the per-table query that
+# build_filter_queries generated before the compiler existed. Both run against the
+# same in-memory SQLite database, so the comparison needs no SQL Server access.
+
+PARTICIPANTS_TABLE = 'participants_2025'
+
+MODALITY_CONFIG = {
+    'tables': [
+        {'name': 'children_data', 'type': 'children', 'gender_column': 'gender'},
+        {'name': 'parent_data', 'type': 'adults', 'gender_column': ''},
+        {'name': 'extra_children_data', 'type': 'children', 'gender_column': ''}
+    ]
+}
+
+KCAL = {'name': 'KCAL', 'type': 'number'}
+PROT = {'name': 'PROT', 'type': 'number'}
+NOTE = {'name': 'note', 'type': 'string'}
+VISIT = {'name': 'visit_date', 'type': 'datetime'}
+
+TIMEPOINTS = [[], ['all'], [1], [2, 3], [1, 2, 3, 4, 5, 6], [6, 1], [1, 1]]
+VARIABLES = [[], [KCAL], [KCAL, PROT]]
+THRESHOLDS = [
+    [],
+    [{'variable': KCAL, 'operator': '>', 'value': '1500'}],
+    [{'variable': PROT, 'operator': 'between', 'value': '20', 'value2': '80'}],
+    [{'variable': KCAL, 'operator': 'IS NULL'}],
+    [{'variable': PROT, 'operator': 'IS NOT NULL'}],
+    [{'variable': NOTE, 'operator': 'LIKE', 'value': 'b'}],
+    [{'variable': NOTE, 'operator': 'NOT LIKE', 'value': 'y'}],
+    [{'variable': NOTE, 'operator': '=', 'value': 'abc'}],
+    [{'variable': VISIT, 'operator': '>=', 'value': '2025-03-01'}],
+    [{'variable': KCAL, 'operator': '<=', 'value': 2500}, {'variable': PROT, 'operator': '!=', 'value': '50'}]
+]
+COHORTS = [[], ['children'], ['adults'], ['adult'], ['adults', 'children']]
+
+
+def build_database(participants=200, seed=7):
+    """Study tables with missing timepoints, duplicate rows, NULLs and messy genders"""
+    rng = random.Random(seed)
+    db = sqlite3.connect(':memory:')
+    genders = ['M', 'F', 'MALE', 'FEMALE', 'x', None]
+    db.execute(f"CREATE TABLE {PARTICIPANTS_TABLE} (pid INTEGER, gender TEXT)")
+    for pid in range(participants):
+        if rng.random() < 0.05:
+            continue  # Participants missing from the participants table count as 'Unknown'
+        db.execute(f"INSERT INTO {PARTICIPANTS_TABLE} VALUES (?, ?)", (pid, rng.choice(genders)))
+
+    for table_config in MODALITY_CONFIG['tables']:
+        db.execute(
+            f"CREATE TABLE {table_config['name']} "
+            "(pid INTEGER, time_point INTEGER, KCAL REAL, PROT REAL, note TEXT, visit_date TEXT, gender TEXT)"
+        )
+        for pid, time_point in itertools.product(range(participants), range(1, 7)):
+            if rng.random() < 0.15:
+                continue
+            for _ in range(2 if rng.random() < 0.03 else 1):
+                db.execute(
+                    f"INSERT INTO {table_config['name']} VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        pid,
+                        time_point,
+                        None if rng.random() < 0.1 else rng.uniform(500, 3500),
+                        None if rng.random() < 0.1 else rng.choice([50, rng.uniform(10, 100)]),
+                        rng.choice(['abc', 'xyz', None]),
+                        f"2025-{rng.randint(1, 6):02d}-{rng.randint(1, 28):02d}",
+                        rng.choice(genders)
+                    )
+                )
+    db.commit()
+    return db
+
+
+def legacy_table_query(table_config, logic_param):
+    """The single-table query build_filter_queries produced before the query compiler"""
+    timepoints = logic_param.get('timepoints') or []
+    if 'all' in timepoints:
+        timepoints = []
+    timepoint_params = [int(tp) for tp in timepoints] or [1, 2, 3, 4, 5, 6]
+    variables = logic_param.get('variables') or []
+    not_null = ' AND '.join(f"t.{var['name']} IS NOT NULL" for var in variables) or '1=1'
+
+    conditions = []
+    params = list(timepoint_params)
+    for threshold in logic_param.get('thresholds') or []:
+        variable, operator = threshold['variable'], threshold['operator']
+        value, value2 = threshold.get('value'), threshold.get('value2')
+        if operator not in ['IS NULL', 'IS NOT NULL'] and value is None:
+            continue
+        convert = float if variable['type'] == 'number' else (lambda v: v)
+        if operator == 'between' and value2:
+            conditions.append(f"t.{variable['name']} BETWEEN ? AND ?")
+            params.extend([convert(value), convert(value2)])
+        elif operator in ['LIKE', 'NOT LIKE']:
+            conditions.append(f"t.{variable['name']} {operator} ?")
+            params.append(f"%{value}%")
+        elif operator in ['IS NULL', 'IS NOT NULL']:
+            conditions.append(f"t.{variable['name']} {operator}")
+        else:
+            conditions.append(f"t.{variable['name']} {operator} ?")
+            params.append(convert(value))
+
+    query = f"""
+    WITH ParticipantGenders AS (
+        SELECT
+            v.pid,
+            COALESCE(p.gender, 'Unknown') as gender
+        FROM (
+            SELECT t.pid
+            FROM {table_config['name']} t
+            WHERE t.time_point IN ({','.join('?' for _ in timepoint_params)})
+            {''.join(f' AND {c}' for c in conditions)}
+            GROUP BY t.pid
+            HAVING COUNT(DISTINCT t.time_point) = {len(timepoint_params)}
+            AND COUNT(CASE WHEN {not_null} THEN 1 END) = {len(timepoint_params)}
+        ) v
+        LEFT JOIN {table_config['name']} t ON v.pid = t.pid
+        LEFT JOIN {PARTICIPANTS_TABLE} p ON v.pid = p.pid
+        GROUP BY v.pid, p.gender
+    )
+    SELECT
+        COUNT(DISTINCT pid) as count,
+        '{table_config['type']}' as source,
+        SUM(CASE WHEN gender IN ('M', 'MALE') OR LOWER(gender) = 'male' THEN 1 ELSE 0 END) as male_count,
+        SUM(CASE WHEN gender IN ('F', 'FEMALE') OR LOWER(gender) = 'female' THEN 1 ELSE 0 END) as female_count,
+        SUM(CASE
+            WHEN gender IS NULL THEN 0
+            WHEN gender NOT IN ('M', 'MALE', 'F', 'FEMALE')
+                AND LOWER(gender) NOT IN ('male', 'female')
+            THEN 1
+            ELSE 0
+        END) as other_count
+    FROM ParticipantGenders
+    """
+    return query, params
+
+
+def legacy_two_table_query(tables, logic_param):
+    """The combined query build_filter_queries produced before the query compiler when both cohorts were selected"""
+    timepoints = logic_param.get('timepoints') or []
+    if 'all' in timepoints:
+        timepoints = []
+    timepoint_params = [int(tp) for tp in timepoints] or [1, 2, 3, 4, 5, 6]
+
+    conditions = []
+    params = []
+    for threshold in logic_param.get('thresholds') or []:
+        variable, operator = threshold['variable'], threshold['operator']
+        value, value2 = threshold.get('value'), threshold.get('value2')
+        if operator not in ['IS NULL', 'IS NOT NULL'] and value is None:
+            continue
+        if operator == 'between' and value2:
+            conditions.append(f"t.{variable['name']} BETWEEN ? AND ?")
+        elif operator in ['IS NULL', 'IS NOT NULL']:
+            conditions.append(f"t.{variable['name']} {operator}")
+        else:
+            conditions.append(f"t.{variable['name']} {operator} ?")
+        if value:
+            if operator == 'between' and value2:
+                params.extend([float(value), float(value2)])
+            else:
+                params.append(float(value) if value.replace('.', '').isdigit() else value)
+
+    ctes = []
+    selects = []
+    for index, table_config in enumerate(tables[:2], start=1):
+        ctes.append(f"""
+        ParticipantGenders_{index} AS (
+            SELECT
+                v.pid,
+                COALESCE(p.gender, 'Unknown') as gender
+            FROM (
+                SELECT t.pid
+                FROM {table_config['name']} t
+                WHERE t.time_point IN ({','.join('?' for _ in timepoint_params)})
+                GROUP BY t.pid
+                HAVING COUNT(DISTINCT t.time_point) = {len(timepoint_params)}
+            ) v
+            LEFT JOIN {table_config['name']} t ON v.pid = t.pid
+            LEFT JOIN {PARTICIPANTS_TABLE} p ON v.pid = p.pid
+            WHERE 1=1 {''.join(f' AND {c}' for c in conditions)}
+            GROUP BY v.pid, p.gender
+        )""")
+        selects.append(f"""
+        SELECT
+            COUNT(DISTINCT pid) as count,
+            '{table_config['type']}' as source,
+            SUM(CASE WHEN gender IN ('M', 'MALE') OR LOWER(gender) = 'male' THEN 1 ELSE 0 END) as male_count,
+            SUM(CASE WHEN gender IN ('F', 'FEMALE') OR LOWER(gender) = 'female' THEN 1 ELSE 0 END) as female_count,
+            SUM(CASE
+                WHEN gender IS NULL THEN 0
+                WHEN gender NOT IN ('M', 'MALE', 'F', 'FEMALE')
+                    AND LOWER(gender) NOT IN ('male', 'female')
+                THEN 1
+                ELSE 0
+            END) as other_count
+        FROM ParticipantGenders_{index}""")
+    query = f"WITH {','.join(ctes)} {' UNION ALL '.join(selects)}"
+    return query, (timepoint_params + params) * 2
+
+
+def two_table_semantics_query(table_config, logic_param):
+    """What the two-table query counted, per table: the differences from compile_filter_query, spelled out
+
+    A participant qualified with a row at every requested timepoint (several rows at
+    one timepoint included) and at least one row, at any timepoint, that met all
+    thresholds. The selected-variable check was not applied and LIKE values were
+    matched without the surrounding wildcards.
+    """
+    timepoints = logic_param.get('timepoints') or []
+    if 'all' in timepoints:
+        timepoints = []
+    timepoint_params = [int(tp) for tp in timepoints] or [1, 2, 3, 4, 5, 6]
+    conditions = []
+    params = []
+    for threshold in logic_param.get('thresholds') or []:
+        variable, operator = threshold['variable'], threshold['operator']
+        value, value2 = threshold.get('value'), threshold.get('value2')
+        convert = float if variable['type'] == 'number' else (lambda v: v)
+        if operator == 'between':
+            conditions.append(f"t.{variable['name']} BETWEEN ? AND ?")
+            params.extend([convert(value), convert(value2)])
+        elif operator in ['IS NULL', 'IS NOT NULL']:
+            conditions.append(f"t.{variable['name']} {operator}")
+        else:
+            conditions.append(f"t.{variable['name']} {operator} ?")
+            params.append(convert(value))
+    any_row = f"""
+        INTERSECT
+        SELECT t.pid FROM {table_config['name']} t WHERE {' AND '.join(conditions)}""" if conditions else ''
+    query = f"""
+    WITH Qualified AS (
+        SELECT t.pid
+        FROM {table_config['name']} t
+        WHERE t.time_point IN ({','.join('?' for _ in timepoint_params)})
+        GROUP BY t.pid
+        HAVING COUNT(DISTINCT t.time_point) = {len(timepoint_params)}{any_row}
+    ),
+    ParticipantGenders AS (
+        SELECT q.pid, COALESCE(p.gender, 'Unknown') as gender
+        FROM Qualified q
+        LEFT JOIN {PARTICIPANTS_TABLE} p ON q.pid = p.pid
+    )
+    SELECT
+        COUNT(DISTINCT pid) as count,
+        '{table_config['type']}' as source,
+        SUM(CASE WHEN gender IN ('M', 'MALE') OR LOWER(gender) = 'male' THEN 1 ELSE 0 END) as male_count,
+        SUM(CASE WHEN gender IN ('F', 'FEMALE') OR LOWER(gender) = 'female' THEN 1 ELSE 0 END) as female_count,
+        SUM(CASE WHEN gender NOT IN ('M', 'MALE', 'F', 'FEMALE') AND LOWER(gender) NOT IN ('male', 'female')
+            THEN 1 ELSE 0 END) as other_count
+    FROM ParticipantGenders
+    """
+    return query, timepoint_params + params
+
+
+def _counts(row):
+    return tuple(value or 0 for value in (row[0], row[2], row[3], row[4]))
+
+
+def test_query_compiler():
+    """Compare compiled and legacy counts for every combination of filter settings"""
+    db = build_database()
+    cursor = db.cursor()
+    checked = 0
+    mismatches = []
+    for cohorts, timepoints, variables, thresholds in itertools.product(COHORTS, TIMEPOINTS, VARIABLES, THRESHOLDS):
+        logic_param = {'cohorts': cohorts, 'timepoints': timepoints, 'variables': variables, 'thresholds': thresholds}
+        tables = select_tables(MODALITY_CONFIG, cohorts)
+
+        query, params = compile_filter_query(tables, logic_param, PARTICIPANTS_TABLE)
+        compiled = {row[5]: (row[1], _counts(row)) for row in cursor.execute(query, params).fetchall()}
+
+        for index, table_config in enumerate(tables):
+            legacy_query, legacy_params = legacy_table_query(table_config, logic_param)
+            expected = _counts(cursor.execute(legacy_query, legacy_params).fetchone())
+            source, actual = compiled.get(index, (table_config['type'], (0, 0, 0, 0)))
+            checked += 1
+            if source != table_config['type'] or actual != expected:
+                mismatches.append((table_config['name'], logic_param, expected, actual))
+
+    print(f"Compared {checked} table results")
+    for table_name, logic_param, expected, actual in mismatches[:20]:
+        print(f"\nMismatch for {table_name}: {logic_param}")
+        print(f"  legacy:   {expected}")
+        print(f"  compiled: {actual}")
+    assert not mismatches, f"{len(mismatches)} compiled results differ from the legacy query"
+    print("All compiled results match the legacy query")
+
+
+def test_wave_breakdown():
+    """Compare the per-wave breakdown of one grouped scan with a pid query per wave and per prefix"""
+    db = build_database()
+    cursor = db.cursor()
+    checked = 0
+    mismatches = []
+    for timepoints, variables, thresholds in itertools.product(TIMEPOINTS, VARIABLES, THRESHOLDS):
+        waves = sorted({int(tp) for tp in timepoints if tp != 'all'}) or [1, 2, 3, 4, 5, 6]
+        logic_param = {'timepoints': waves, 'variables': variables, 'thresholds': thresholds}
+        for table_config in MODALITY_CONFIG['tables']:
+            query, params = compile_wave_query(table_config, logic_param)
+            rows = cursor.execute(query, params).fetchall()
+            pids, at_wave, through_wave = wave_qualifying(
+                [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], waves
+            )
+            for i, wave in enumerate(waves):
+                for name, qualifying, wave_set in (('wave', at_wave, [wave]), ('through', through_wave, waves[:i + 1])):
+                    query, params = compile_pid_query([table_config], {**logic_param, 'timepoints': wave_set})
+                    expected = sorted(row[1] for row in cursor.execute(query, params).fetchall())
+                    actual = sorted(pids[qualifying[:, i]].tolist())
+                    checked += 1
+                    if actual != expected:
+                        mismatches.append((table_config['name'], name, wave_set, logic_param))
+
+    print(f"Compared {checked} wave results")
+    for table_name, name, wave_set, logic_param in mismatches[:20]:
+        print(f"\nMismatch for {table_name} {name} {wave_set}: {logic_param}")
+    assert not mismatches, f"{len(mismatches)} wave breakdowns differ from the pid query"
+    print("All wave breakdowns match the pid query")
+
+
+def test_legacy_two_table_query():
+    """Pin what the pre-compiler two-table query returned when both cohorts were selected
+
+    The compiler gives both tables the per-table semantics instead (see the README).
+    This records the old outputs: they match two_table_semantics_query wherever the
+    old query ran, and it failed for threshold values sent as JSON numbers.
+    """
+    db = build_database()
+    cursor = db.cursor()
+    tables = MODALITY_CONFIG['tables'][:2]
+    checked = 0
+    differing = 0
+    mismatches = []
+    for timepoints, variables, thresholds in itertools.product(TIMEPOINTS, VARIABLES, THRESHOLDS):
+        logic_param = {'cohorts': [], 'timepoints': timepoints, 'variables': variables, 'thresholds': thresholds}
+        numeric_value = any(
+            not isinstance(t.get('value'), str) for t in thresholds if t['operator'] not in ('IS NULL', 'IS NOT NULL')
+        )
+        query, params = compile_filter_query(tables, logic_param, PARTICIPANTS_TABLE)
+        compiled = {row[5]: _counts(row) for row in cursor.execute(query, params).fetchall()}
+        try:
+            legacy_query, legacy_params = legacy_two_table_query(tables, logic_param)
+            legacy = [_counts(row) for row in cursor.execute(legacy_query, legacy_params).fetchall()]
+        except AttributeError:
+            checked += 1
+            if not numeric_value:
+                mismatches.append((logic_param, 'the two-table query failed', None))
+            continue
+        if numeric_value:
+            mismatches.append((logic_param, 'the two-table query ran with a JSON number value', legacy))
+            continue
+
+        for index, table_config in enumerate(tables):
+            expected = _counts(cursor.execute(*two_table_semantics_query(table_config, logic_param)).fetchone())
+            current = compiled.get(index, (0, 0, 0, 0))
+            checked += 1
+            differing += legacy[index] != current
+            if legacy[index] != expected:
+                mismatches.append((logic_param, expected, legacy[index]))
+
+    print(f"Compared {checked} two-table results ({differing} differ from the compiled query)")
+    for logic_param, expected, actual in mismatches[:20]:
+        print(f"\nMismatch for {logic_param}")
+        print(f"  expected:  {expected}")
+        print(f"  two-table: {actual}")
+    assert not mismatches, f"{len(mismatches)} two-table results differ from the documented semantics"
+    print("All two-table results match the documented differences")
+
+
+if __name__ == "__main__":
+    test_query_compiler()
+    test_wave_breakdown()
+    test_legacy_two_table_query()
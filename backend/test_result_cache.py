@@ -0,0 +1,130 @@
+import time
+
+import numpy as np
+
+from result_cache import ResultCache, filter_cache_key
+
+# Unit checks of the /query-data result cache: key canonicalization, TTL and size
+# bounds, per-table invalidation and the per-participant (stale/resolve) refresh.
+
+KCAL = {'name': 'KCAL', 'type': 'number'}
+PROT = {'name': 'PROT', 'type': 'number'}
+TABLES = ['asa24_children_totals_2025', 'participants_2025']
+
+
+def pids(*values):
+    return np.array(values, dtype=np.int64)
+
+
+def test_cache_keys():
+    """Requests that mean the same filter share a key; ones that count differently do not"""
+    same = [
+        [{'timepoints': [2, 1], 'cohorts': ['children', 'adult'], 'variables': [KCAL, PROT],
+          'thresholds': [{'variable': KCAL, 'operator': '>', 'value': '1500'},
+                         {'variable': PROT, 'operator': 'IS NULL', 'value': 'ignored'}]}],
+        [{'timepoints': ['1', '2'], 'cohorts': ['adults', 'children'], 'variables': [PROT, KCAL, KCAL],
+          'thresholds': [{'variable': PROT, 'operator': 'IS NULL'},
+                         {'variable': KCAL, 'operator': '>', 'value': 1500.0},
+                         {'variable': KCAL, 'operator': '<'}]}],
+    ]
+    assert filter_cache_key('Diet', same[0]) == filter_cache_key('Diet', same[1])
+    assert filter_cache_key('Diet', [{'timepoints': ['all']}]) == filter_cache_key('Diet', [{}]) == \
+        filter_cache_key('Diet', [{'timepoints': [1, 2, 3, 4, 5, 6]}])
+    # Only the first logic parameter is read
+    assert filter_cache_key('Diet', same[0]) == filter_cache_key('Diet', same[0] + [{'timepoints': [3]}])
+
+    different = [
+        [{'timepoints': [1, 1]}],  # COUNT(DISTINCT time_point) can never reach 2
+        [{'timepoints': [1]}],
+        [{'thresholds': [{'variable': KCAL, 'operator': '>', 'value': '1500'}]}],
+        [{'thresholds': [{'variable': KCAL, 'operator': '>=', 'value': '1500'}]}],
+        [{'thresholds': [{'variable': KCAL, 'operator': 'between', 'value': '1', 'value2': '2'}]}],
+        [{'thresholds': [{'variable': KCAL, 'operator': 'between', 'value': '1', 'value2': '3'}]}],
+        [{'thresholds': [{'variable': {'name': 'KCAL', 'type': 'string'}, 'operator': '=', 'value': '1500'}]}],
+    ]
+    keys = [filter_cache_key('Diet', lps) for lps in different]
+    assert len(set(keys)) == len(keys), "Different filters share a cache key"
+    assert filter_cache_key('Other', different[1]) != keys[1]
+    assert filter_cache_key('Diet', [], baseline=True) != filter_cache_key('Diet', [])
+    print("Equivalent filters share a cache key")
+
+
+def test_bounds():
+    """Entries expire after the TTL and the least recently used ones go first at max_entries / max_bytes"""
+    cache = ResultCache(max_entries=2, ttl=0.05)
+    cache.put('a', {'total': 1}, TABLES)
+    assert cache.get('a') == {'total': 1}
+    time.sleep(0.1)
+    assert cache.get('a') is None, "An expired entry was returned"
+    assert cache.stats()['expirations'] == 1
+
+    cache = ResultCache(max_entries=2)
+    cache.put('a', 1, TABLES)
+    cache.put('b', 2, TABLES)
+    cache.get('a')  # 'b' is now the least recently used
+    cache.put('c', 3, TABLES)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+    value = {'counts': 'x' * 100}
+    cache = ResultCache(max_bytes=300)
+    cache.put('a', value, TABLES)
+    cache.put('b', value, TABLES)
+    cache.put('c', value, TABLES)
+    stats = cache.stats()
+    assert stats['bytes'] <= 300 and stats['entries'] == 2 and stats['evictions'] == 1, stats
+    assert cache.get('a') is None and cache.get('c') == value
+    cache.put('huge', {'counts': 'x' * 400}, TABLES)
+    assert cache.get('huge') is None and cache.stats()['entries'] == 2, "An entry over max_bytes was stored"
+    print("Entries expire and are evicted within the bounds")
+
+
+def test_invalidation():
+    """A table change drops only the entries computed from that table, whatever its case"""
+    cache = ResultCache()
+    cache.put('diet', 1, TABLES)
+    cache.put('survey', 2, ['qualtrics_children_data_2025', 'participants_2025'])
+    assert cache.invalidate_tables(['ASA24_Children_Totals_2025']) == 1
+    assert cache.get('diet') is None and cache.get('survey') == 2
+    assert cache.invalidate_tables(['participants_2025']) == 1
+    assert cache.get('survey') is None and cache.stats()['entries'] == 0
+    print("Table changes drop only the entries that depend on them")
+
+
+def test_delta_refresh():
+    """Changes narrowed down to pids hold entries back for stale()/resolve(); other changes drop them"""
+    cache = ResultCache()
+    members = {'ASA24_Children_Totals_2025': pids(1, 2, 3)}
+    cache.put('delta', {'total': 3}, TABLES, members)
+    cache.put('plain', {'total': 3}, TABLES)
+    assert cache.stale('delta') is None, "An unchanged entry was reported stale"
+
+    assert cache.apply_changes({'asa24_children_totals_2025': pids(2, 4)}) == 1
+    assert cache.get('plain') is None, "An entry without members survived a change"
+    assert cache.get('delta') is None, "An entry waiting for a refresh was returned"
+    value, held, pending = cache.stale('delta')
+    assert value == {'total': 3} and list(held) == ['asa24_children_totals_2025']
+    assert pending['asa24_children_totals_2025'].tolist() == [2, 4]
+
+    # Changes that arrive while the refresh runs stay pending after it is stored
+    cache.apply_changes({'asa24_children_totals_2025': pids(5)})
+    cache.resolve('delta', {'total': 3}, {'asa24_children_totals_2025': pids(1, 3, 4)}, pending)
+    assert cache.get('delta') is None
+    _, held, pending = cache.stale('delta')
+    assert held['asa24_children_totals_2025'].tolist() == [1, 3, 4]
+    assert pending['asa24_children_totals_2025'].tolist() == [2, 4, 5]
+    cache.resolve('delta', {'total': 2}, {'asa24_children_totals_2025': pids(1, 3)}, pending)
+    assert cache.get('delta') == {'total': 2} and cache.stale('delta') is None
+    assert cache.stats()['delta_refreshes'] == 2
+
+    # A change that is not narrowed down to pids (None), or one to a table without members, drops the entry
+    for change in ({'asa24_children_totals_2025': None}, {'participants_2025': pids(1)}):
+        cache.put('delta', {'total': 2}, TABLES, {'asa24_children_totals_2025': pids(1, 3)})
+        assert cache.apply_changes(change) == 1 and cache.stale('delta') is None and cache.get('delta') is None
+    print("Changed participants are re-checked through stale() and resolve()")
+
+
+if __name__ == "__main__":
+    test_cache_keys()
+    test_bounds()
+    test_invalidation()
+    test_delta_refresh()
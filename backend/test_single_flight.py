@@ -0,0 +1,120 @@
+import threading
+import time
+
+from admission_control import DeadlineExceeded
+from single_flight import SingleFlight
+
+# Threaded checks of query coalescing: identical concurrent calls share the leader's
+# execution and its outcome, exceptions included.
+
+CALLERS = 5
+
+
+class BlockingTask:
+    """A fake query that blocks until released, then returns its result or raises its error"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5), "The task was never released"
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def call(flights, key, task):
+    """Run task under key the way _run_coalesced does: the leader executes, everyone else waits"""
+    flight, leader = flights.begin(key)
+    if leader:
+        try:
+            outcome = task()
+        except Exception as e:
+            outcome = e
+        flights.finish(flight, outcome)
+    else:
+        assert flight.wait(5), "A waiter was never woken"
+    return flight.outcome
+
+
+def run_concurrently(flights, key, task):
+    """Start CALLERS identical calls while the first one blocks; returns every caller's outcome"""
+    outcomes = [None] * CALLERS
+
+    def caller(i):
+        outcomes[i] = call(flights, key, task)
+
+    threads = [threading.Thread(target=caller, args=(0,))]
+    threads[0].start()
+    assert task.started.wait(5), "The leader never started the task"
+    for i in range(1, CALLERS):
+        threads.append(threading.Thread(target=caller, args=(i,)))
+        threads[i].start()
+    waited = time.monotonic() + 5
+    while flights.stats()['waiting'] < CALLERS - 1:
+        assert time.monotonic() < waited, f"Only {flights.stats()['waiting']} callers joined the flight"
+        time.sleep(0.01)
+    task.release.set()
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive(), "A caller is still blocked"
+    return outcomes
+
+
+def test_shared_execution():
+    """Identical calls overlapping the leader's run get its result without running the task again"""
+    flights = SingleFlight()
+    result = {'counts': {'total': 3}}
+    task = BlockingTask(result=result)
+    outcomes = run_concurrently(flights, 'Diet', task)
+    assert task.calls == 1, f"The task ran {task.calls} times"
+    assert all(outcome is result for outcome in outcomes), "A caller got a different result"
+    stats = flights.stats()
+    assert (stats['executions'], stats['coalesced'], stats['in_flight'], stats['waiting']) == (1, CALLERS - 1, 0, 0)
+
+    # Nothing is kept once the leader finishes: the next call runs again
+    task = BlockingTask(result={'counts': {'total': 4}})
+    task.release.set()
+    assert call(flights, 'Diet', task) == {'counts': {'total': 4}} and task.calls == 1
+    assert flights.stats()['executions'] == 2
+    print("Identical concurrent calls share one execution")
+
+
+def test_different_keys():
+    """Calls with different keys do not wait on each other"""
+    flights = SingleFlight()
+    blocked = BlockingTask(result='diet')
+    thread = threading.Thread(target=call, args=(flights, 'Diet', blocked))
+    thread.start()
+    assert blocked.started.wait(5)
+    other = BlockingTask(result='survey')
+    other.release.set()
+    assert call(flights, 'Survey', other) == 'survey' and other.calls == 1
+    blocked.release.set()
+    thread.join(5)
+    assert flights.stats()['coalesced'] == 0
+    print("Different keys run separately")
+
+
+def test_shared_errors():
+    """An error or DeadlineExceeded raised by the leader's task is the outcome of every waiter"""
+    for error in (RuntimeError('Communication link failure'), DeadlineExceeded('Request deadline of 1s exceeded')):
+        flights = SingleFlight()
+        task = BlockingTask(error=error)
+        outcomes = run_concurrently(flights, 'Diet', task)
+        assert task.calls == 1, f"The task ran {task.calls} times"
+        assert all(outcome is error for outcome in outcomes), f"A caller did not get the {type(error).__name__}"
+        assert flights.stats()['in_flight'] == 0, "A failed flight was kept"
+    print("Errors reach every waiter")
+
+
+if __name__ == "__main__":
+    test_shared_execution()
+    test_different_keys()
+    test_shared_errors()
@@ -0,0 +1,699 @@
+import atexit
+import gzip
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import standin_db
+import synthetic_data
+from admission_control import AdmissionController, Overloaded
+from columnar_engine import ColumnarEngine
+from filter_spec import select_tables
+from query_compiler import compile_filter_query, compile_pid_query, compile_sweep_query
+from threshold_sweep import SWEEP_OPERATORS, sweep_qualifying
+from timepoint_index import TimepointIndex
+
+# Differential checks of the in-memory answer paths against the SQL they stand in
+# for. Synthetic study data is written to a SQLite file and read through the
+# standin_db connection, the same way the app runs with DB_STANDIN_PATH, so the
+# comparison needs no SQL Server access.
+
+PARTICIPANTS_TABLE = synthetic_data.PARTICIPANTS_TABLE
+
+MODALITY_MAPPING = {
+    'Diet_Data_Totals': {
+        'tables': [
+            {'name': 'asa24_children_totals_2025', 'type': 'children', 'gender_column': ''},
+            {'name': 'asa24_parents_totals_2025', 'type': 'adults', 'gender_column': ''}
+        ]
+    },
+    'Qualtrics_Data': {
+        'tables': [
+            {'name': 'qualtrics_children_data_2025', 'type': 'children', 'gender_column': 'gender'},
+            {'name': 'qualtrics_parent_data_2025', 'type': 'adults', 'gender_column': 'gender_v2'}
+        ]
+    },
+    'Demographic_Data': {
+        'tables': [
+            {'name': 'child_demographics_2025', 'type': 'children', 'gender_column': 'gender'},
+            {'name': 'parent_demographics_2025', 'type': 'adults', 'gender_column': 'gender_v2'}
+        ]
+    }
+}
+
+
+def _number(name):
+    return {'name': name, 'type': 'number'}
+
+
+def _string(name):
+    return {'name': name, 'type': 'string'}
+
+
+VARIABLES = {
+    'Diet_Data_Totals': [[], [_number('KCAL')], [_number('KCAL'), _number('VD')]],
+    'Qualtrics_Data': [[], [_number('Q1')]],
+    'Demographic_Data': [[], [_number('age')]]
+}
+THRESHOLDS = {
+    'Diet_Data_Totals': [
+        [],
+        [{'variable': _number('KCAL'), 'operator': '>', 'value': '1500'}],
+        [{'variable': _number('PROT'), 'operator': 'between', 'value': '1000', 'value2': '2500'}],
+        [{'variable': _number('SODI'), 'operator': 'IS NULL'}],
+        [{'variable': _number('KCAL'), 'operator': '<=', 'value': 2500},
+         {'variable': _number('CAFF'), 'operator': 'IS NOT NULL'}]
+    ],
+    'Qualtrics_Data': [
+        [],
+        [{'variable': _number('Q1'), 'operator': '>=', 'value': '3'}],
+        [{'variable': _number('Q2'), 'operator': '!=', 'value': '5'}],
+        [{'variable': _string('comments'), 'operator': 'LIKE', 'value': 'busy'}],
+        [{'variable': _string('comments'), 'operator': '=', 'value': 'fine'}]
+    ],
+    'Demographic_Data': [
+        [],
+        [{'variable': _number('age'), 'operator': 'between', 'value': '5', 'value2': '12'}],
+        [{'variable': _string('race'), 'operator': 'NOT LIKE', 'value': 'White'}]
+    ]
+}
+TIMEPOINTS = [[], [1], [2, 3], [6, 1], [1, 2, 3, 4, 5, 6], [1, 1]]
+COHORTS = [[], ['children'], ['adults']]
+DATABASE_FILE = 'study.db'
+_app = {}
+
+
+def build_database(participants=150, seed=11):
+    """Synthetic study tables in a temporary SQLite file; returns (directory, connect)"""
+    directory = tempfile.mkdtemp(prefix='standin-test-')
+    path = os.path.join(directory, DATABASE_FILE)
+    synthetic_data.generate(path, participants, seed)
+    # SQL Server ignores trailing blanks when comparing strings and SQLite does not; the in-memory paths
+    # follow SQL Server, so the gender strings are trimmed for the SQL they are compared with (for the same
+    # reason, string thresholds above use the stored case)
+    db = sqlite3.connect(path)
+    for table_name, gender_column in [(PARTICIPANTS_TABLE, 'gender')] + [
+        (t['name'], t['gender_column']) for m in MODALITY_MAPPING.values() for t in m['tables'] if t['gender_column']
+    ]:
+        db.execute(f"UPDATE {table_name} SET {gender_column} = RTRIM({gender_column})")
+    db.commit()
+    db.close()
+    return directory, lambda: standin_db.connect(path)
+
+
+def load_app():
+    """The app module running on its own stand-in database; returns (app module, connect)
+
+    The app reads DB_STANDIN_PATH when it is imported, so every test that goes through
+    the routes shares this one database.
+    """
+    if not _app:
+        directory, connect = build_database()
+        atexit.register(shutil.rmtree, directory, True)
+        os.environ['DB_STANDIN_PATH'] = os.path.join(directory, DATABASE_FILE)
+        import app
+        assert app.MODALITY_MAPPING == MODALITY_MAPPING, "The test mapping no longer matches the app's"
+        _app.update(module=app, connect=connect)
+    return _app['module'], _app['connect']
+
+
+def empty_counts():
+    return {
+        'total': 0,
+        'children': 0,
+        'adults': 0,
+        'gender': {
+            'children': {'M': 0, 'F': 0, 'O': 0},
+            'adults': {'M': 0, 'F': 0, 'O': 0}
+        }
+    }
+
+
+def sql_counts(connect, modality, logic_parameters):
+    """The /query-data counts of the compiled SQL, the answer every in-memory path must reproduce"""
+    logic_param = logic_parameters[0] if logic_parameters else {}
+    tables = select_tables(MODALITY_MAPPING[modality], logic_param.get('cohorts') or [])
+    query, params = compile_filter_query(tables, logic_param, PARTICIPANTS_TABLE)
+    conn = connect()
+    try:
+        rows = conn.cursor().execute(query, params).fetchall()
+    finally:
+        conn.close()
+    counts = empty_counts()
+    for count, source, male_count, female_count, other_count, _ in rows:
+        counts[source] = count or 0
+        counts['total'] += count or 0
+        counts['gender'][source] = {'M': male_count or 0, 'F': female_count or 0, 'O': other_count or 0}
+    return counts
+
+
+def baseline_sql_counts(connect, modality):
+    """The default counts of the SQL path: participants with all six timepoints, NULL genders in no group"""
+    counts = empty_counts()
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        for table_config in MODALITY_MAPPING[modality]['tables']:
+            gender_column = table_config['gender_column']
+            gender = f"MIN(t.{gender_column})" if gender_column else 'MIN(p.gender)'
+            cursor.execute(f"""
+                WITH TimePointCounts AS (
+                    SELECT t.pid, {gender} as gender
+                    FROM {table_config['name']} t
+                    LEFT JOIN {PARTICIPANTS_TABLE} p ON t.pid = p.pid
+                    WHERE t.time_point IN (1,2,3,4,5,6)
+                    GROUP BY t.pid
+                    HAVING COUNT(DISTINCT t.time_point) = 6
+                )
+                SELECT
+                    COUNT(pid),
+                    SUM(CASE WHEN gender IN ('M', 'MALE') OR LOWER(gender) = 'male' THEN 1 ELSE 0 END),
+                    SUM(CASE WHEN gender IN ('F', 'FEMALE') OR LOWER(gender) = 'female' THEN 1 ELSE 0 END),
+                    SUM(CASE
+                        WHEN gender IS NULL THEN 0
+                        WHEN gender NOT IN ('M', 'MALE', 'F', 'FEMALE') AND LOWER(gender) NOT IN ('male', 'female')
+                        THEN 1
+                        ELSE 0
+                    END)
+                FROM TimePointCounts
+            """)
+            count, male_count, female_count, other_count = cursor.fetchone()
+            table_type = table_config['type']
+            counts[table_type] = count
+            counts['total'] += count
+            counts['gender'][table_type] = {'M': male_count or 0, 'F': female_count or 0, 'O': other_count or 0}
+    finally:
+        conn.close()
+    return counts
+
+
+def filter_cases():
+    """(modality, logicParameters) for every combination of the settings above"""
+    for modality in MODALITY_MAPPING:
+        for timepoints, cohorts, variables, thresholds in itertools.product(
+            TIMEPOINTS, COHORTS, VARIABLES[modality], THRESHOLDS[modality]
+        ):
+            yield modality, [
+                {'timepoints': timepoints, 'cohorts': cohorts, 'variables': variables, 'thresholds': thresholds}
+            ]
+
+
+def sql_pids(cursor, table_config, logic_param):
+    """Sorted qualifying pids of one table under the compiled SQL"""
+    query, params = compile_pid_query([table_config], logic_param)
+    cursor.execute(query, params)
+    return sorted(row[1] for row in cursor.fetchall())
+
+
+def _report(name, checked, mismatches):
+    print(f"Compared {checked} {name} results")
+    for modality, logic_parameters, expected, actual in mismatches[:20]:
+        print(f"\nMismatch for {modality}: {logic_parameters}")
+        print(f"  sql:      {expected}")
+        print(f"  {name}: {actual}")
+    assert not mismatches, f"{len(mismatches)} {name} results differ from the SQL counts"
+
+
+def test_columnar_engine():
+    """Compare the columnar engine with the compiled SQL, before and after a data change"""
+    directory, connect = build_database()
+    try:
+        engine = ColumnarEngine(connect, MODALITY_MAPPING, PARTICIPANTS_TABLE)
+        assert engine.refresh()
+        checked = 0
+        mismatches = []
+        for modality, logic_parameters in filter_cases():
+            result = engine.answer(modality, logic_parameters)
+            if result is None:
+                continue
+            expected = sql_counts(connect, modality, logic_parameters)
+            checked += 1
+            if result['counts'] != expected:
+                mismatches.append((modality, logic_parameters, expected, result['counts']))
+        assert checked, "The columnar engine answered no filter"
+        _report('columnar', checked, mismatches)
+
+        # After a change the snapshot is not used until it has been reloaded
+        logic_parameters = [{'thresholds': THRESHOLDS['Diet_Data_Totals'][1]}]
+        conn = connect()
+        conn.cursor().execute("UPDATE asa24_children_totals_2025 SET KCAL = 3000 WHERE time_point = 1")
+        conn.commit()
+        conn.close()
+        engine.invalidate(['asa24_children_totals_2025'])
+        assert engine.answer('Diet_Data_Totals', logic_parameters) is None, "A changed snapshot was used"
+        assert engine.refresh()
+        result = engine.answer('Diet_Data_Totals', logic_parameters)
+        assert result['counts'] == sql_counts(connect, 'Diet_Data_Totals', logic_parameters)
+
+        engine.max_age = 0
+        assert engine.answer('Diet_Data_Totals', logic_parameters) is None, "An expired snapshot was used"
+        print("All columnar results match the SQL counts")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_timepoint_index():
+    """Compare the timepoint index with the compiled SQL and the default counts query"""
+    directory, connect = build_database()
+    try:
+        index = TimepointIndex(connect, MODALITY_MAPPING, PARTICIPANTS_TABLE)
+        assert index.refresh()
+        checked = 0
+        mismatches = []
+        for modality in MODALITY_MAPPING:
+            result = index.answer(modality, [], baseline=True)
+            expected = baseline_sql_counts(connect, modality)
+            checked += 1
+            if result['counts'] != expected:
+                mismatches.append((modality, [], expected, result['counts']))
+        for modality, logic_parameters in filter_cases():
+            result = index.answer(modality, logic_parameters)
+            if result is None:
+                continue
+            expected = sql_counts(connect, modality, logic_parameters)
+            checked += 1
+            if result['counts'] != expected:
+                mismatches.append((modality, logic_parameters, expected, result['counts']))
+        _report('timepoint index', checked, mismatches)
+
+        # Rows of a participant added after the build are not counted against another one (the first
+        # participant, whose waves with one non-null PROT row the filter asks for)
+        conn = connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT time_point FROM asa24_children_totals_2025 "
+            "WHERE pid = (SELECT MIN(pid) FROM asa24_children_totals_2025) AND PROT IS NOT NULL "
+            "GROUP BY time_point HAVING COUNT(*) = 1"
+        )
+        timepoints = [row[0] for row in cursor.fetchall()]
+        logic_parameters = [{'timepoints': timepoints, 'cohorts': ['children'], 'variables': [_number('PROT')]}]
+        expected = sql_counts(connect, 'Diet_Data_Totals', logic_parameters)
+        for time_point in timepoints:
+            cursor.execute(
+                "INSERT INTO asa24_children_totals_2025 (pid, time_point, PROT) VALUES (?, ?, 1)", [10 ** 6, time_point]
+            )
+        conn.commit()
+        conn.close()
+        assert index.answer('Diet_Data_Totals', logic_parameters)['counts'] == expected
+
+        # Once the change is known, SQL answers until the index is rebuilt
+        index.invalidate(['asa24_children_totals_2025'])
+        assert index.answer('Diet_Data_Totals', logic_parameters) is None, "A stale index was used"
+        assert index.refresh()
+        result = index.answer('Diet_Data_Totals', logic_parameters)
+        assert result['counts'] == sql_counts(connect, 'Diet_Data_Totals', logic_parameters)
+        print("All timepoint index results match the SQL counts")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+SWEEPS = {'Diet_Data_Totals': ('KCAL', [1200, 1800.5, 2500]), 'Qualtrics_Data': ('Q3', [2, 4, 1]),
+          'Demographic_Data': ('age', [8, 30, 12.5])}
+
+
+def test_threshold_sweep():
+    """Compare every cutoff of a sweep with the compiled SQL for the filter plus that threshold"""
+    directory, connect = build_database()
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        checked = 0
+        mismatches = []
+        for modality, (name, cutoffs) in SWEEPS.items():
+            for timepoints, variables, thresholds, operator in itertools.product(
+                TIMEPOINTS, VARIABLES[modality], THRESHOLDS[modality][:2], SWEEP_OPERATORS
+            ):
+                logic_param = {'timepoints': timepoints, 'variables': variables, 'thresholds': thresholds}
+                spec_timepoints = sorted(int(tp) for tp in timepoints) or list(synthetic_data.TIMEPOINTS)
+                for table_config in MODALITY_MAPPING[modality]['tables']:
+                    query, params = compile_sweep_query(table_config, logic_param, [name])
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+                    pids, qualifying = sweep_qualifying(
+                        [row[0] for row in rows],
+                        np.array([row[1] for row in rows], dtype=np.int64),
+                        np.array([row[2] for row in rows], dtype=np.int8),
+                        [np.array([np.nan if row[3] is None else float(row[3]) for row in rows], dtype=np.float64)],
+                        [(cutoffs, operator)],
+                        spec_timepoints
+                    )
+                    for i, cutoff in enumerate(cutoffs):
+                        threshold = {'variable': _number(name), 'operator': operator, 'value': cutoff}
+                        swept = {**logic_param, 'thresholds': thresholds + [threshold]}
+                        expected = sql_pids(cursor, table_config, swept)
+                        actual = sorted(pids[qualifying[:, i]].tolist())
+                        checked += 1
+                        if actual != expected:
+                            mismatches.append((table_config['name'], [logic_param, threshold], expected, actual))
+        _report('sweep', checked, mismatches)
+
+        # Duplicate timepoints never qualify (COUNT(DISTINCT time_point) cannot reach 2 for [1, 1])
+        pids, qualifying = sweep_qualifying(
+            [1, 1], np.array([1, 1]), np.array([1, 1], dtype=np.int8), [np.array([5.0, 5.0])], [([1.0], '>')], [1, 1]
+        )
+        assert not qualifying.any(), "A participant qualified for duplicate timepoints"
+        print("All sweep results match the SQL pids")
+    finally:
+        conn.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_baseline_counts():
+    """Compare the materialized default counts, with genders from the dimension and from SQL, with the SQL counts"""
+    app, connect = load_app()
+    client = app.app.test_client()
+    checked = 0
+    mismatches = []
+    enabled = app.PARTICIPANTS_DIMENSION_ENABLED
+    try:
+        for use_dimension in (True, False):
+            app.PARTICIPANTS_DIMENSION_ENABLED = use_dimension
+            if use_dimension:
+                assert app.participants_dimension.refresh(full=True)
+            assert app.baseline_counts.refresh()
+            for modality in MODALITY_MAPPING:
+                response = client.post('/query-data', json={'filters': [{'modality': modality}]})
+                result = response.get_json()['results'][modality]
+                assert 'refreshed_at' in result, "The default counts were not served from the materialized counts"
+                expected = baseline_sql_counts(connect, modality)
+                checked += 1
+                if result['counts'] != expected:
+                    mismatches.append((modality, [], expected, result['counts']))
+    finally:
+        app.PARTICIPANTS_DIMENSION_ENABLED = enabled
+    _report('baseline', checked, mismatches)
+    print("All default counts match the SQL counts")
+
+
+def _complete_timepoints(cursor, table_name, columns, limit=5):
+    """Add the missing wave of up to `limit` participants with five of the six, so they join the default counts"""
+    cursor.execute(
+        f"SELECT pid, SUM(time_point) FROM {table_name} GROUP BY pid "
+        f"HAVING COUNT(DISTINCT time_point) = 5 AND COUNT(*) = 5 ORDER BY pid"
+    )
+    missing = cursor.fetchall()[:limit]
+    copied = ', '.join(f"MIN({column})" for column in columns)
+    for pid, present in missing:
+        cursor.execute(
+            f"INSERT INTO {table_name} (pid, time_point, {', '.join(columns)}) "
+            f"SELECT pid, ?, {copied} FROM {table_name} WHERE pid = ? GROUP BY pid",
+            [sum(synthetic_data.TIMEPOINTS) - present, pid]
+        )
+    return len(missing)
+
+
+def test_delta_updates():
+    """Compare the results patched for changed participants (cache, index, default counts) with the SQL counts"""
+    app, connect = load_app()
+    client = app.app.test_client()
+    assert app.timepoint_index.refresh()
+    assert app.participants_dimension.refresh(full=True)
+    assert app.baseline_counts.refresh()
+    # Filters that ask for nothing are default counts, compared with their own SQL below
+    cases = [(m, lps) for m, lps in filter_cases() if not app._is_baseline_request(lps)]
+    for modality, logic_parameters in cases:
+        client.post('/query-data', json={'filters': [{'modality': modality, 'logicParameters': logic_parameters}]})
+    app.change_tracker.poll()  # The watermarks the change below is measured from
+
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT pid FROM asa24_children_totals_2025 ORDER BY pid")
+        pids = [row[0] for row in cursor.fetchall()][:10]
+        marks = ','.join('?' for _ in pids)
+        cursor.execute(
+            f"UPDATE asa24_children_totals_2025 SET KCAL = 3000, PROT = NULL WHERE time_point = 2 AND pid IN ({marks})",
+            pids
+        )
+        cursor.execute("SELECT DISTINCT pid FROM qualtrics_parent_data_2025 ORDER BY pid")
+        pids = [row[0] for row in cursor.fetchall()][:10]
+        marks = ','.join('?' for _ in pids)
+        cursor.execute(
+            f"UPDATE qualtrics_parent_data_2025 SET gender_v2 = 'female', Q1 = 5 WHERE pid IN ({marks})", pids
+        )
+        completed = _complete_timepoints(cursor, 'asa24_parents_totals_2025', ['KCAL'])
+        completed += _complete_timepoints(cursor, 'child_demographics_2025', ['gender', 'age'])
+        conn.commit()
+    finally:
+        conn.close()
+    assert completed, "No participant was added to the default counts"
+
+    patched = app.timepoint_index.stats()['patches']
+    delta_refreshes = app.baseline_counts.stats()['delta_refreshes']
+    changes = app.change_tracker.poll()
+    assert set(changes) == {
+        'asa24_children_totals_2025', 'qualtrics_parent_data_2025', 'asa24_parents_totals_2025',
+        'child_demographics_2025'
+    }, f"Unexpected changes: {sorted(changes)}"
+    assert all(pids is not None for pids in changes.values()), "A change was not narrowed down to participants"
+    assert app.timepoint_index.stats()['patches'] > patched, "The timepoint index was not patched"
+    waited = time.monotonic() + 30
+    while app.baseline_counts.stats()['delta_refreshes'] == delta_refreshes:
+        assert time.monotonic() < waited, "The default counts were not patched"
+        time.sleep(0.05)
+
+    checked = 0
+    mismatches = []
+    refreshed = app.result_cache.stats()['delta_refreshes']
+    for modality, logic_parameters in cases:
+        response = client.post(
+            '/query-data', json={'filters': [{'modality': modality, 'logicParameters': logic_parameters}]}
+        )
+        result = response.get_json()['results'][modality]
+        expected = sql_counts(connect, modality, logic_parameters)
+        checked += 1
+        if result['counts'] != expected:
+            mismatches.append((modality, logic_parameters, expected, result['counts']))
+    assert app.result_cache.stats()['delta_refreshes'] > refreshed, "No cached result was refreshed per participant"
+    for modality in MODALITY_MAPPING:
+        result = client.post('/query-data', json={'filters': [{'modality': modality}]}).get_json()['results'][modality]
+        assert 'refreshed_at' in result, "The default counts were not served from the materialized counts"
+        expected = baseline_sql_counts(connect, modality)
+        checked += 1
+        if result['counts'] != expected:
+            mismatches.append((modality, [], expected, result['counts']))
+    _report('delta', checked, mismatches)
+    print("All results patched after a change match the SQL counts")
+
+
+def test_query_waves():
+    """Compare /query-waves with /query-data's SQL at each wave and prefix, and with per-wave pids by attendance"""
+    app, connect = load_app()
+    client = app.app.test_client()
+    assert app.participants_dimension.refresh(full=True)
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        checked = 0
+        mismatches = []
+        for modality, logic_parameters in filter_cases():
+            response = client.post(
+                '/query-waves', json={'modality': modality, 'logicParameters': logic_parameters, 'bypassCache': True}
+            )
+            result = response.get_json()
+            assert response.status_code == 200, result
+            logic_param = logic_parameters[0]
+            waves = result['timepoints']
+            for i, wave in enumerate(waves):
+                for name, wave_set in (('waves', [wave]), ('through', waves[:i + 1])):
+                    spec = [{**logic_param, 'timepoints': wave_set}]
+                    expected = sql_counts(connect, modality, spec)
+                    checked += 1
+                    if result[name][i]['counts'] != expected:
+                        mismatches.append((modality, spec, expected, result[name][i]['counts']))
+
+            expected = {k: empty_counts() for k in range(1, len(waves) + 1)}
+            for table_config in select_tables(MODALITY_MAPPING[modality], logic_param['cohorts']):
+                attended = {}
+                for wave in waves:
+                    for pid in sql_pids(cursor, table_config, {**logic_param, 'timepoints': [wave]}):
+                        attended[pid] = attended.get(pid, 0) + 1
+                for k in attended.values():
+                    expected[k][table_config['type']] += 1
+                    expected[k]['total'] += 1
+            for k, counts in expected.items():
+                actual = result['attendance'][k - 1]['counts']
+                checked += 1
+                if {key: actual[key] for key in ('total', 'children', 'adults')} != {
+                    key: counts[key] for key in ('total', 'children', 'adults')
+                }:
+                    mismatches.append((modality, [logic_param, f"{k} waves"], counts, actual))
+    finally:
+        conn.close()
+    _report('wave', checked, mismatches)
+    print("All wave results match the SQL counts")
+
+
+def test_malformed_filters():
+    """Filters the query compiler rejects are answered 400 by /query-data and /export-data, not 500"""
+    app, _ = load_app()
+    client = app.app.test_client()
+    between = [{'thresholds': [{'variable': _number('KCAL'), 'operator': 'between', 'value': '1000'}]}]
+    for logic_parameters in (between, [{'timepoints': ['first']}]):
+        filters = [{'modality': 'Diet_Data_Totals', 'logicParameters': logic_parameters}]
+        for route, body in (
+            ('/query-data', {'filters': filters}),
+            ('/query-data', {'filters': filters, 'combine': 'AND'}),
+            ('/export-data', filters[0])
+        ):
+            response = client.post(route, json=body)
+            assert response.status_code == 400, (route, logic_parameters, response.get_json())
+    print("Malformed filters are rejected with 400")
+
+
+def test_http_caching():
+    """ETag revalidation, gzip negotiation and the debug-only query text of the HTTP responses"""
+    app, _ = load_app()
+    client = app.app.test_client()
+    route = '/get-variables/Diet_Data_Totals/children'
+    response = client.get(route)
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag.startswith('W/'), response.headers
+    assert 'private' in response.headers['Cache-Control']
+    identity = response.get_data()
+    assert len(identity) >= app.COMPRESS_MIN_BYTES, "The variable list is too small to be compressed"
+
+    response = client.get(route, headers={'If-None-Match': etag})
+    assert response.status_code == 304 and not response.get_data(), response.status_code
+    assert response.headers['ETag'] == etag
+
+    # Compression changes the bytes but not the (weak) ETag, so either encoding revalidates the other
+    response = client.get(route, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers.get('Content-Encoding') == 'gzip', response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == identity
+    assert response.headers['ETag'] == etag
+    response = client.get(route, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # Responses under COMPRESS_MIN_BYTES are sent as they are
+    response = client.get('/get-modalities', headers={'Accept-Encoding': 'gzip'})
+    assert len(response.get_data()) < app.COMPRESS_MIN_BYTES
+    assert 'Content-Encoding' not in response.headers and 'Accept-Encoding' in response.headers['Vary']
+    json.loads(response.get_data())
+
+    # The generated SQL is only returned with "debug", whether or not the result came from the cache
+    filters = [{'modality': 'Diet_Data_Totals', 'logicParameters': [{'thresholds': THRESHOLDS['Diet_Data_Totals'][1]}]}]
+    for body in ({'bypassCache': True}, {}, {}):
+        result = client.post('/query-data', json={'filters': filters, **body}).get_json()['results']['Diet_Data_Totals']
+        assert 'query' not in result, "The query text was sent without debug"
+        result = client.post('/query-data', json={'filters': filters, 'debug': True, **body}).get_json()
+        assert 'query' in result['results']['Diet_Data_Totals'], "The query text is missing with debug"
+    print("HTTP caching and compression behave as documented")
+
+
+def test_admission_control():
+    """Requests beyond the running and queued limits get 503 with Retry-After"""
+    app, _ = load_app()
+    client = app.app.test_client()
+    filters = [{'modality': 'Diet_Data_Totals', 'logicParameters': [{'thresholds': THRESHOLDS['Diet_Data_Totals'][1]}]}]
+    admission, max_queue = app.admission, app.admission.max_queue
+    rejected = admission.stats()['rejected']
+    for _ in range(admission.max_concurrent):
+        admission.acquire()
+    admission.max_queue = 0
+    try:
+        response = client.post('/query-data', json={'filters': filters})
+    finally:
+        admission.max_queue = max_queue
+        for _ in range(admission.max_concurrent):
+            admission.release()
+    assert response.status_code == 503, response.get_json()
+    assert response.headers['Retry-After'] == str(app.REQUEST_LIMITS['RETRY_AFTER'])
+    assert admission.stats()['rejected'] == rejected + 1
+    assert client.post('/query-data', json={'filters': filters}).status_code == 200
+    assert admission.stats()['running'] == 0, "A request kept its admission slot"
+
+    # A queued request that gets no slot within the queue timeout is shed as well
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.1, retry_after=7)
+    controller.acquire()
+    try:
+        controller.acquire()
+        raise AssertionError("A request was admitted past max_concurrent")
+    except Overloaded as e:
+        assert e.retry_after == 7
+    controller.release()
+    controller.acquire()
+    stats = controller.stats()
+    assert (stats['running'], stats['timed_out'], stats['admitted']) == (1, 1, 2), stats
+    print("Requests over the admission limits get 503")
+
+
+SLOW_STATEMENT = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+
+def test_request_deadline():
+    """A statement still running at the request deadline is cancelled on the database and the request gets 504"""
+    app, _ = load_app()
+    client = app.app.test_client()
+    filters = [{'modality': 'Diet_Data_Totals', 'logicParameters': [{'thresholds': THRESHOLDS['Diet_Data_Totals'][2]}]}]
+    cancelled = []
+
+    def slow_filter_counts(cursor, modality, logic_parameters):
+        try:
+            cursor.execute(SLOW_STATEMENT)  # Runs until it is interrupted
+            return cursor.fetchall()
+        except Exception as e:
+            cancelled.append(e)
+            raise
+
+    filter_counts, app._filter_counts = app._filter_counts, slow_filter_counts
+    expired = app.deadline_watchdog.stats()['expired']
+    started = time.monotonic()
+    try:
+        response = client.post('/query-data', json={'filters': filters, 'bypassCache': True, 'timeout': 0.3})
+    finally:
+        app._filter_counts = filter_counts
+    # The per-query timeout is rounded up to whole seconds, so an answer before one second is the watchdog's
+    assert time.monotonic() - started < 1, "The statement was not cancelled at the deadline"
+    assert response.status_code == 504, response.get_json()
+    assert cancelled and 'HY008' in str(cancelled[0]), f"The statement was not cancelled: {cancelled}"
+    assert app.deadline_watchdog.stats()['expired'] == expired + 1
+    assert app.admission.stats()['running'] == 0, "A cancelled request kept its admission slot"
+    print("Statements running at the deadline are cancelled with 504")
+
+
+def test_export_admission():
+    """An export holds its admission slot until its stream is closed; exports beyond the limit get 503"""
+    app, _ = load_app()
+    client = app.app.test_client()
+    body = {'modality': 'Diet_Data_Totals', 'logicParameters': [{'timepoints': [1]}]}
+    exports, queue_timeout = app.export_admission, app.export_admission.queue_timeout
+    exports.queue_timeout = 0
+    streams = []
+    try:
+        for _ in range(exports.max_concurrent):
+            streams.append(client.post('/export-data', json=body, buffered=False))
+        assert exports.stats()['running'] == exports.max_concurrent, "A streaming export released its slot early"
+        response = client.post('/export-data', json=body)
+        assert response.status_code == 503 and response.headers['Retry-After'], response.status_code
+    finally:
+        exports.queue_timeout = queue_timeout
+        for stream in streams:
+            stream.close()
+    assert exports.stats()['running'] == 0, "A closed export kept its slot"
+    response = client.post('/export-data', json=body)
+    assert response.status_code == 200 and response.get_data(), response.status_code
+    response.close()  # What the WSGI server does once the body is sent
+    assert exports.stats()['running'] == 0
+    print("Exports hold their admission slot until the stream closes")
+
+
+if __name__ == "__main__":
+    test_columnar_engine()
+    test_timepoint_index()
+    test_threshold_sweep()
+    test_baseline_counts()
+    test_delta_updates()
+    test_query_waves()
+    test_malformed_filters()
+    test_http_caching()
+    test_admission_control()
+    test_request_deadline()
+    test_export_admission()
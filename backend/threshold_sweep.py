@@ -0,0 +1,77 @@
+import numpy as np
+
+from timepoint_index import pid_array
+
+# Operators whose matching rows grow or shrink monotonically with the cutoff, so every
+# row passes a prefix of the cutoffs once they are ordered from loosest to tightest
+SWEEP_OPERATORS = ('>', '>=', '<', '<=')
+
+
+def cutoff_order(cutoffs, operator):
+    """Positions of the cutoffs ordered from loosest to tightest"""
+    order = np.argsort(cutoffs, kind='stable')
+    return order if operator in ('>', '>=') else order[::-1]
+
+
+def passed_cutoffs(values, cutoffs, operator):
+    """For each value, how many cutoffs (in cutoff_order) it passes; NULLs pass none"""
+    ascending = np.sort(cutoffs)
+    if operator == '>':
+        passed = np.searchsorted(ascending, values, side='left')
+    elif operator == '>=':
+        passed = np.searchsorted(ascending, values, side='right')
+    elif operator == '<':
+        passed = len(cutoffs) - np.searchsorted(ascending, values, side='right')
+    elif operator == '<=':
+        passed = len(cutoffs) - np.searchsorted(ascending, values, side='left')
+    else:
+        raise ValueError(f"Operator {operator} cannot be swept; use one of {', '.join(SWEEP_OPERATORS)}")
+    passed[np.isnan(values)] = 0
+    return passed
+
+
+def _rows_above(pid_index, passed, shape):
+    """rows[p, j1, j2, ...] = number of rows of pid p passing cutoff cell (j1, j2, ...)"""
+    counts = np.zeros((shape[0],) + tuple(k + 1 for k in shape[1:]), dtype=np.int32)
+    np.add.at(counts, (pid_index,) + tuple(passed), 1)
+    for axis in range(1, counts.ndim):
+        counts = np.flip(np.cumsum(np.flip(counts, axis), axis=axis), axis)
+    return counts[(slice(None),) + tuple(slice(1, None) for _ in shape[1:])]
+
+
+def sweep_qualifying(pids, time_points, counted, values, dimensions, timepoints):
+    """Which participants qualify for every cutoff cell of a sweep
+
+    pids/time_points/counted are the rows of the sweep query, values one float array
+    per swept variable and dimensions the matching (cutoffs, operator) pairs. A pid
+    qualifies for a cell when its rows passing that cell's cutoffs cover every
+    requested timepoint and exactly len(timepoints) of them are counted, which is
+    the HAVING clause of the count query. Returns (unique pids, bool array shaped
+    (pids, len(cutoffs_1)[, len(cutoffs_2)])) with cells in request order.
+    """
+    unique, pid_index = np.unique(pid_array(pids), return_inverse=True)
+    shape = (len(unique),) + tuple(len(cutoffs) for cutoffs, _ in dimensions)
+    passed = [
+        passed_cutoffs(column, np.asarray(cutoffs, dtype=np.float64), operator)
+        for column, (cutoffs, operator) in zip(values, dimensions)
+    ]
+
+    present = np.zeros(shape, dtype=np.uint8)
+    for tp in sorted(set(timepoints)):
+        rows = time_points == tp
+        present += _rows_above(pid_index[rows], [p[rows] for p in passed], shape) > 0
+    rows = counted.astype(bool)
+    counted_rows = _rows_above(pid_index[rows], [p[rows] for p in passed], shape)
+    qualifying = (present == len(set(timepoints))) & (counted_rows == len(timepoints))
+    if len(set(timepoints)) != len(timepoints):
+        qualifying[:] = False  # COUNT(DISTINCT time_point) can never reach a count that includes duplicates
+
+    # Back from loosest-to-tightest order to the order the cutoffs were given in
+    for axis, (cutoffs, operator) in enumerate(dimensions, start=1):
+        order = cutoff_order(np.asarray(cutoffs, dtype=np.float64), operator)
+        index = [slice(None)] * qualifying.ndim
+        index[axis] = order
+        restored = np.empty_like(qualifying)
+        restored[tuple(index)] = qualifying
+        qualifying = restored
+    return unique, qualifying
@@ -0,0 +1,542 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from filter_spec import ALL_TIMEPOINTS, canonical_filter_spec, select_tables
+
+FULL_MASK = 0b111111  # time_point 1..6 -> bits 0..5
+
+# Gender codes; the SQL path compares gender case-insensitively and ignores trailing blanks
+GENDER_NULL = 0
+GENDER_M = 1
+GENDER_F = 2
+GENDER_O = 3
+
+FETCH_BATCH_SIZE = 50000
+PID_CHUNK_SIZE = 1000  # pids per IN (...) list; SQL Server allows at most 2100 parameters per statement
+MAX_NOTNULL_SETS = 32  # cached variable-set row counts per table
+SNAPSHOT_NAME = 'timepoint-index'
+
+
+def gender_code(value):
+    """Classify a raw gender value the same way the count queries' CASE expressions do"""
+    if value is None:
+        return GENDER_NULL
+    value = str(value).rstrip().upper()
+    if value in ('M', 'MALE'):
+        return GENDER_M
+    if value in ('F', 'FEMALE'):
+        return GENDER_F
+    return GENDER_O
+
+
+def timepoint_mask(timepoints):
+    mask = 0
+    for tp in timepoints:
+        mask |= 1 << (tp - 1)
+    return mask
+
+
+def quote_identifier(name):
+    return '[' + str(name).replace(']', ']]') + ']'
+
+
+def fetch_rows(cursor, batch_size=FETCH_BATCH_SIZE):
+    """Yield rows from an executed cursor in fetchmany batches"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def pid_chunks(pids, size=PID_CHUNK_SIZE):
+    """Split pids into lists of Python values for IN (...) parameters"""
+    pids = np.asarray(pids).tolist()
+    return [pids[start:start + size] for start in range(0, len(pids), size)]
+
+
+def pid_array(values):
+    """Build a NumPy pid array (int64 for numeric ids, fixed-width str otherwise)"""
+    arr = np.asarray(values)
+    if arr.dtype == object:
+        arr = arr.astype(str)
+    return arr
+
+
+def lookup(sorted_keys, values, keys, default):
+    """Vectorized dict lookup: values[i] where sorted_keys[i] == key, else default"""
+    result = np.full(len(keys), default, dtype=values.dtype)
+    if len(sorted_keys) == 0 or len(keys) == 0:
+        return result
+    pos = np.searchsorted(sorted_keys, keys)
+    pos[pos >= len(sorted_keys)] = 0
+    found = sorted_keys[pos] == keys
+    result[found] = values[pos[found]]
+    return result
+
+
+def load_participant_genders(cursor, participants_table):
+    """Return (sorted pids, gender codes) from the participants table"""
+    cursor.execute(f"SELECT pid, gender FROM {participants_table}")
+    rows = list(fetch_rows(cursor))
+    pids, first = np.unique(pid_array([row[0] for row in rows]), return_index=True)
+    codes = np.array([gender_code(row[1]) for row in rows], dtype=np.int8)
+    return pids, codes[first]
+
+
+def slot_counts(pid_index, timepoints, size):
+    """Rows per (pid, time_point 1..6) as a (size x 6) uint8 matrix"""
+    counts = np.bincount(pid_index * 8 + timepoints, minlength=size * 8).reshape(-1, 8)[:, 1:7]
+    return np.minimum(counts, 255).astype(np.uint8)
+
+
+def min_gender_codes(pid_index, genders, size):
+    """Gender code of MIN(gender) per pid (NULLs ignored), using case-insensitive ordering"""
+    codes = np.zeros(size, dtype=np.int8)
+    keep = [i for i, g in enumerate(genders) if g is not None]
+    if not keep:
+        return codes
+    idx = pid_index[keep]
+    folded = np.array([str(genders[i]).rstrip().upper() for i in keep])
+    order = np.lexsort((folded, idx))
+    first_idx, first_pos = np.unique(idx[order], return_index=True)
+    codes[first_idx] = [gender_code(v) for v in folded[order][first_pos]]
+    return codes
+
+
+class TableTimepoints:
+    """Timepoint presence for one table: sorted pids and per-pid 6-bit masks
+
+    present has bit k-1 set when the pid has a row at time_point k. row_counts holds
+    the number of rows per pid and timepoint, which the SQL path's
+    COUNT(CASE WHEN <variables not null> ...) = N check depends on when a
+    participant has duplicate rows at a timepoint.
+    """
+
+    def __init__(self, table_config, pids, present, row_counts, table_gender, participant_gender):
+        self.table_config = table_config
+        self.pids = pids
+        self.present = present
+        self.row_counts = row_counts  # (pids x 6) uint8, saturating at 255
+        self.table_gender = table_gender  # MIN(gender column) per pid, as the baseline query reads it
+        self.participant_gender = participant_gender  # participants table gender per pid
+        self.notnull = OrderedDict()  # variable names -> row_counts restricted to rows with all of them non-null
+        self.built_at = time.time()
+
+    def nbytes(self):
+        return int(
+            self.pids.nbytes + self.present.nbytes + self.row_counts.nbytes +
+            self.table_gender.nbytes + self.participant_gender.nbytes +
+            sum(mask.nbytes for mask in self.notnull.values())
+        )
+
+
+class TimepointIndex:
+    """In-memory pid -> timepoint bitmap index for every table in MODALITY_MAPPING
+
+    Answers timepoint/cohort/variable-presence questions (no thresholds) with
+    vectorized bit operations instead of the GROUP BY pid HAVING COUNT(DISTINCT
+    time_point) scan. Rebuilt in the background every max_age seconds or when
+    invalidate() is called for a mapped table. With a SnapshotStore the arrays are
+    published to disk and memory-mapped, so worker processes share one copy and only
+    one of them rebuilds it.
+    """
+
+    def __init__(self, get_connection, modality_mapping, participants_table, max_age=3600, store=None):
+        self._get_connection = get_connection
+        self._mapping = modality_mapping
+        self.participants_table = participants_table
+        self.max_age = max_age
+        self._store = store
+        self._snapshot_version = None
+        self._tables = {}
+        self._updated_at = {}  # table -> time its entry was last built or patched
+        self._participants = None
+        self._built_at = None
+        self._build_seconds = 0
+        self._stale = True
+        self._generation = 0  # bumped by invalidate() so a rebuild that raced a change stays stale
+        self._building = False
+        self._lock = threading.Lock()
+        self._counters = {
+            'answered': 0, 'fallbacks': 0, 'builds': 0, 'snapshot_loads': 0, 'patches': 0, 'build_errors': 0
+        }
+
+    def _table_configs(self):
+        return [t for config in self._mapping.values() for t in config['tables']]
+
+    def _table_query(self, table_config, pid_count=0):
+        gender_col = table_config['gender_column']
+        select_gender = f", {gender_col}" if gender_col else ''
+        only_pids = f" AND pid IN ({','.join('?' for _ in range(pid_count))})" if pid_count else ''
+        return (
+            f"SELECT pid, time_point{select_gender} FROM {table_config['name']} "
+            f"WHERE time_point IN (1,2,3,4,5,6){only_pids}"
+        )
+
+    def _build_table(self, cursor, table_config, participants):
+        cursor.execute(self._table_query(table_config))
+        return self._entry_from_rows(table_config, list(fetch_rows(cursor)), participants)
+
+    def _entry_from_rows(self, table_config, rows, participants):
+        gender_col = table_config['gender_column']
+        pids, pid_index = np.unique(pid_array([row[0] for row in rows]), return_inverse=True)
+        timepoints = np.array([row[1] for row in rows], dtype=np.int64)
+
+        present = np.zeros(len(pids), dtype=np.uint8)
+        np.bitwise_or.at(present, pid_index, (1 << (timepoints - 1)).astype(np.uint8))
+        row_counts = slot_counts(pid_index, timepoints, len(pids))
+
+        participant_gender = lookup(participants[0], participants[1], pids, GENDER_NULL)
+        if gender_col:
+            table_gender = min_gender_codes(pid_index, [row[2] for row in rows], len(pids))
+        else:
+            table_gender = participant_gender
+        return TableTimepoints(table_config, pids, present, row_counts, table_gender, participant_gender)
+
+    def _build(self):
+        """Read every mapped table; returns ({table: TableTimepoints}, participants)"""
+        conn = self._get_connection()
+        if not conn:
+            raise ConnectionError('Database connection failed')
+        try:
+            cursor = conn.cursor()
+            try:
+                participants = load_participant_genders(cursor, self.participants_table)
+                tables = {t['name']: self._build_table(cursor, t, participants) for t in self._table_configs()}
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+        return tables, participants
+
+    def _to_arrays(self, tables, participants):
+        arrays = {'participants.pids': participants[0], 'participants.codes': participants[1]}
+        for name, entry in tables.items():
+            arrays.update({
+                f'{name}.pids': entry.pids,
+                f'{name}.present': entry.present,
+                f'{name}.row_counts': entry.row_counts,
+                f'{name}.participant_gender': entry.participant_gender
+            })
+            if entry.table_config['gender_column']:
+                arrays[f'{name}.table_gender'] = entry.table_gender
+        return arrays, {}
+
+    def _from_arrays(self, arrays):
+        tables = {}
+        for table_config in self._table_configs():
+            name = table_config['name']
+            participant_gender = arrays[f'{name}.participant_gender']
+            tables[name] = TableTimepoints(
+                table_config, arrays[f'{name}.pids'], arrays[f'{name}.present'], arrays[f'{name}.row_counts'],
+                arrays.get(f'{name}.table_gender', participant_gender), participant_gender
+            )
+        return tables, (arrays['participants.pids'], arrays['participants.codes'])
+
+    def refresh(self, rebuild=False):
+        """Rebuild the index for every mapped table; returns False if the database was unreachable
+
+        With a snapshot store, a current snapshot (published by any worker) is mapped
+        instead of reading the tables unless rebuild=True, and a rebuilt index is
+        published. Returns False as well while another worker is building it.
+        """
+        started = time.monotonic()
+        generation = self._generation
+        built_at = time.time()
+        version = None
+        built = True
+        try:
+            if self._store is None:
+                tables, participants = self._build()
+            else:
+                snapshot, built = self._store.get_or_build(
+                    SNAPSHOT_NAME,
+                    [t['name'] for t in self._table_configs()] + [self.participants_table],
+                    lambda: self._to_arrays(*self._build()),
+                    max_age=self.max_age,
+                    rebuild=rebuild
+                )
+                if snapshot is None:
+                    return False
+                tables, participants = self._from_arrays(snapshot.arrays)
+                built_at, version = snapshot.created_at, snapshot.version
+        except ConnectionError:
+            return False
+        except Exception as e:
+            print(f"Error building timepoint index: {e}")
+            self._counters['build_errors'] += 1
+            return False
+        with self._lock:
+            self._tables = tables
+            self._participants = participants
+            self._built_at = built_at
+            self._updated_at = {name: built_at for name in tables}
+            self._snapshot_version = version
+            self._build_seconds = time.monotonic() - started
+            self._stale = generation != self._generation
+            self._counters['builds' if built else 'snapshot_loads'] += 1
+        return True
+
+    def invalidate(self, tables=None):
+        """Mark the index stale so the next request triggers a background rebuild"""
+        self._generation += 1
+        self._stale = True
+
+    def apply_changes(self, changes):
+        """ChangeTracker listener: re-read only the affected participants' rows of each changed table
+
+        Changes that are not narrowed down to pids, and participants table changes
+        (which touch every table's genders), fall back to a full rebuild.
+        """
+        configs = {t['name'].lower(): t for t in self._table_configs()}
+        participants_changed = self.participants_table.lower() in {t.lower() for t in changes}
+        changes = {t: pids for t, pids in changes.items() if t.lower() in configs}  # other tables do not matter
+        if not changes and not participants_changed:
+            return
+        if not self._tables or participants_changed or any(pids is None for pids in changes.values()):
+            self.invalidate()
+            return
+        try:
+            for table, pids in changes.items():
+                if len(pids):
+                    self._patch(configs[table.lower()], pids)
+        except Exception as e:
+            print(f"Error patching timepoint index: {e}")
+            self.invalidate()
+            return
+        if self._store is not None:
+            self._publish_patched()
+
+    def _patch(self, table_config, pids):
+        """Replace the entries of pids in one table's index with their current rows"""
+        name = table_config['name']
+        entry = self._tables.get(name)
+        if entry is None:
+            return
+        conn = self._get_connection()
+        if not conn:
+            raise ConnectionError('Database connection failed')
+        rows = []
+        try:
+            cursor = conn.cursor()
+            try:
+                for chunk in pid_chunks(pids):
+                    cursor.execute(self._table_query(table_config, len(chunk)), chunk)
+                    rows.extend(fetch_rows(cursor))
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+
+        fresh = self._entry_from_rows(table_config, rows, self._participants)
+        keep = ~np.isin(entry.pids, pid_array(pids))
+        fresh_pids = fresh.pids if len(fresh.pids) else fresh.pids.astype(entry.pids.dtype)
+        merged = np.concatenate([entry.pids[keep], fresh_pids])
+        order = np.argsort(merged, kind='stable')
+
+        def combine(old, new):
+            return np.concatenate([old[keep], new.astype(old.dtype)])[order]
+
+        patched = TableTimepoints(
+            table_config, merged[order], combine(entry.present, fresh.present),
+            combine(entry.row_counts, fresh.row_counts), combine(entry.table_gender, fresh.table_gender),
+            combine(entry.participant_gender, fresh.participant_gender)
+        )
+        with self._lock:
+            self._tables = {**self._tables, name: patched}
+            self._updated_at[name] = time.time()
+            self._generation += 1  # a rebuild that read the table before this change stays stale
+            self._counters['patches'] += 1
+
+    def _publish_patched(self):
+        """Publish the patched index so other workers map it instead of patching their own copies"""
+        release = self._store.claim(SNAPSHOT_NAME)
+        if release is None:
+            return
+        try:
+            tables, participants = self._tables, self._participants
+            snapshot = self._store.publish(
+                SNAPSHOT_NAME, *self._to_arrays(tables, participants),
+                tables=[t['name'] for t in self._table_configs()] + [self.participants_table]
+            )
+        finally:
+            release()
+        if snapshot is None:
+            return
+        mapped, participants = self._from_arrays(snapshot.arrays)
+        with self._lock:
+            if self._tables is tables:
+                self._tables = mapped
+                self._participants = participants
+                self._snapshot_version = snapshot.version
+
+    def updated_at(self):
+        """Time each table's entry was last built or patched"""
+        with self._lock:
+            return dict(self._updated_at)
+
+    def check(self):
+        """Start a background rebuild if the index is missing, stale or older than max_age"""
+        if not self._stale and self._built_at and time.time() - self._built_at < self.max_age:
+            return
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._building = False
+
+        threading.Thread(target=run, name='timepoint-index-build', daemon=True).start()
+
+    def _notnull_counts(self, entry, variables):
+        key = tuple(sorted(set(variables)))
+        with self._lock:
+            counts = entry.notnull.get(key)
+            if counts is not None:
+                entry.notnull.move_to_end(key)
+                return counts
+        conn = self._get_connection()
+        if not conn:
+            return None
+        try:
+            cursor = conn.cursor()
+            try:
+                conditions = ' AND '.join(f"{quote_identifier(v)} IS NOT NULL" for v in key)
+                cursor.execute(
+                    f"SELECT pid, time_point FROM {entry.table_config['name']} "
+                    f"WHERE time_point IN (1,2,3,4,5,6) AND {conditions}"
+                )
+                rows = list(fetch_rows(cursor))
+            finally:
+                cursor.close()
+        except Exception as e:
+            print(f"Error loading not-null counts for {entry.table_config['name']}: {e}")
+            return None
+        finally:
+            conn.close()
+        pos = np.zeros(0, dtype=np.int64)
+        tps = np.zeros(0, dtype=np.int64)
+        if rows and len(entry.pids):
+            pids = pid_array([row[0] for row in rows])
+            pos = np.searchsorted(entry.pids, pids)
+            pos[pos >= len(entry.pids)] = 0
+            # Rows of participants the index does not hold (added since it was built) are left out
+            found = entry.pids[pos] == pids
+            pos = pos[found]
+            tps = np.array([row[1] for row in rows], dtype=np.int64)[found]
+        counts = slot_counts(pos, tps, len(entry.pids))
+        with self._lock:
+            entry.notnull[key] = counts
+            while len(entry.notnull) > MAX_NOTNULL_SETS:
+                entry.notnull.popitem(last=False)
+        return counts
+
+    def _baseline(self, modality):
+        counts = {
+            'total': 0,
+            'children': 0,
+            'adults': 0,
+            'gender': {
+                'children': {'M': 0, 'F': 0},
+                'adults': {'M': 0, 'F': 0}
+            }
+        }
+        for table_config in self._mapping[modality]['tables']:
+            entry = self._tables.get(table_config['name'])
+            if entry is None:
+                return None
+            genders = np.bincount(entry.table_gender[entry.present == FULL_MASK], minlength=4)
+            table_type = table_config['type']
+            count = int(genders.sum())
+            counts[table_type] = count
+            counts['total'] += count
+            counts['gender'][table_type]['M'] = int(genders[GENDER_M])
+            counts['gender'][table_type]['F'] = int(genders[GENDER_F])
+            counts['gender'][table_type]['O'] = int(genders[GENDER_O])
+        return {'counts': counts}
+
+    def _filtered(self, modality, logic_parameters):
+        spec = canonical_filter_spec(modality, logic_parameters)
+        if spec['thresholds'] or any(tp not in ALL_TIMEPOINTS for tp in spec['timepoints']):
+            return None
+        tables = select_tables(self._mapping[modality], spec['cohorts'])
+
+        required = timepoint_mask(spec['timepoints'])
+        duplicated = len(set(spec['timepoints'])) != len(spec['timepoints'])
+        counts = {
+            'total': 0,
+            'children': 0,
+            'adults': 0,
+            'gender': {
+                'children': {'M': 0, 'F': 0, 'O': 0},
+                'adults': {'M': 0, 'F': 0, 'O': 0}
+            }
+        }
+        for table_config in tables:
+            entry = self._tables.get(table_config['name'])
+            if entry is None:
+                return None
+            qualifying = (entry.present & required) == required
+            if duplicated:
+                qualifying[:] = False
+            # HAVING COUNT(rows with all variables non-null) = N as well
+            row_counts = entry.row_counts
+            if spec['variables']:
+                row_counts = self._notnull_counts(entry, spec['variables'])
+                if row_counts is None:
+                    return None
+            columns = [tp - 1 for tp in sorted(set(spec['timepoints']))]
+            qualifying &= row_counts[:, columns].sum(axis=1) == len(spec['timepoints'])
+            genders = np.bincount(entry.participant_gender[qualifying], minlength=4)
+            table_type = table_config['type']
+            count = int(genders.sum())
+            counts[table_type] = count
+            counts['total'] += count
+            counts['gender'][table_type]['M'] = int(genders[GENDER_M])
+            counts['gender'][table_type]['F'] = int(genders[GENDER_F])
+            # Missing participants are COALESCEd to 'Unknown', which counts as other
+            counts['gender'][table_type]['O'] = int(genders[GENDER_O] + genders[GENDER_NULL])
+        return {'counts': counts}
+
+    def answer(self, modality, logic_parameters, baseline=False):
+        """Answer a request from the index, or return None when it has to go to SQL"""
+        result = None
+        # A stale index predates a change that has not been patched in; SQL answers until it is rebuilt
+        if self._tables and not self._stale and modality in self._mapping:
+            if baseline:
+                result = self._baseline(modality)
+            else:
+                result = self._filtered(modality, logic_parameters)
+        if result is None:
+            self._counters['fallbacks'] += 1
+            return None
+        self._counters['answered'] += 1
+        result['engine'] = 'timepoint-index'
+        return result
+
+    def stats(self):
+        """Memory footprint per table and freshness of the index"""
+        tables = {
+            name: {'participants': int(len(entry.pids)), 'bytes': entry.nbytes(), 'notnull_sets': len(entry.notnull)}
+            for name, entry in self._tables.items()
+        }
+        participants = self._participants
+        participants_bytes = int(participants[0].nbytes + participants[1].nbytes) if participants else 0
+        return {
+            'built_at': self._built_at,
+            'build_seconds': round(self._build_seconds, 3),
+            'snapshot_version': self._snapshot_version,
+            'stale': self._stale,
+            'tables': tables,
+            'participants_bytes': participants_bytes,
+            'total_bytes': participants_bytes + sum(t['bytes'] for t in tables.values()),
+            **self._counters
+        }
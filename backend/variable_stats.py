@@ -0,0 +1,268 @@
+import threading
+import time
+
+import numpy as np
+
+from timepoint_index import quote_identifier
+
+HISTOGRAM_BUCKETS = 32
+SKETCH_SIZE = 256  # k of the k-minimum-values distinct-count sketch
+
+
+def _hash64(values):
+    """splitmix64 of the float64 bit patterns (-0.0 folded into 0.0)"""
+    with np.errstate(over='ignore'):
+        x = (values + 0.0).view(np.uint64)
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def distinct_sketch(values, k=SKETCH_SIZE):
+    """k smallest distinct hashes of the values (mergeable: take the k smallest of a union)"""
+    return np.unique(_hash64(values))[:k]
+
+
+def distinct_estimate(sketch, k=SKETCH_SIZE):
+    if len(sketch) < k:
+        return int(len(sketch))  # Fewer than k distinct values: the sketch is exact
+    return int(round((k - 1) / (float(sketch[k - 1]) / 2.0 ** 64)))
+
+
+class ColumnStats:
+    """Distribution summary of one numeric column"""
+
+    __slots__ = ('rows', 'nulls', 'min', 'max', 'boundaries', 'counts', 'sketch', 'distinct')
+
+    def __init__(self, values):
+        present = np.sort(values[~np.isnan(values)])
+        self.rows = int(len(values))
+        self.nulls = self.rows - int(len(present))
+        self.sketch = distinct_sketch(present)
+        self.distinct = distinct_estimate(self.sketch)
+        if len(present):
+            self.min = float(present[0])
+            self.max = float(present[-1])
+            # Equi-depth: boundaries are quantiles, so every bucket holds about the same number of rows
+            self.boundaries = np.quantile(present, np.linspace(0, 1, HISTOGRAM_BUCKETS + 1), method='inverted_cdf')
+            edges = np.searchsorted(present, self.boundaries, side='left')
+            edges[-1] = len(present)  # The last bucket includes the maximum
+            self.counts = np.diff(edges)
+        else:
+            self.min = self.max = None
+            self.boundaries = np.array([])
+            self.counts = np.array([], dtype=np.int64)
+
+    def _equal(self, x):
+        non_null = self.rows - self.nulls
+        if self.min is None or x < self.min or x > self.max:
+            return 0.0
+        return non_null / max(self.distinct, 1)  # Uniform frequency assumption
+
+    def _below(self, x):
+        """Estimated number of values < x"""
+        if self.min is None or x <= self.min:
+            return 0.0
+        if x > self.max:
+            return float(self.rows - self.nulls)
+        i = int(np.searchsorted(self.boundaries, x, side='right')) - 1
+        i = min(i, len(self.counts) - 1)
+        low, high = self.boundaries[i], self.boundaries[i + 1]
+        fraction = (x - low) / (high - low) if high > low else 0.0
+        return float(self.counts[:i].sum() + self.counts[i] * fraction)
+
+    def estimate(self, operator, value=None, value2=None):
+        """Approximate number of rows matching a threshold"""
+        non_null = float(self.rows - self.nulls)
+        if operator == 'IS NULL':
+            return float(self.nulls)
+        if operator == 'IS NOT NULL':
+            return non_null
+        if value is None or value == '':
+            raise ValueError(f"Operator '{operator}' needs a value")
+        x = float(value)
+        if operator == '<':
+            rows = self._below(x)
+        elif operator == '<=':
+            rows = self._below(x) + self._equal(x)
+        elif operator == '>':
+            rows = non_null - self._below(x) - self._equal(x)
+        elif operator == '>=':
+            rows = non_null - self._below(x)
+        elif operator == '=':
+            rows = self._equal(x)
+        elif operator == '!=':
+            rows = non_null - self._equal(x)
+        elif operator == 'between':
+            if value2 is None or value2 == '':
+                raise ValueError("Operator 'between' needs two values")
+            y = float(value2)
+            rows = self._below(y) + self._equal(y) - self._below(x)
+        else:
+            raise ValueError(f"Unsupported operator for numeric estimates: {operator}")
+        return min(max(rows, 0.0), non_null)
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'nulls': self.nulls,
+            'null_fraction': round(self.nulls / self.rows, 6) if self.rows else None,
+            'min': self.min,
+            'max': self.max,
+            'distinct_estimate': self.distinct,
+            'histogram': {
+                'boundaries': [float(b) for b in self.boundaries],
+                'counts': [int(c) for c in self.counts]
+            }
+        }
+
+
+class VariableStatistics:
+    """Precomputed distributions of the numeric variables of every mapped table
+
+    Each table is summarized in one pass (a single SELECT of its numeric columns,
+    read in fetchmany batches): min/max, null fraction, an equi-depth histogram and
+    a k-minimum-values distinct-count sketch per column. Only tables reported as
+    changed (or older than max_age) are rebuilt, in the background, while the
+    previous statistics keep being served.
+    """
+
+    def __init__(self, get_connection, schema_catalog, max_age=86400):
+        self._get_connection = get_connection
+        self._schema_catalog = schema_catalog
+        self.max_age = max_age
+        self._tables = {}  # table name -> (built_at, build_seconds, {column: ColumnStats})
+        self._stale = set()
+        self._building = set()
+        self._lock = threading.Lock()
+        self._counters = {'builds': 0, 'build_errors': 0, 'estimates': 0}
+
+    def _numeric_columns(self, table_name):
+        columns = self._schema_catalog.columns(table_name)
+        if columns is None:
+            return None
+        return [name for name, data_type in columns if data_type == 'number']
+
+    def build(self, table_name):
+        """Summarize one table; returns False if the database or schema catalog was unavailable"""
+        columns = self._numeric_columns(table_name)
+        if columns is None:
+            return False
+        with self._lock:
+            self._stale.discard(table_name)
+        started = time.monotonic()
+        values = [[] for _ in columns]
+        if columns:
+            conn = self._get_connection()
+            if not conn:
+                return False
+            try:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(f"SELECT {', '.join(quote_identifier(c) for c in columns)} FROM {table_name}")
+                    while True:
+                        rows = cursor.fetchmany(10000)
+                        if not rows:
+                            break
+                        batch = np.array(
+                            [[np.nan if v is None else float(v) for v in row] for row in rows], dtype=np.float64
+                        ).reshape(len(rows), len(columns))
+                        for position in range(len(columns)):
+                            values[position].append(batch[:, position])
+                finally:
+                    cursor.close()
+            except Exception as e:
+                print(f"Error building variable statistics for {table_name}: {e}")
+                self._counters['build_errors'] += 1
+                with self._lock:
+                    self._stale.add(table_name)
+                return False
+            finally:
+                conn.close()
+
+        stats = {
+            name: ColumnStats(np.concatenate(parts) if parts else np.array([], dtype=np.float64))
+            for name, parts in zip(columns, values)
+        }
+        with self._lock:
+            self._tables[table_name] = (time.time(), time.monotonic() - started, stats)
+            self._counters['builds'] += 1
+        return True
+
+    def invalidate(self, tables):
+        """Mark statistics of changed tables for a background rebuild"""
+        tables = {t.lower() for t in tables}
+        with self._lock:
+            self._stale.update(name for name in self._tables if name.lower() in tables)
+
+    def _refresh_in_background(self, table_name):
+        with self._lock:
+            if table_name in self._building:
+                return
+            self._building.add(table_name)
+
+        def run():
+            try:
+                self.build(table_name)
+            finally:
+                with self._lock:
+                    self._building.discard(table_name)
+
+        threading.Thread(target=run, name='variable-stats-build', daemon=True).start()
+
+    def table(self, table_name):
+        """Column statistics of a table, built on first use; None if they cannot be built"""
+        entry = self._tables.get(table_name)
+        if entry is None:
+            if not self.build(table_name):
+                return None
+            entry = self._tables[table_name]
+        elif table_name in self._stale or time.time() - entry[0] > self.max_age:
+            self._refresh_in_background(table_name)
+        return entry
+
+    def describe(self, table_name):
+        entry = self.table(table_name)
+        if entry is None:
+            return None
+        built_at, build_seconds, stats = entry
+        return {
+            'built_at': built_at,
+            'build_seconds': round(build_seconds, 3),
+            'variables': {name: column.to_dict() for name, column in stats.items()}
+        }
+
+    def estimate(self, table_name, variable, operator, value=None, value2=None):
+        """Approximate rows of a table matching one threshold, or None if there are no statistics"""
+        entry = self.table(table_name)
+        if entry is None:
+            return None
+        stats = {name.lower(): column for name, column in entry[2].items()}
+        column = stats.get(str(variable).lower())
+        if column is None:
+            raise ValueError(f"No numeric statistics for {variable} in {table_name}")
+        rows = column.estimate(operator, value, value2)
+        self._counters['estimates'] += 1
+        return {
+            'estimated_rows': int(round(rows)),
+            'rows': column.rows,
+            'selectivity': round(rows / column.rows, 6) if column.rows else 0.0
+        }
+
+    def stats(self):
+        """Which tables have statistics, how large and how fresh they are"""
+        with self._lock:
+            return {
+                'tables': {
+                    name: {
+                        'variables': len(stats),
+                        'built_at': built_at,
+                        'build_seconds': round(build_seconds, 3)
+                    }
+                    for name, (built_at, build_seconds, stats) in self._tables.items()
+                },
+                'stale': sorted(self._stale),
+                'max_age': self.max_age,
+                **self._counters
+            }
@@ -0,0 +1,40 @@
+import numpy as np
+
+from timepoint_index import pid_array
+
+
+def wave_bits(count):
+    """Bit i set for waves[i]; row j of the result is the mask of the first j + 1 waves"""
+    return np.left_shift(np.uint64(1), np.arange(count, dtype=np.uint64))
+
+
+def wave_qualifying(pids, time_points, counted, waves):
+    """Which participants qualify at each wave and through each prefix of waves
+
+    pids/time_points/counted are the (pid, time_point) groups of the wave query.
+    A pid qualifies for a set of waves when it has a row at each of them and exactly
+    as many counted rows across them as there are waves, which is the HAVING clause
+    of the count query; presence is kept as one bitmask per pid. Returns
+    (unique pids, at_wave, through_wave) with bool arrays shaped (pids, len(waves)):
+    at_wave[:, i] is the filter at timepoint waves[i] alone and through_wave[:, i]
+    the filter at waves[0..i].
+    """
+    unique, pid_index = np.unique(pid_array(pids), return_inverse=True)
+    position = {tp: i for i, tp in enumerate(waves)}
+    column = np.array([position.get(int(tp), -1) for tp in time_points], dtype=np.int64)
+    rows = column >= 0
+    pid_index, column = pid_index[rows], column[rows]
+    counted = np.asarray(counted, dtype=np.int64)[rows]
+
+    bits = wave_bits(len(waves))
+    present = np.zeros(len(unique), dtype=np.uint64)
+    np.bitwise_or.at(present, pid_index, bits[column])
+    counts = np.zeros((len(unique), len(waves)), dtype=np.int64)
+    np.add.at(counts, (pid_index, column), counted)
+
+    at_wave = ((present[:, None] & bits) != 0) & (counts == 1)
+    prefixes = np.cumsum(bits, dtype=np.uint64)
+    through_wave = ((present[:, None] & prefixes) == prefixes) & (
+        np.cumsum(counts, axis=1) == np.arange(1, len(waves) + 1)
+    )
+    return unique, at_wave, through_wave